@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from sqlalchemy import delete, event, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .imaging import DERIVED_DIR, PHOTO_COLUMNS, remove_derivatives
+from .models import Photo, PhotoBlob
+from .uploads import StagedUpload, discard_upload, finish_upload, sync_upload
+
+# 按内容寻址的文件名：<sha256><扩展名>
+BLOB_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+# 超过这个时间仍未完成的 .part 临时文件视为中断的上传
+STALE_UPLOAD_SECONDS = 3600
+# session.info 中的键：事务提交后 / 未提交结束后才执行的文件操作
+COMMIT_FILES_KEY = "upload_files_on_commit"
+ROLLBACK_FILES_KEY = "upload_files_on_rollback"
+# 按文件名加的事务级咨询锁（双参数形式，与单参数的版本号分配锁不在同一空间）
+BLOB_LOCK_CLASS = 0x4C4A4246
+
+logger = logging.getLogger(__name__)
+# 提交 / 回滚后在后台删除文件的任务，保留引用直到完成
+_cleanup_tasks: set[asyncio.Task] = set()
+
+
+def _blob_lock(filename: str):
+    return select(func.pg_advisory_xact_lock(BLOB_LOCK_CLASS, func.hashtext(filename)))
+
+
+async def store_blob(
+    session: AsyncSession, staged: StagedUpload, upload_dir: Path, replacing: str | None = None
+) -> bool:
+    """
+    登记一次对 staged 内容的引用，返回是否是新内容（需要生成派生图，源文件用 staged.temp_path）。
+
+    临时文件在事务提交后才改名为 upload_dir/<sha256><扩展名>；未提交时删除临时文件，
+    新内容还会删除本事务生成的派生图。本事务持有该文件名的咨询锁直到结束，
+    其它事务释放同名文件时的删除会等到这之后再确认是否仍无人引用。
+    replacing 为随后要 release_blob 的旧文件名：先按文件名顺序锁住新旧两行，
+    两张照片互换文件时不会死锁。
+    """
+    stmt = insert(PhotoBlob).values(filename=staged.filename, size=staged.size, refcount=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PhotoBlob.filename], set_={"refcount": PhotoBlob.refcount + 1}
+    ).returning(PhotoBlob.refcount)
+    try:
+        await session.execute(_blob_lock(staged.filename))
+        if replacing is not None:
+            await _lock_blobs(session, [staged.filename, replacing])
+        res = await session.execute(stmt)
+        created = res.scalar_one() == 1
+        if created:
+            await asyncio.to_thread(sync_upload, staged)
+    except BaseException:
+        await asyncio.to_thread(discard_upload, staged)
+        raise
+    _on_commit(session, finish_upload, staged, upload_dir / staged.filename)
+    _on_rollback(session, discard_upload, staged)
+    if created:
+        _on_rollback(session, _schedule_removal, staged.filename, upload_dir)
+    return created
+
+
+async def _lock_blobs(session: AsyncSession, filenames: list[str]) -> None:
+    await session.execute(
+        select(PhotoBlob.filename)
+        .where(PhotoBlob.filename.in_(filenames))
+        .order_by(PhotoBlob.filename)
+        .with_for_update()
+    )
+
+
+def _remove_files(filename: str, upload_dir: Path) -> None:
+    (upload_dir / filename).unlink(missing_ok=True)
+    remove_derivatives(filename, upload_dir)
+
+
+async def remove_unreferenced(filename: str, upload_dir: Path) -> bool:
+    """
+    持有文件名咨询锁确认没有 blob 行也没有照片引用后，删除原图与派生图，返回是否删除。
+    与 store_blob 互斥：同一内容的新上传要么在此之前提交（这里看到新行，不删），
+    要么在此之后才登记（文件已删，提交后由它重新放置）。
+    """
+    async with SessionLocal() as session:
+        await session.execute(_blob_lock(filename))
+        res = await session.execute(select(PhotoBlob.filename).where(PhotoBlob.filename == filename))
+        if res.first() is None:
+            res = await session.execute(select(Photo.id).where(Photo.filename == filename).limit(1))
+        if res.first() is not None:
+            await session.commit()
+            return False
+        await asyncio.to_thread(_remove_files, filename, upload_dir)
+        await session.commit()
+    return True
+
+
+async def _remove_logged(filename: str, upload_dir: Path) -> None:
+    try:
+        await remove_unreferenced(filename, upload_dir)
+    except Exception as exc:
+        logger.warning("failed to remove unreferenced upload %s: %s", filename, exc)
+
+
+def _schedule_removal(filename: str, upload_dir: Path) -> None:
+    task = asyncio.get_running_loop().create_task(_remove_logged(filename, upload_dir))
+    _cleanup_tasks.add(task)
+    task.add_done_callback(_cleanup_tasks.discard)
+
+
+async def wait_file_cleanups() -> None:
+    """等待已排队的文件删除完成（进程退出前调用）；漏掉的由 gc-uploads 清理。"""
+    if _cleanup_tasks:
+        await asyncio.gather(*_cleanup_tasks, return_exceptions=True)
+
+
+async def release_blob(session: AsyncSession, filename: str, upload_dir: Path) -> bool:
+    """
+    照片不再引用 filename 时（已删除或换了文件，且已 flush）调用：引用计数减一，
+    归零时删除 blob 行，事务提交后再删除原图与派生图，返回文件是否会被删除。
+    没有 blob 行的旧文件只要没有其它照片引用也一并删除。
+    """
+    res = await session.execute(
+        update(PhotoBlob)
+        .where(PhotoBlob.filename == filename)
+        .values(refcount=PhotoBlob.refcount - 1)
+        .returning(PhotoBlob.refcount)
+    )
+    remaining = res.scalar_one_or_none()
+    if remaining is None:
+        res = await session.execute(select(func.count()).select_from(Photo).where(Photo.filename == filename))
+        if res.scalar_one():
+            return False
+    elif remaining > 0:
+        return False
+    else:
+        await session.execute(delete(PhotoBlob).where(PhotoBlob.filename == filename))
+    _on_commit(session, _schedule_removal, filename, upload_dir)
+    return True
+
+
+def _on_commit(session: AsyncSession, action, *args) -> None:
+    session.info.setdefault(COMMIT_FILES_KEY, []).append((action, args))
+
+
+def _on_rollback(session: AsyncSession, action, *args) -> None:
+    session.info.setdefault(ROLLBACK_FILES_KEY, []).append((action, args))
+
+
+def _run_file_actions(actions) -> None:
+    for action, args in actions:
+        try:
+            action(*args)
+        except OSError as exc:
+            logger.warning("failed to update upload files: %s", exc)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_file_changes(session: Session) -> None:
+    # 提交时行锁与咨询锁都已释放。这里只做改名（单次 rename，很快，响应返回前图片即可访问）
+    # 和排队删除；删除在后台任务里重新加锁、确认无人引用后才在线程中执行
+    session.info.pop(ROLLBACK_FILES_KEY, None)
+    _run_file_actions(session.info.pop(COMMIT_FILES_KEY, ()))
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_file_changes(session: Session, transaction) -> None:
+    # 未提交就结束（回滚或会话关闭）：删除暂存的上传，新内容的派生图排队删除，待删除的旧文件保留
+    if transaction.parent is not None:
+        return
+    session.info.pop(COMMIT_FILES_KEY, None)
+    _run_file_actions(session.info.pop(ROLLBACK_FILES_KEY, ()))
+
+
+async def reuse_derivatives(session: AsyncSession, photo: Photo) -> bool:
+    """重复上传时从引用同一文件的其它照片复制尺寸、主色、BlurHash 与派生图列表，不再重新生成。"""
+    query = select(Photo).where(Photo.filename == photo.filename, Photo.variants.is_not(None))
+    if photo.id is not None:
+        query = query.where(Photo.id != photo.id)
+    res = await session.execute(query.limit(1))
+    source = res.scalars().first()
+    if source is None:
+        return False
+    for name in PHOTO_COLUMNS:
+        setattr(photo, name, getattr(source, name))
+    return True
+
+
+@dataclass
+class GcResult:
+    recounted: int = 0
+    files: int = 0
+    derived: int = 0
+    temp: int = 0
+
+
+def _sweep(upload_dir: Path, referenced: set[str], result: GcResult) -> None:
+    if not upload_dir.is_dir():
+        return
+    stale_before = time.time() - STALE_UPLOAD_SECONDS
+    for path in upload_dir.iterdir():
+        if not path.is_file():
+            continue
+        name = path.name
+        if name.startswith(".upload-") and name.endswith(".part"):
+            if path.stat().st_mtime < stale_before:
+                path.unlink(missing_ok=True)
+                result.temp += 1
+        elif not name.startswith(".") and name not in referenced:
+            path.unlink(missing_ok=True)
+            result.files += 1
+
+    derived_dir = upload_dir / DERIVED_DIR
+    if not derived_dir.is_dir():
+        return
+    stems = {Path(name).stem for name in referenced}
+    for path in derived_dir.iterdir():
+        # 派生图命名为 <原图主名>-<尺寸>.<格式>
+        if path.is_file() and path.name.rsplit("-", 1)[0] not in stems:
+            path.unlink(missing_ok=True)
+            result.derived += 1
+
+
+async def collect_garbage(session: AsyncSession, upload_dir: Path) -> GcResult:
+    """
+    按 photo 表校正 photo_blob 的引用计数，并删除 upload_dir 中没有照片引用的原图、
+    派生图与中断上传留下的临时文件。
+
+    整个过程锁住 photo_blob 表：正在进行的上传与删除会在各自事务提交后才被看到，
+    校正期间的新写入则等待本事务结束，扫描到的文件与数据库状态一致。
+    """
+    result = GcResult()
+    await session.execute(text("LOCK TABLE photo_blob IN SHARE ROW EXCLUSIVE MODE"))
+    res = await session.execute(select(Photo.filename, func.count()).group_by(Photo.filename))
+    counts = dict(res.all())
+    res = await session.execute(select(PhotoBlob.filename, PhotoBlob.refcount))
+    blobs = dict(res.all())
+
+    for filename, refcount in blobs.items():
+        actual = counts.get(filename, 0)
+        if actual == refcount:
+            continue
+        if actual == 0:
+            await session.execute(delete(PhotoBlob).where(PhotoBlob.filename == filename))
+        else:
+            await session.execute(
+                update(PhotoBlob).where(PhotoBlob.filename == filename).values(refcount=actual)
+            )
+        result.recounted += 1
+    for filename, actual in counts.items():
+        if filename in blobs or not BLOB_NAME.match(filename):
+            continue
+        path = upload_dir / filename
+        size = path.stat().st_size if path.is_file() else 0
+        session.add(PhotoBlob(filename=filename, size=size, refcount=actual))
+        result.recounted += 1
+    await session.flush()
+
+    await asyncio.to_thread(_sweep, upload_dir, set(counts), result)
+    await session.commit()
+    return result
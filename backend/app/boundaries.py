@@ -0,0 +1,125 @@
+import json
+import logging
+import math
+from dataclasses import dataclass, field
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 网格索引的格子边长（度）与多边形边按纬度分桶的宽度（度）
+GRID_SIZE = 1.0
+BAND_SIZE = 0.05
+
+Edge = tuple[float, float, float, float]
+
+
+@dataclass
+class Ring:
+    """
+    多边形的一个环。边按纬度分桶，射线法只需检查与查询点同一纬度带内的少量边。
+    """
+
+    bbox: tuple[float, float, float, float]
+    bands: dict[int, list[Edge]] = field(default_factory=dict)
+
+    @classmethod
+    def from_coords(cls, coords: list[list[float]]) -> "Ring":
+        xs = [p[0] for p in coords]
+        ys = [p[1] for p in coords]
+        ring = cls(bbox=(min(xs), min(ys), max(xs), max(ys)))
+        for i in range(len(coords) - 1):
+            x1, y1 = coords[i][0], coords[i][1]
+            x2, y2 = coords[i + 1][0], coords[i + 1][1]
+            if y1 == y2:
+                continue
+            edge = (x1, y1, x2, y2)
+            for band in range(math.floor(min(y1, y2) / BAND_SIZE), math.floor(max(y1, y2) / BAND_SIZE) + 1):
+                ring.bands.setdefault(band, []).append(edge)
+        return ring
+
+    def contains(self, x: float, y: float) -> bool:
+        min_x, min_y, max_x, max_y = self.bbox
+        if not (min_x <= x <= max_x and min_y <= y <= max_y):
+            return False
+        inside = False
+        for x1, y1, x2, y2 in self.bands.get(math.floor(y / BAND_SIZE), ()):
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+        return inside
+
+
+@dataclass
+class Region:
+    adcode: str
+    name: str
+    level: str
+    polygons: list[tuple[Ring, list[Ring]]]
+
+    def contains(self, x: float, y: float) -> bool:
+        for outer, holes in self.polygons:
+            if outer.contains(x, y) and not any(hole.contains(x, y) for hole in holes):
+                return True
+        return False
+
+
+class AdcodeResolver:
+    """
+    本地行政区边界的点查询（point-in-polygon），用于离线把坐标换算成 adcode。
+
+    多边形按外包框登记到 1° 网格，查询时先取所在格子的候选，再做外包框与射线法判断。
+    边界数据是前端地图使用的同一份 GeoJSON，精度为市级（直辖市为区级）。
+    """
+
+    def __init__(self, regions: list[Region]):
+        self.regions = regions
+        self._grid: dict[tuple[int, int], list[Region]] = {}
+        for region in regions:
+            cells = set()
+            for outer, _ in region.polygons:
+                min_x, min_y, max_x, max_y = outer.bbox
+                for gx in range(math.floor(min_x / GRID_SIZE), math.floor(max_x / GRID_SIZE) + 1):
+                    for gy in range(math.floor(min_y / GRID_SIZE), math.floor(max_y / GRID_SIZE) + 1):
+                        cells.add((gx, gy))
+            for cell in cells:
+                self._grid.setdefault(cell, []).append(region)
+
+    @classmethod
+    def from_geojson(cls, path: Path) -> "AdcodeResolver":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        regions = []
+        for feature in data.get("features", []):
+            props = feature.get("properties") or {}
+            geometry = feature.get("geometry") or {}
+            adcode = str(props.get("adcode") or "").strip()
+            if not adcode or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+                continue
+            polygons = geometry["coordinates"]
+            if geometry["type"] == "Polygon":
+                polygons = [polygons]
+            rings = [
+                (Ring.from_coords(polygon[0]), [Ring.from_coords(hole) for hole in polygon[1:]])
+                for polygon in polygons
+                if polygon and len(polygon[0]) >= 4
+            ]
+            regions.append(Region(adcode, props.get("name") or "", props.get("level") or "", rings))
+        return cls(regions)
+
+    def lookup(self, lat: float, lng: float) -> Region | None:
+        cell = (math.floor(lng / GRID_SIZE), math.floor(lat / GRID_SIZE))
+        for region in self._grid.get(cell, ()):
+            if region.contains(lng, lat):
+                return region
+        return None
+
+
+def load_adcode_resolver(path: Path) -> AdcodeResolver | None:
+    """加载边界数据；文件不存在或解析失败时返回 None，逆地理编码退回网络请求。"""
+    if not path.is_file():
+        logger.warning("boundary file %s not found, offline adcode lookup disabled", path)
+        return None
+    try:
+        return AdcodeResolver.from_geojson(path)
+    except (OSError, ValueError, KeyError, TypeError, IndexError) as exc:
+        logger.warning("failed to load boundary file %s: %s", path, exc)
+        return None
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+from .config import get_settings
+from .singleflight import SingleFlight
+
+try:  # 可选依赖：配置 RESPONSE_CACHE_REDIS_URL 时作为多 worker 共享的二级缓存
+    from redis import asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class RedisCacheBackend:
+    """共享缓存后端；键中已包含数据版本号，旧版本条目依靠 TTL 过期即可。"""
+
+    def __init__(self, url: str, ttl: int):
+        self.client = redis_asyncio.from_url(url)
+        self.ttl = ttl
+
+    async def get(self, key: str) -> bytes | None:
+        try:
+            return await self.client.get(f"lj:resp:{key}")
+        except Exception as exc:
+            logger.warning("response cache backend get failed: %s", exc)
+            return None
+
+    async def set(self, key: str, value: bytes) -> None:
+        try:
+            await self.client.set(f"lj:resp:{key}", value, ex=self.ttl)
+        except Exception as exc:
+            logger.warning("response cache backend set failed: %s", exc)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class ResponseCache:
+    """
+    进程内响应缓存：按条目数与总字节数做 LRU 淘汰，可叠加共享后端。
+    同一个键的并发未命中只触发一次计算（single-flight），其余请求等待同一结果。
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, backend: RedisCacheBackend | None = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_local(self, key: str) -> bytes | None:
+        body = self._entries.get(key)
+        if body is not None:
+            self._entries.move_to_end(key)
+        return body
+
+    def _put_local(self, key: str, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = body
+        self._size += len(body)
+        while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[bytes]]) -> bytes:
+        body = self._get_local(key)
+        if body is not None:
+            self.hits += 1
+            return body
+        # 正在计算的请求由当前请求等待复用，同样算作命中
+        if self._flights.pending(key):
+            self.hits += 1
+        else:
+            self.misses += 1
+        return await self._flights.run(key, lambda: self._load(key, compute))
+
+    async def _load(self, key: str, compute: Callable[[], Awaitable[bytes]]) -> bytes:
+        body = await self.backend.get(key) if self.backend else None
+        if body is None:
+            body = await compute()
+            if self.backend:
+                await self.backend.set(key, body)
+        self._put_local(key, body)
+        return body
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+
+    async def close(self) -> None:
+        if self.backend:
+            await self.backend.close()
+            self.backend = None
+
+
+def _build_cache() -> ResponseCache:
+    backend = None
+    if settings.response_cache_redis_url:
+        if redis_asyncio is None:
+            logger.warning("RESPONSE_CACHE_REDIS_URL is set but the redis package is not installed")
+        else:
+            backend = RedisCacheBackend(settings.response_cache_redis_url, settings.response_cache_ttl)
+    return ResponseCache(settings.response_cache_max_entries, settings.response_cache_max_bytes, backend)
+
+
+response_cache = _build_cache()
+
+
+def cache_key(endpoint: str, params: dict[str, Any], version: int) -> str:
+    normalized = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return f"{endpoint}:v{version}:{normalized}"
+
+
+def make_etag(key: str) -> str:
+    return f'W/"{hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {tag.strip() for tag in header.split(",")}
+    return "*" in candidates or etag in candidates or etag.removeprefix("W/") in candidates
+
+
+async def cached_response(
+    request: Request,
+    endpoint: str,
+    params: dict[str, Any],
+    version: int,
+    render: Callable[[], Awaitable[bytes]],
+    media_type: str,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """
+    按 (endpoint, 规范化参数, 数据版本) 缓存已序列化的响应体并附带 ETag；
+    客户端携带匹配的 If-None-Match 时直接返回 304，不做任何计算。
+    """
+    key = cache_key(endpoint, params, version)
+    etag = make_etag(key)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", **(headers or {})}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    body = await response_cache.get_or_compute(key, render)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+async def cached_json_response(
+    request: Request,
+    endpoint: str,
+    params: dict[str, Any],
+    version: int,
+    compute: Callable[[], Awaitable[BaseModel]],
+) -> Response:
+    async def render() -> bytes:
+        return (await compute()).model_dump_json().encode("utf-8")
+
+    return await cached_response(request, endpoint, params, version, render, "application/json")
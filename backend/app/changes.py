@@ -0,0 +1,242 @@
+import asyncio
+import json
+import logging
+
+from sqlalchemy import delete, event, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .config import get_settings
+from .database import SessionLocal
+from .map_version import MAP_VERSION_KEY, get_map_version, publish_versions, version_key
+from .models import ChangeLog, MetaKV, PendingChange
+
+# 已被压缩清理的最高版本号；since 低于它的客户端只能拿全量快照
+CHANGE_LOG_FLOOR_KEY = "change_log_floor"
+# 每产生这么多个版本做一次压缩
+COMPACT_EVERY = 200
+# 每条变更分配版本号后广播到该频道，/api/events 据此向客户端推送
+CHANGES_CHANNEL = "lovejournal_changes"
+# 串行化版本号分配的事务级咨询锁
+SEQUENCER_LOCK_ID = 0x4C4A5351
+SEQUENCE_BATCH = 500
+# session.info 中的标记：本事务登记过变更，提交后需要分配版本号
+PENDING_CHANGES_KEY = "pending_changes"
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+async def record_change(
+    session: AsyncSession, kind: str, item_id: int, op: str, facets: set[str]
+) -> bool:
+    """
+    在写事务内登记一条变更（op 为 "upsert" 或 "delete"），facets 为空（派生数据没有
+    实际变化）时什么都不做。只插入 pending_change，不修改版本号等共享行，并发写入互不等待；
+    调用方用 commit_changes 提交，版本号在提交后分配。
+    """
+    if not facets:
+        return False
+    session.add(PendingChange(kind=kind, item_id=item_id, op=op, facets=",".join(sorted(facets))))
+    session.info[PENDING_CHANGES_KEY] = True
+    return True
+
+
+async def commit_changes(session: AsyncSession) -> int | None:
+    """
+    提交写事务；登记过变更时等 change_sequencer 为其分配版本号后返回，并返回分配后的全局版本号
+    （没有登记变更或分配失败时为 None）。同一进程内并发的写入合并为一次分配，分配失败不影响
+    已提交的写入，遗留的变更在下一轮补做。
+
+    新版本在本进程内立即可见；其他 uvicorn worker 要等 NOTIFY 到达才更新内存中的版本号，
+    这段时间里发往其他 worker 的读请求（如 /api/changes?since=）仍按旧版本应答。需要
+    “写后读”一致的调用方应把返回的版本号带给客户端，客户端据此判断结果是否已包含自己的写入。
+    """
+    await session.commit()
+    if session.info.pop(PENDING_CHANGES_KEY, False):
+        return await change_sequencer.flush(session)
+    return None
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_changes(session: Session) -> None:
+    session.info.pop(PENDING_CHANGES_KEY, None)
+
+
+async def _stored_version(session: AsyncSession) -> int:
+    value = await session.scalar(select(MetaKV.value).where(MetaKV.key == MAP_VERSION_KEY))
+    try:
+        return int(value or 0)
+    except ValueError:
+        return 0
+
+
+async def sequence_changes(session: AsyncSession) -> int:
+    """
+    为已提交的 pending_change 分配全局版本号：移入 change_log，把涉及的分量版本设为
+    其最后一次变化时的版本号，并 NOTIFY 广播。在给定会话上开启独立事务并提交，返回分配后的全局版本号。
+
+    只有这个短事务修改 map_version 与分量行，由事务级咨询锁串行；版本号在锁内分配并随
+    事务一起提交，所以按提交顺序递增：客户端看到版本 v 时，不大于 v 的变更都已可见。
+    """
+    while True:
+        await session.execute(select(func.pg_advisory_xact_lock(SEQUENCER_LOCK_ID)))
+        current = await _stored_version(session)
+        res = await session.execute(select(PendingChange).order_by(PendingChange.id).limit(SEQUENCE_BATCH))
+        pending = res.scalars().all()
+        if not pending:
+            await session.commit()
+            return current
+
+        versions: dict[str, int] = {}
+        payloads = []
+        for offset, change in enumerate(pending, 1):
+            version = current + offset
+            session.add(ChangeLog(version=version, kind=change.kind, item_id=change.item_id, op=change.op))
+            for facet in change.facets.split(","):
+                versions[version_key(change.kind, facet)] = version
+            payloads.append(
+                json.dumps({"kind": change.kind, "id": change.item_id, "op": change.op, "version": version})
+            )
+        latest = current + len(pending)
+        versions[MAP_VERSION_KEY] = latest
+        await publish_versions(session, versions)
+        await session.execute(delete(PendingChange).where(PendingChange.id.in_([c.id for c in pending])))
+        await session.execute(
+            text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+            {"channel": CHANGES_CHANNEL, "payloads": payloads},
+        )
+        if latest // COMPACT_EVERY > current // COMPACT_EVERY:
+            await compact_change_log(session, latest - settings.change_log_retention)
+        await session.commit()
+        if len(pending) < SEQUENCE_BATCH:
+            return latest
+
+
+class ChangeSequencer:
+    """
+    每个进程一个的版本号分配任务。写入提交后调用 flush 唤醒它并等待下一轮分配完成，
+    一轮处理所有已提交的 pending_change，并发写入只排一次咨询锁；空闲时定期补做
+    写入进程在提交之后、分配之前退出时遗留的变更。
+
+    多 worker 部署时每个进程各有一个，靠咨询锁串行；新版本号经 NOTIFY 传到其他进程之前，
+    那些进程上的读请求看到的仍是旧版本，见 commit_changes。
+    """
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._session_factory = SessionLocal
+        self._wake = asyncio.Event()
+        self._waiters: list[asyncio.Future] = []
+
+    def start(self, session_factory=SessionLocal) -> None:
+        if self._task is None:
+            self._session_factory = session_factory
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._release(self._waiters)
+        self._waiters = []
+
+    async def flush(self, session: AsyncSession) -> int | None:
+        """
+        等待本次提交之前的变更分配好版本号，返回该轮分配后的全局版本号（分配失败时为 None）。
+        任务未启动（命令行工具）时直接在 session 上分配。
+        """
+        if self._task is None:
+            return await self._sequence(session)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._wake.set()
+        return await asyncio.shield(waiter)
+
+    @staticmethod
+    def _release(waiters: list[asyncio.Future], version: int | None = None) -> None:
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(version)
+
+    async def _sequence(self, session: AsyncSession) -> int | None:
+        try:
+            return await sequence_changes(session)
+        except Exception as exc:
+            logger.warning("change sequencing failed: %s", exc)
+            await session.rollback()
+            return None
+
+    async def _run(self) -> None:
+        poll = settings.change_sequence_poll_seconds
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), poll)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            # 本轮开始前登记的等待者，其变更都已提交，本轮一定能处理到
+            waiters, self._waiters = self._waiters, []
+            version = None
+            try:
+                async with self._session_factory() as session:
+                    version = await self._sequence(session)
+            except Exception as exc:
+                logger.warning("change sequencing failed: %s", exc)
+            finally:
+                self._release(waiters, version)
+
+
+change_sequencer = ChangeSequencer()
+
+
+async def get_change_log_floor(session: AsyncSession) -> int:
+    value = await session.scalar(select(MetaKV.value).where(MetaKV.key == CHANGE_LOG_FLOOR_KEY))
+    try:
+        return int(value or 0)
+    except ValueError:
+        return 0
+
+
+async def ensure_change_log_floor(session: AsyncSession) -> None:
+    """
+    首次启用变更日志时，把下限设为当前版本：此前的修改没有日志，更早的 since 只能全量同步。
+    """
+    current = await get_map_version(session)
+    stmt = insert(MetaKV).values(key=CHANGE_LOG_FLOOR_KEY, value=str(current))
+    await session.execute(stmt.on_conflict_do_nothing(index_elements=[MetaKV.key]))
+    await session.commit()
+
+
+async def compact_change_log(session: AsyncSession, up_to_version: int) -> None:
+    """删除 version <= up_to_version 的记录并抬高下限，不提交，由调用方所在事务负责。"""
+    if up_to_version <= await get_change_log_floor(session):
+        return
+    await session.execute(delete(ChangeLog).where(ChangeLog.version <= up_to_version))
+    stmt = insert(MetaKV).values(key=CHANGE_LOG_FLOOR_KEY, value=str(up_to_version))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MetaKV.key], set_={"value": str(up_to_version), "updated_at": func.now()}
+    )
+    await session.execute(stmt)
+
+
+async def changes_since(session: AsyncSession, since: int) -> list[ChangeLog] | None:
+    """
+    返回 since 之后每个条目的最后一次变更（同一条目多次修改只保留最新一条）。
+    日志已压缩到 since 之后时返回 None，调用方应改为全量快照。
+    """
+    if since < await get_change_log_floor(session):
+        return None
+    latest = (
+        select(ChangeLog)
+        .where(ChangeLog.version > since)
+        .order_by(ChangeLog.kind, ChangeLog.item_id, ChangeLog.version.desc())
+        .distinct(ChangeLog.kind, ChangeLog.item_id)
+    )
+    res = await session.execute(latest)
+    return sorted(res.scalars().all(), key=lambda change: change.version)
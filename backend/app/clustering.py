@@ -0,0 +1,148 @@
+import asyncio
+import math
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from .singleflight import SingleFlight
+
+MAX_ZOOM = 18
+# 聚合网格边长（屏幕像素），按 256px 瓦片换算为经纬度
+CELL_PIXELS = 60
+SAMPLE_SIZE = 3
+
+
+BBox = tuple[float, float, float, float]
+
+
+def split_bbox(bbox: BBox) -> list[BBox]:
+    """minLng > maxLng 表示视口跨越 180° 经线，拆成东西两段。"""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    if min_lng <= max_lng:
+        return [bbox]
+    return [(min_lng, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lng, max_lat)]
+
+
+def cell_size(zoom: int) -> float:
+    return 360.0 / (256 * 2**zoom) * CELL_PIXELS
+
+
+@dataclass
+class ClusterPoint:
+    kind: str
+    id: int
+    lat: float
+    lng: float
+
+
+@dataclass
+class Cluster:
+    lat_sum: float = 0.0
+    lng_sum: float = 0.0
+    count: int = 0
+    kinds: dict[str, int] = field(default_factory=dict)
+    samples: list[tuple[str, int]] = field(default_factory=list)
+    # 成员点的外包框，视口过滤按它与视口是否相交判断
+    min_lat: float = math.inf
+    min_lng: float = math.inf
+    max_lat: float = -math.inf
+    max_lng: float = -math.inf
+
+    @property
+    def lat(self) -> float:
+        return self.lat_sum / self.count
+
+    @property
+    def lng(self) -> float:
+        return self.lng_sum / self.count
+
+    def add(self, point: ClusterPoint) -> None:
+        self.lat_sum += point.lat
+        self.lng_sum += point.lng
+        self.count += 1
+        self.min_lat = min(self.min_lat, point.lat)
+        self.min_lng = min(self.min_lng, point.lng)
+        self.max_lat = max(self.max_lat, point.lat)
+        self.max_lng = max(self.max_lng, point.lng)
+        self.kinds[point.kind] = self.kinds.get(point.kind, 0) + 1
+        if len(self.samples) < SAMPLE_SIZE:
+            self.samples.append((point.kind, point.id))
+
+    def intersects(self, bbox: BBox) -> bool:
+        min_lng, min_lat, max_lng, max_lat = bbox
+        return (
+            self.min_lng <= max_lng
+            and self.max_lng >= min_lng
+            and self.min_lat <= max_lat
+            and self.max_lat >= min_lat
+        )
+
+
+def _grid(points: list[ClusterPoint], zoom: int) -> list[Cluster]:
+    size = cell_size(zoom)
+    cells: dict[tuple[int, int], Cluster] = {}
+    for point in points:
+        key = (math.floor(point.lng / size), math.floor(point.lat / size))
+        cluster = cells.get(key)
+        if cluster is None:
+            cluster = cells[key] = Cluster()
+        cluster.add(point)
+    return list(cells.values())
+
+
+class ClusterIndex:
+    """
+    某个数据版本 + 筛选条件下全部坐标点的网格聚合。
+
+    每个缩放级别首次被请求时计算一次并保留，之后同版本的请求只做视口过滤。
+    points 需按时间倒序传入，代表条目因此取每个网格中最新的几条。
+    """
+
+    def __init__(self, points: list[ClusterPoint]):
+        self.points = points
+        self._levels: dict[int, list[Cluster]] = {}
+        self._lock = asyncio.Lock()
+
+    async def level(self, zoom: int) -> list[Cluster]:
+        zoom = max(0, min(MAX_ZOOM, zoom))
+        clusters = self._levels.get(zoom)
+        if clusters is None:
+            async with self._lock:
+                clusters = self._levels.get(zoom)
+                if clusters is None:
+                    clusters = await asyncio.to_thread(_grid, self.points, zoom)
+                    self._levels[zoom] = clusters
+        return clusters
+
+    async def query(self, zoom: int, bbox: BBox | None = None) -> list[Cluster]:
+        clusters = await self.level(zoom)
+        if not bbox:
+            return clusters
+        # 按成员外包框相交判断：重心落在视口外、但有成员在视口内的聚合在边缘不会消失
+        ranges = split_bbox(bbox)
+        return [c for c in clusters if any(c.intersects(r) for r in ranges)]
+
+
+class ClusterIndexCache:
+    """按 (数据版本, 筛选条件) 缓存 ClusterIndex，版本号变化后旧条目自然被 LRU 淘汰。"""
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, ClusterIndex] = OrderedDict()
+        self._flights = SingleFlight()
+
+    async def get(self, key: tuple, loader) -> ClusterIndex:
+        index = self._entries.get(key)
+        if index is not None:
+            self._entries.move_to_end(key)
+            return index
+        return await self._flights.run(key, lambda: self._build(key, loader))
+
+    async def _build(self, key: tuple, loader) -> ClusterIndex:
+        index = ClusterIndex(await loader())
+        self._entries[key] = index
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return index
+
+
+cluster_cache = ClusterIndexCache()
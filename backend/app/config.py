@@ -7,6 +7,10 @@ from pydantic_settings import BaseSettings
 from pydantic_settings import SettingsConfigDict
 
 
+# 前端地图使用的行政区边界，后端离线逆地理编码复用同一份数据
+DEFAULT_BOUNDARIES_PATH = Path(__file__).resolve().parents[2] / "frontend" / "public" / "geo" / "china-provinces.geojson"
+
+
 class Settings(BaseSettings):
     """Application configuration loaded from environment variables."""
 
@@ -23,9 +27,46 @@ class Settings(BaseSettings):
         env="DATABASE_URL",
     )
     upload_dir: Path = Field(default_factory=lambda: Path(os.getenv("UPLOAD_DIR", "uploads")))
+    upload_max_bytes: int = Field(30 * 1024 * 1024, env="UPLOAD_MAX_BYTES")
+    # 生成缩略图的进程池大小
+    image_workers: int = Field(2, env="IMAGE_WORKERS")
     amap_key: str = Field("fd67dbc2f43a792a5a2aa190e3a49d92", env="AMAP_WEB_KEY")
     amap_js_code: str = Field("9a6053273e69e199acb91aae8add03c9", env="AMAP_JS_CODE")
+    amap_base_url: str = Field("https://restapi.amap.com", env="AMAP_BASE_URL")
+    amap_timeout: float = Field(5.0, env="AMAP_TIMEOUT")
+    amap_max_connections: int = Field(20, env="AMAP_MAX_CONNECTIONS")
+    amap_max_keepalive: int = Field(10, env="AMAP_MAX_KEEPALIVE")
+    amap_http2: bool = Field(True, env="AMAP_HTTP2")
+    geo_boundaries_path: Path = Field(
+        default_factory=lambda: Path(os.getenv("GEO_BOUNDARIES_PATH", DEFAULT_BOUNDARIES_PATH))
+    )
+    # 本地边界只到市级（直辖市到区级）；开启后非区级结果再请求高德取更细的 adcode
+    geo_network_regeo: bool = Field(False, env="GEO_NETWORK_REGEO")
+    geo_max_concurrency: int = Field(4, env="GEO_MAX_CONCURRENCY")
+    geo_max_qps: float = Field(10.0, env="GEO_MAX_QPS")
+    # 连续失败（含超时）次数达到阈值后熔断，冷却后半开探测
+    geo_breaker_failures: int = Field(5, env="GEO_BREAKER_FAILURES")
+    geo_breaker_reset_seconds: float = Field(30.0, env="GEO_BREAKER_RESET_SECONDS")
+    # 一次保存（后台任务中一个条目的解析）花在地理编码上的总时间上限
+    geo_deadline_seconds: float = Field(8.0, env="GEO_DEADLINE_SECONDS")
+    geo_cache_max_entries: int = Field(10000, env="GEO_CACHE_MAX_ENTRIES")
+    geo_cache_ttl: int = Field(30 * 24 * 3600, env="GEO_CACHE_TTL")
+    geo_cache_negative_ttl: int = Field(600, env="GEO_CACHE_NEGATIVE_TTL")
+    # 后台地理编码任务：每进程协程数、最多尝试次数、重试退避基数（秒，按次数翻倍）
+    geo_job_workers: int = Field(2, env="GEO_JOB_WORKERS")
+    geo_job_max_attempts: int = Field(5, env="GEO_JOB_MAX_ATTEMPTS")
+    geo_job_retry_base: int = Field(60, env="GEO_JOB_RETRY_BASE")
+    geo_job_lease_seconds: int = Field(120, env="GEO_JOB_LEASE_SECONDS")
+    geo_job_poll_seconds: int = Field(30, env="GEO_JOB_POLL_SECONDS")
     cors_origins: str = Field("*", env="CORS_ORIGINS")
+    response_cache_max_entries: int = Field(512, env="RESPONSE_CACHE_MAX_ENTRIES")
+    response_cache_max_bytes: int = Field(64 * 1024 * 1024, env="RESPONSE_CACHE_MAX_BYTES")
+    response_cache_redis_url: str = Field("", env="RESPONSE_CACHE_REDIS_URL")
+    response_cache_ttl: int = Field(3600, env="RESPONSE_CACHE_TTL")
+    change_log_retention: int = Field(5000, env="CHANGE_LOG_RETENTION")
+    # 写入提交后唤醒本进程的版本号分配任务；空闲时按此间隔补做进程退出前遗留的变更
+    change_sequence_poll_seconds: int = Field(5, env="CHANGE_SEQUENCE_POLL_SECONDS")
+    events_heartbeat_seconds: int = Field(15, env="EVENTS_HEARTBEAT_SECONDS")
 
 
 @lru_cache()
@@ -10,6 +10,16 @@ from .models import User
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 
+async def user_from_token(session: AsyncSession, token: str | None) -> User | None:
+    payload = decode_token(token) if token else None
+    if not payload:
+        return None
+    user_id: int | None = payload.get("sub")
+    if not user_id:
+        return None
+    return await auth.get_user_by_id(session, int(user_id))
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)
 ) -> User:
@@ -18,13 +28,7 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    payload = decode_token(token)
-    if not payload:
-        raise credentials_exception
-    user_id: int | None = payload.get("sub")
-    if not user_id:
-        raise credentials_exception
-    user = await auth.get_user_by_id(session, int(user_id))
+    user = await user_from_token(session, token)
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import logging
+
+from .changes import CHANGES_CHANNEL
+from .map_version import MapVersionWatcher
+
+logger = logging.getLogger(__name__)
+
+# 每个连接最多积压的事件数，超过后改为让该连接从变更日志补齐
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class Subscriber:
+    """
+    一个 SSE 连接的事件队列。
+
+    队列里放变更字典；放入 None 表示“可能漏了事件”（队列溢出或监听连接重连），
+    消费方应从变更日志按上次发送的版本号补齐。
+    """
+
+    def __init__(self):
+        self.queue: asyncio.Queue[dict | None] = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def push(self, change: dict) -> None:
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            self.request_resync()
+
+    def request_resync(self) -> None:
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class EventBroker:
+    """
+    进程内的变更广播。
+
+    变更分配版本号后通过 NOTIFY 发布，每个 worker 的监听连接收到后分发给本进程内的全部
+    SSE 连接，因此多 worker 部署下任何一个 worker 的写入都能推送到所有客户端。
+    """
+
+    def __init__(self):
+        self._subscribers: set[Subscriber] = set()
+
+    def attach(self, watcher: MapVersionWatcher) -> None:
+        watcher.listen(CHANGES_CHANNEL, self._on_notify)
+        watcher.on_reconnect(self.request_resync)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber()
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+
+    def publish(self, change: dict) -> None:
+        for subscriber in self._subscribers:
+            subscriber.push(change)
+
+    def request_resync(self) -> None:
+        for subscriber in self._subscribers:
+            subscriber.request_resync()
+
+    def _on_notify(self, payload: str) -> None:
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            logger.warning("invalid change notification: %r", payload)
+            return
+        self.publish(change)
+
+
+event_broker = EventBroker()
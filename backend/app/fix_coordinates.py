@@ -3,6 +3,7 @@
 
 用于修复数据库中可能存储错误的经纬度数据。
 问题：之前的代码可能将经度存为lat，纬度存为lng。
+修复后的记录会同步到 timeline_item 投影并登记变更，地图与时间线的缓存随之失效。
 
 运行方法：
 cd backend
@@ -22,8 +23,9 @@ import os
 # 确保可以导入 app 模块
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from app.changes import commit_changes, record_change
 from app.config import get_settings
-from app.models import Entry, KeyDate, Photo
+from app.indexing import ITEM_MODELS, index_item
 
 settings = get_settings()
 
@@ -50,7 +52,7 @@ async def analyze_and_fix_coordinates(dry_run: bool = True):
         need_fix_count = 0
         fixed_count = 0
         
-        for Model in [Entry, KeyDate, Photo]:
+        for kind, Model in ITEM_MODELS.items():
             table_name = Model.__tablename__
             print(f"\n检查 {table_name} 表...")
             
@@ -110,6 +112,9 @@ async def analyze_and_fix_coordinates(dry_run: bool = True):
                         # 交换 lat 和 lng
                         record.lat = lng
                         record.lng = lat
+                        # 同步投影、区域计数与版本号，否则 /api/map 与 /api/timeline 仍返回旧坐标
+                        facets = await index_item(session, kind, record)
+                        await record_change(session, kind, record.id, "upsert", facets)
                         fixed_count += 1
                         print(f"    ✅ 已修复: lat={record.lat}, lng={record.lng}")
             
@@ -122,7 +127,7 @@ async def analyze_and_fix_coordinates(dry_run: bool = True):
         print(f"需要修复: {need_fix_count}")
         
         if not dry_run and fixed_count > 0:
-            await session.commit()
+            await commit_changes(session)
             print(f"✅ 已修复: {fixed_count}")
         elif dry_run and need_fix_count > 0:
             print("\n⚠️  这是分析模式，未修改任何数据。")
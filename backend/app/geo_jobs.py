@@ -0,0 +1,236 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from .changes import commit_changes, record_change
+from .config import get_settings
+from .database import SessionLocal
+from .indexing import ITEM_MODELS, index_item
+from .map_version import MapVersionWatcher
+from .models import GeoJob
+from .utils import (
+    GeoHelper,
+    GeoPending,
+    LocationInput,
+    assign_geo_info,
+    ensure_coords,
+    geo_status_for,
+    item_tags_text,
+)
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+GEO_JOBS_CHANNEL = "lovejournal_geo_jobs"
+# 后来新增的 geo_status 列，create_all 不会给已存在的表补列
+GEO_STATUS_TABLES = ("entry", "key_date", "photo", "timeline_item")
+
+
+async def ensure_geo_status_columns(conn: AsyncConnection) -> None:
+    for table in GEO_STATUS_TABLES:
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS geo_status VARCHAR(16)"))
+
+
+async def enqueue_geo_job(
+    session: AsyncSession, kind: str, item_id: int, geo: LocationInput, *, remerge: bool = True
+) -> None:
+    """
+    登记（或覆盖）条目的后台解析任务，与业务写入同一事务提交；
+    提交后通过 NOTIFY 唤醒各 worker 进程。
+    """
+    values = {
+        "kind": kind,
+        "item_id": item_id,
+        "location": geo.location if remerge else None,
+        "coords": geo.coords if remerge else None,
+        "source_location": geo.source,
+        "remerge": remerge,
+        "revision": 1,
+        "attempts": 0,
+        "next_run_at": datetime.now(),
+        "last_error": None,
+    }
+    stmt = insert(GeoJob).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[GeoJob.kind, GeoJob.item_id],
+        set_={
+            **{key: value for key, value in values.items() if key not in ("kind", "item_id", "revision")},
+            "revision": GeoJob.revision + 1,
+        },
+    )
+    await session.execute(stmt)
+    await session.execute(text("SELECT pg_notify(:channel, '')"), {"channel": GEO_JOBS_CHANNEL})
+
+
+async def cancel_geo_job(session: AsyncSession, kind: str, item_id: int) -> None:
+    """条目被删除或位置已当场解析时撤销尚未完成的任务，避免旧结果覆盖新位置。"""
+    await session.execute(delete(GeoJob).where(GeoJob.kind == kind, GeoJob.item_id == item_id))
+
+
+@dataclass
+class ClaimedJob:
+    kind: str
+    item_id: int
+    revision: int
+    attempts: int
+    location: str | None
+    coords: str | None
+    source_location: str | None
+    remerge: bool
+
+
+class GeoJobWorker:
+    """
+    geo_job 表的后台消费者，每个进程在 lifespan 中启动 GEO_JOB_WORKERS 个协程。
+
+    认领任务用 FOR UPDATE SKIP LOCKED 并把 next_run_at 推后一个租期，多 worker 进程
+    之间互不重复；进程崩溃时租期过后任务会被重新认领。解析分两步：先在事务外请求高德
+    预热缓存，再在锁住任务行的短事务里离线重算并回写条目，然后记录变更推送给客户端。
+    """
+
+    def __init__(self):
+        self.geo_helper: GeoHelper | None = None
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def attach(self, watcher: MapVersionWatcher) -> None:
+        watcher.listen(GEO_JOBS_CHANNEL, lambda _payload: self.wake())
+        # 重连期间可能漏掉通知，醒来扫一遍
+        watcher.on_reconnect(self.wake)
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def start(self, geo_helper: GeoHelper) -> None:
+        self.geo_helper = geo_helper
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(settings.geo_job_workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _run(self) -> None:
+        while True:
+            # 认领前清除唤醒标记，认领查询之后到达的通知不会丢失
+            self._wakeup.clear()
+            try:
+                job = await self._claim()
+            except Exception as exc:
+                logger.warning("geo job claim failed: %s", exc)
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.geo_job_poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._process(job)
+            except Exception as exc:
+                # 租期到后会被重新认领
+                logger.warning("geo job %s:%s failed: %s", job.kind, job.item_id, exc)
+
+    async def _claim(self) -> ClaimedJob | None:
+        async with SessionLocal() as session:
+            res = await session.execute(
+                select(GeoJob)
+                .where(GeoJob.next_run_at <= datetime.now())
+                .order_by(GeoJob.next_run_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = res.scalars().first()
+            if job is None:
+                return None
+            job.attempts += 1
+            job.next_run_at = datetime.now() + timedelta(seconds=settings.geo_job_lease_seconds)
+            claimed = ClaimedJob(
+                job.kind,
+                job.item_id,
+                job.revision,
+                job.attempts,
+                job.location,
+                job.coords,
+                job.source_location,
+                job.remerge,
+            )
+            await session.commit()
+        return claimed
+
+    async def _warm(self, job: ClaimedJob, current_location: str | None) -> None:
+        """
+        事务外完成全部网络请求，结果进入缓存，应用阶段离线重算即可命中。
+        整个条目的解析共用一个时间预算，超时的查询留到下次重试。
+        """
+        helper = self.geo_helper
+        with helper.deadline(settings.geo_deadline_seconds):
+            location = current_location
+            if job.remerge:
+                location = await helper.merge_location_and_coords(job.location, job.coords)
+            probe = SimpleNamespace(lat=None, lng=None, adcode=None)
+            await assign_geo_info(probe, helper, location, job.source_location)
+
+    async def _process(self, job: ClaimedJob) -> None:
+        model = ITEM_MODELS[job.kind]
+        async with SessionLocal() as session:
+            item = await session.get(model, job.item_id)
+            current_location = item.location if item else None
+        if item is not None:
+            await self._warm(job, current_location)
+
+        helper = self.geo_helper
+        async with SessionLocal() as session:
+            locked = await session.get(GeoJob, (job.kind, job.item_id), with_for_update=True)
+            if locked is None or locked.revision != job.revision:
+                # 解析期间条目被重新保存，新的任务会覆盖这次结果
+                return
+            item = await session.get(model, job.item_id)
+            if item is None:
+                await session.delete(locked)
+                await session.commit()
+                return
+
+            scratch = SimpleNamespace(location=item.location, lat=item.lat, lng=item.lng, adcode=item.adcode)
+            try:
+                with helper.offline():
+                    if job.remerge:
+                        scratch.location = await helper.merge_location_and_coords(job.location, job.coords)
+                    await assign_geo_info(scratch, helper, scratch.location, job.source_location)
+                ensure_coords(scratch, helper)
+                resolved = geo_status_for(scratch) != "failed"
+            except GeoPending:
+                resolved = False
+
+            if not resolved and job.attempts < settings.geo_job_max_attempts:
+                delay = settings.geo_job_retry_base * 2 ** (job.attempts - 1)
+                locked.next_run_at = datetime.now() + timedelta(seconds=delay)
+                locked.last_error = "location not resolved"
+                await session.commit()
+                return
+
+            if resolved:
+                item.location = scratch.location
+                item.lat, item.lng, item.adcode = scratch.lat, scratch.lng, scratch.adcode
+                item.tags = item_tags_text(job.kind, item)
+            item.geo_status = geo_status_for(item) if resolved else "failed"
+            await session.flush()
+            facets = await index_item(session, job.kind, item)
+            await record_change(session, job.kind, item.id, "upsert", facets)
+            await session.delete(locked)
+            await commit_changes(session)
+
+
+geo_job_worker = GeoJobWorker()
@@ -0,0 +1,139 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from .models import GeoCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# get() 未命中时的返回值，用来与“缓存了 None（查询无结果）”区分
+MISSING = object()
+# 每写入这么多次顺带清理一批过期行，单次最多删除 PRUNE_BATCH 行
+PRUNE_EVERY = 100
+PRUNE_BATCH = 1000
+
+
+async def prune_expired(session: AsyncSession, limit: int | None = None) -> int:
+    """删除已过期的 geo_cache 行（走 expires_at 索引），limit 限制单次删除行数，不提交，返回删除行数。"""
+    expired = select(GeoCacheEntry.key).where(GeoCacheEntry.expires_at <= datetime.now())
+    if limit is not None:
+        expired = expired.limit(limit)
+    res = await session.execute(delete(GeoCacheEntry).where(GeoCacheEntry.key.in_(expired)))
+    return res.rowcount or 0
+
+
+class GeoCache:
+    """
+    地理编码两级缓存：进程内 LRU（条目数 + TTL 上限）在前，geo_cache 表在后。
+
+    无结果（None）使用较短的 negative_ttl，避免一次网络失败被永久缓存。
+    数据库层是尽力而为的：读写失败只记录日志，按未命中处理。
+    过期行不会被读到，但也不会被覆盖写掉；每 PRUNE_EVERY 次写入顺带删除一批，
+    也可用 python -m app.manage prune-geocache 一次清空。
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: int,
+        negative_ttl: int,
+        session_factory: async_sessionmaker[AsyncSession] | None = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.session_factory = session_factory
+        self._entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._stores = 0
+
+    def _ttl_for(self, value: Any) -> int:
+        return self.ttl if value is not None else self.negative_ttl
+
+    def _put_local(self, key: str, value: Any, expires_at: float) -> None:
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_local(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    async def _get_db(self, key: str) -> Any:
+        if self.session_factory is None:
+            return MISSING
+        try:
+            async with self.session_factory() as session:
+                res = await session.execute(
+                    select(GeoCacheEntry.value, GeoCacheEntry.expires_at).where(
+                        GeoCacheEntry.key == key, GeoCacheEntry.expires_at > datetime.now()
+                    )
+                )
+                row = res.first()
+        except Exception as exc:
+            logger.warning("geo cache lookup failed: %s", exc)
+            return MISSING
+        if row is None:
+            return MISSING
+        value = json.loads(row.value) if row.value is not None else None
+        self._put_local(key, value, row.expires_at.timestamp())
+        return value
+
+    async def get(self, key: str) -> Any:
+        """返回缓存值（可能是 None），未命中时返回 MISSING。"""
+        value = self._get_local(key)
+        if value is not MISSING:
+            self.memory_hits += 1
+            return value
+        value = await self._get_db(key)
+        if value is not MISSING:
+            self.db_hits += 1
+            return value
+        self.misses += 1
+        return MISSING
+
+    async def set(self, key: str, value: Any) -> None:
+        ttl = self._ttl_for(value)
+        self._put_local(key, value, time.time() + ttl)
+        if self.session_factory is None:
+            return
+        expires_at = datetime.now() + timedelta(seconds=ttl)
+        payload = json.dumps(value, ensure_ascii=False) if value is not None else None
+        stmt = insert(GeoCacheEntry).values(key=key, value=payload, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[GeoCacheEntry.key], set_={"value": payload, "expires_at": expires_at}
+        )
+        self._stores += 1
+        try:
+            async with self.session_factory() as session:
+                await session.execute(stmt)
+                if self._stores % PRUNE_EVERY == 0:
+                    await prune_expired(session, PRUNE_BATCH)
+                await session.commit()
+        except Exception as exc:
+            logger.warning("geo cache store failed: %s", exc)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .config import get_settings
+
+try:  # 可选依赖：未安装 Pillow 时不生成缩略图，前端回退到原图
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# 派生图的最长边（像素），小于原图的尺寸才生成，不放大
+DERIVATIVE_SIZES = (256, 768, 1600)
+DERIVED_DIR = "derived"
+# 后来新增的图片元数据列，create_all 不会给已存在的表补列
+PHOTO_COLUMNS = {
+    "width": "INTEGER",
+    "height": "INTEGER",
+    "dominant_color": "VARCHAR(7)",
+    "blurhash": "VARCHAR(64)",
+    "variants": "TEXT",
+}
+
+B83_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+_executor: ProcessPoolExecutor | None = None
+
+
+async def ensure_photo_columns(conn: AsyncConnection) -> None:
+    for table in ("photo", "timeline_item"):
+        for name, ddl in PHOTO_COLUMNS.items():
+            await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {name} {ddl}"))
+
+
+def _b83(value: int, length: int) -> str:
+    return "".join(B83_CHARS[(value // 83 ** (length - 1 - i)) % 83] for i in range(length))
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def encode_blurhash(image, x_components: int = 4, y_components: int = 3) -> str:
+    """按 BlurHash 规范编码一张（已缩小的）RGB 图片，前端解码后作为加载占位。"""
+    width, height = image.size
+    pixels = [tuple(_srgb_to_linear(c) for c in pixel) for pixel in image.getdata()]
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            norm = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                basis_y = math.cos(math.pi * j * y / height)
+                for x in range(width):
+                    basis = norm * math.cos(math.pi * i * x / width) * basis_y
+                    pr, pg, pb = pixels[y * width + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = 1 / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _b83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(c) for factor in ac for c in factor)
+        quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+        result += _b83(quantised_max, 1)
+    else:
+        max_value = 1.0
+        result += _b83(0, 1)
+    result += _b83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (
+            max(0, min(18, int(math.floor(math.copysign(abs(c / max_value) ** 0.5, c) * 9 + 9.5))))
+            for c in factor
+        )
+        result += _b83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def _dominant_color(image) -> str:
+    """缩小后量化成 5 色，取像素最多的颜色。"""
+    small = image.copy()
+    small.thumbnail((64, 64))
+    quantized = small.quantize(colors=5)
+    palette = quantized.getpalette()
+    _, index = max(quantized.getcolors())
+    r, g, b = palette[index * 3 : index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def _output_formats() -> list[tuple[str, str, dict]]:
+    formats = [("webp", "WEBP", {"quality": 80, "method": 4})]
+    if features.check("avif"):
+        formats.insert(0, ("avif", "AVIF", {"quality": 50}))
+    formats.append(("jpg", "JPEG", {"quality": 82, "progressive": True, "optimize": True}))
+    return formats
+
+
+def generate_derivatives(source: str, derived_dir: str, stem: str) -> dict:
+    """
+    在进程池中运行：读取原图（按 EXIF 方向摆正），生成各尺寸的 AVIF / WebP / JPEG 派生图，
+    并计算宽高、主色与 BlurHash。返回可直接写入 Photo 的字段。
+    """
+    with Image.open(source) as opened:
+        image = ImageOps.exif_transpose(opened)
+        width, height = image.size
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            # JPEG 不支持透明通道，统一铺白底
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image.convert("RGBA"), mask=image.convert("RGBA").getchannel("A"))
+            image = background
+        else:
+            image = image.convert("RGB")
+
+    os.makedirs(derived_dir, exist_ok=True)
+    longest = max(width, height)
+    targets = [size for size in DERIVATIVE_SIZES if size < longest] or [longest]
+    variants = []
+    for target in targets:
+        resized = image.copy()
+        resized.thumbnail((target, target), Image.Resampling.LANCZOS)
+        for ext, fmt, options in _output_formats():
+            name = f"{stem}-{target}.{ext}"
+            resized.save(os.path.join(derived_dir, name), fmt, **options)
+            variants.append(
+                {
+                    "width": resized.width,
+                    "height": resized.height,
+                    "format": ext,
+                    "url": f"/uploads/{DERIVED_DIR}/{name}",
+                }
+            )
+
+    tiny = image.copy()
+    tiny.thumbnail((32, 32))
+    return {
+        "width": width,
+        "height": height,
+        "dominant_color": _dominant_color(image),
+        "blurhash": encode_blurhash(tiny),
+        "variants": json.dumps(variants, separators=(",", ":")),
+    }
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.image_workers)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _stem(filename: str) -> str:
+    return Path(filename).stem
+
+
+async def build_derivatives(photo, upload_dir: Path, source: Path | None = None) -> None:
+    """
+    为照片生成派生图并写入宽高、主色、BlurHash 与 variants 字段。
+    原图尚未放到最终位置（新上传在提交后才改名）时用 source 指定读取路径。
+    图片无法解码（如未安装 HEIC 插件）或未安装 Pillow 时清空这些字段，前端使用原图。
+    """
+    fields = dict.fromkeys(PHOTO_COLUMNS)
+    if Image is not None:
+        loop = asyncio.get_running_loop()
+        try:
+            fields = await loop.run_in_executor(
+                _get_executor(),
+                generate_derivatives,
+                str(source or upload_dir / photo.filename),
+                str(upload_dir / DERIVED_DIR),
+                _stem(photo.filename),
+            )
+        except Exception as exc:
+            logger.warning("failed to build derivatives for %s: %s", photo.filename, exc)
+    for name, value in fields.items():
+        setattr(photo, name, value)
+
+
+def remove_derivatives(filename: str, upload_dir: Path) -> None:
+    """删除某个原图的全部派生图（照片被替换或删除时调用）。"""
+    derived_dir = upload_dir / DERIVED_DIR
+    if not derived_dir.is_dir():
+        return
+    for path in derived_dir.glob(f"{_stem(filename)}-*"):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def parse_variants(value: str | None) -> list[dict]:
+    if not value:
+        return []
+    try:
+        return json.loads(value)
+    except ValueError:
+        return []
+
+
+def image_fields(obj) -> dict:
+    """照片（或其 timeline_item 投影）上与图片相关的响应字段。"""
+    variants = parse_variants(obj.variants)
+    return {
+        "width": obj.width,
+        "height": obj.height,
+        "dominant_color": obj.dominant_color,
+        "blurhash": obj.blurhash,
+        "thumbnail": thumbnail_url(variants),
+        "variants": variants,
+    }
+
+
+def thumbnail_url(variants: list[dict]) -> str | None:
+    """最小尺寸的 WebP（没有时取 JPEG）派生图，用于列表与地图弹窗。"""
+    for fmt in ("webp", "jpg"):
+        candidates = [v for v in variants if v.get("format") == fmt]
+        if candidates:
+            return min(candidates, key=lambda v: v["width"])["url"]
+    return None
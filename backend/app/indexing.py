@@ -0,0 +1,309 @@
+from datetime import datetime
+
+from sqlalchemy import Integer, cast, delete, exists, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Entry, ItemTag, KeyDate, Photo, RegionStat, TagStat, TimelineItem
+
+# 与时间线 / 地图返回的 type 字段保持一致
+ITEM_MODELS = {"entry": Entry, "keydate": KeyDate, "photo": Photo}
+TYPE_ALIASES = {
+    "entry": ("all", "entry", "text"),
+    "photo": ("all", "photo", "img", "image"),
+    "keydate": ("all", "keydate", "date", "anniversary"),
+}
+
+
+def resolve_kinds(type_filter: str) -> list[str]:
+    """把 ?type= 参数解析为 timeline_item.type 取值列表。"""
+    type_filter = (type_filter or "all").lower()
+    return [kind for kind, aliases in TYPE_ALIASES.items() if type_filter in aliases]
+
+
+def kind_filter(kinds: list[str]):
+    """
+    类型条件；全部类型时返回 None，不加 IN 条件，
+    以免 IN 列表阻止规划器直接利用 (timestamp, type, source_id) 索引的顺序。
+    """
+    if len(kinds) >= len(ITEM_MODELS):
+        return None
+    if len(kinds) == 1:
+        return TimelineItem.type == kinds[0]
+    return TimelineItem.type.in_(kinds)
+
+
+def item_tags(item) -> list[str]:
+    return [t for t in (item.tags or "").split(",") if t]
+
+
+def item_timestamp(kind: str, item) -> datetime:
+    if kind == "keydate":
+        return item.date or datetime.now()
+    return item.created_at or datetime.now()
+
+
+def timeline_row(kind: str, item) -> dict:
+    """把源表对象映射为 timeline_item 的一行。"""
+    row = {
+        "type": kind,
+        "source_id": item.id,
+        "timestamp": item_timestamp(kind, item),
+        "content": None,
+        "caption": None,
+        "title": None,
+        "filename": None,
+        "image": None,
+        "location": item.location,
+        "tags": item.tags,
+        "lat": item.lat,
+        "lng": item.lng,
+        "adcode": item.adcode,
+        "geo_status": item.geo_status,
+        "width": None,
+        "height": None,
+        "dominant_color": None,
+        "blurhash": None,
+        "variants": None,
+    }
+    if kind == "entry":
+        row["content"] = item.content
+    elif kind == "keydate":
+        row["title"] = item.title
+    else:
+        row["caption"] = item.caption
+        row["filename"] = item.filename
+        row["image"] = f"/uploads/{item.filename}"
+        for key in ("width", "height", "dominant_color", "blurhash", "variants"):
+            row[key] = getattr(item, key)
+    row["snippet"] = str(row["content"] or row["caption"] or row["title"] or "")[:120]
+    return row
+
+
+def tag_filter(tag: str):
+    """按标签过滤 timeline_item 的半连接，走 item_tag 主键 (tag, item_type, item_id) 索引。"""
+    return exists().where(
+        ItemTag.tag == tag,
+        ItemTag.item_type == TimelineItem.type,
+        ItemTag.item_id == TimelineItem.source_id,
+    )
+
+
+async def _clear_item_tags(session: AsyncSession, kind: str, item_id: int) -> set[str]:
+    res = await session.execute(
+        delete(ItemTag).where(ItemTag.item_type == kind, ItemTag.item_id == item_id).returning(ItemTag.tag)
+    )
+    return set(res.scalars().all())
+
+
+async def _apply_tag_stats(session: AsyncSession, old_tags: set[str], new_tags: set[str]) -> None:
+    """
+    按新旧标签差异增量更新 tag_stat；last_used_at 通过 item_tag 的 (tag, ts) 索引重新取最大值。
+    """
+    added = new_tags - old_tags
+    removed = old_tags - new_tags
+    if added:
+        stmt = insert(TagStat).values([{"tag": tag, "count": 1} for tag in added])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[TagStat.tag], set_={"count": TagStat.count + 1}
+        )
+        await session.execute(stmt)
+    if removed:
+        await session.execute(
+            update(TagStat).where(TagStat.tag.in_(removed)).values(count=TagStat.count - 1)
+        )
+        await session.execute(delete(TagStat).where(TagStat.tag.in_(removed), TagStat.count <= 0))
+    affected = old_tags | new_tags
+    if affected:
+        await session.flush()
+        latest = (
+            select(func.max(ItemTag.ts)).where(ItemTag.tag == TagStat.tag).scalar_subquery()
+        )
+        await session.execute(
+            update(TagStat).where(TagStat.tag.in_(affected)).values(last_used_at=latest)
+        )
+
+
+RegionKey = tuple[str, int]
+
+
+def _region_key(adcode: str | None, ts: datetime | None) -> RegionKey | None:
+    if not adcode or ts is None:
+        return None
+    return adcode, ts.year
+
+
+async def _apply_region_stats(
+    session: AsyncSession, kind: str, old_key: RegionKey | None, new_key: RegionKey | None
+) -> None:
+    """条目的 (adcode, 年份) 变化时，旧格子减一、新格子加一。"""
+    if old_key == new_key:
+        return
+    if old_key:
+        adcode, year = old_key
+        match = (RegionStat.adcode == adcode, RegionStat.kind == kind, RegionStat.year == year)
+        await session.execute(update(RegionStat).where(*match).values(count=RegionStat.count - 1))
+        await session.execute(delete(RegionStat).where(*match, RegionStat.count <= 0))
+    if new_key:
+        adcode, year = new_key
+        stmt = insert(RegionStat).values(adcode=adcode, kind=kind, year=year, count=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RegionStat.adcode, RegionStat.kind, RegionStat.year],
+            set_={"count": RegionStat.count + 1},
+        )
+        await session.execute(stmt)
+
+
+async def _projected_row(session: AsyncSession, kind: str, item_id: int) -> dict | None:
+    res = await session.execute(
+        select(*TimelineItem.__table__.c).where(
+            TimelineItem.type == kind, TimelineItem.source_id == item_id
+        )
+    )
+    row = res.mappings().first()
+    return dict(row) if row else None
+
+
+def _located(row: dict | None) -> bool:
+    return row is not None and row["lat"] is not None and row["lng"] is not None
+
+
+def changed_facets(old: dict | None, new: dict | None) -> set[str]:
+    """
+    比较条目投影的新旧两行，返回受影响的版本分量（见 map_version.FACETS）。
+    地图的筛选条件也会读正文与标签，所以带坐标条目的任意变化都算作 geo。
+    带标签条目的新增、删除或时间变化会改写 item_tag.ts 与 tag_stat.last_used_at，同样算作 tags。
+    """
+    if old == new:
+        return set()
+    facets = {"text"}
+    old_row, new_row = old or {}, new or {}
+    tagged = bool(old_row.get("tags") or new_row.get("tags"))
+    if old_row.get("tags") != new_row.get("tags") or (
+        tagged and (old is None or new is None or old_row.get("timestamp") != new_row.get("timestamp"))
+    ):
+        facets.add("tags")
+    if _located(old) or _located(new):
+        facets.add("geo")
+    return facets
+
+
+async def _upsert_timeline_item(session: AsyncSession, kind: str, item) -> set[str]:
+    old = await _projected_row(session, kind, item.id)
+    row = timeline_row(kind, item)
+    facets = changed_facets(old, row)
+    if not facets:
+        return facets
+    stmt = insert(TimelineItem).values(**row)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TimelineItem.type, TimelineItem.source_id],
+        set_={key: value for key, value in row.items() if key not in ("type", "source_id")},
+    )
+    await session.execute(stmt)
+    old_region = _region_key(old["adcode"], old["timestamp"]) if old else None
+    await _apply_region_stats(session, kind, old_region, _region_key(row["adcode"], row["timestamp"]))
+    return facets
+
+
+async def index_item(session: AsyncSession, kind: str, item) -> set[str]:
+    """
+    写入条目的派生数据（标签索引、标签计数、时间线投影、区域计数），需在条目 flush
+    （已有 id）之后、提交之前调用，与业务写入处于同一事务。返回受影响的版本分量。
+    """
+    old_tags = await _clear_item_tags(session, kind, item.id)
+    ts = item_timestamp(kind, item)
+    new_tags = set(item_tags(item))
+    for tag in new_tags:
+        session.add(ItemTag(tag=tag, item_type=kind, item_id=item.id, ts=ts))
+    await _apply_tag_stats(session, old_tags, new_tags)
+    return await _upsert_timeline_item(session, kind, item)
+
+
+async def unindex_item(session: AsyncSession, kind: str, item_id: int) -> set[str]:
+    old_tags = await _clear_item_tags(session, kind, item_id)
+    await _apply_tag_stats(session, old_tags, set())
+    old = await _projected_row(session, kind, item_id)
+    await session.execute(
+        delete(TimelineItem).where(TimelineItem.type == kind, TimelineItem.source_id == item_id)
+    )
+    old_region = _region_key(old["adcode"], old["timestamp"]) if old else None
+    await _apply_region_stats(session, kind, old_region, None)
+    return changed_facets(old, None)
+
+
+async def rebuild_tag_index(session: AsyncSession) -> int:
+    """根据各表的 tags 字符串重建 item_tag 与 tag_stat，返回写入的标签行数。"""
+    await session.execute(delete(ItemTag))
+    await session.execute(delete(TagStat))
+    total = 0
+    for kind, model in ITEM_MODELS.items():
+        res = await session.execute(select(model).where(model.tags.is_not(None)))
+        for item in res.scalars():
+            ts = item_timestamp(kind, item)
+            for tag in item_tags(item):
+                session.add(ItemTag(tag=tag, item_type=kind, item_id=item.id, ts=ts))
+                total += 1
+    await session.flush()
+    await session.execute(
+        insert(TagStat).from_select(
+            ["tag", "count", "last_used_at"],
+            select(ItemTag.tag, func.count(), func.max(ItemTag.ts)).group_by(ItemTag.tag),
+        )
+    )
+    await session.commit()
+    return total
+
+
+def region_year(column):
+    return cast(func.extract("year", column), Integer)
+
+
+async def rebuild_region_stats(session: AsyncSession) -> int:
+    """根据 timeline_item 重建 region_stat，返回区域格子数。"""
+    await session.execute(delete(RegionStat))
+    year = region_year(TimelineItem.timestamp)
+    await session.execute(
+        insert(RegionStat).from_select(
+            ["adcode", "kind", "year", "count"],
+            select(TimelineItem.adcode, TimelineItem.type, year, func.count())
+            .where(TimelineItem.adcode.is_not(None), TimelineItem.adcode != "")
+            .group_by(TimelineItem.adcode, TimelineItem.type, year),
+        )
+    )
+    await session.commit()
+    return await session.scalar(select(func.count()).select_from(RegionStat)) or 0
+
+
+async def rebuild_timeline_items(session: AsyncSession) -> int:
+    """根据源表重建 timeline_item 投影（连同 region_stat），返回写入的行数。"""
+    await session.execute(delete(TimelineItem))
+    total = 0
+    for kind, model in ITEM_MODELS.items():
+        res = await session.execute(select(model))
+        rows = [timeline_row(kind, item) for item in res.scalars()]
+        if rows:
+            await session.execute(insert(TimelineItem), rows)
+            total += len(rows)
+    await session.commit()
+    await rebuild_region_stats(session)
+    return total
+
+
+async def ensure_indexes_populated(session: AsyncSession) -> None:
+    """
+    启动时检查派生表：升级后首次启动（派生表为空而源表有数据）自动回填，
+    之后由写入路径增量维护。
+    """
+    has_items = False
+    for model in ITEM_MODELS.values():
+        if await session.scalar(select(exists().where(model.id.is_not(None)))):
+            has_items = True
+            break
+    if not has_items:
+        return
+    if not await session.scalar(select(exists().where(TimelineItem.source_id.is_not(None)))):
+        await rebuild_timeline_items(session)
+    elif not await session.scalar(select(exists().where(RegionStat.count > 0))):
+        await rebuild_region_stats(session)
+    if not await session.scalar(select(exists().where(ItemTag.item_id.is_not(None)))):
+        await rebuild_tag_index(session)
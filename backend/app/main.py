@@ -1,3 +1,4 @@
+import asyncio
 import os
 from contextlib import asynccontextmanager
 
@@ -6,14 +7,29 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy import text
 
+from .blobs import wait_file_cleanups
+from .boundaries import load_adcode_resolver
+from .cache import response_cache
+from .changes import change_sequencer, ensure_change_log_floor
 from .config import get_settings
 from .database import Base, SessionLocal, engine
-from .map_version import get_map_version
+from .events import event_broker
+from .geo_jobs import ensure_geo_status_columns, geo_job_worker
+from .geocache import GeoCache
+from .imaging import ensure_photo_columns, shutdown_executor
+from .indexing import ensure_indexes_populated
+from .map_version import get_map_version, map_version_watcher
+from .models import TimelineItem
 from .routers import auth as auth_router
+from .routers import changes as changes_router
 from .routers import entries as entries_router
+from .routers import events as events_router
+from .routers import geo as geo_router
 from .routers import map as map_router
 from .routers import timeline as timeline_router
-from .utils import GeoHelper
+from .search import ensure_search_indexes
+from .uploads import UploadSizeLimitMiddleware
+from .utils import GeoHelper, create_amap_client
 
 settings = get_settings()
 
@@ -21,22 +37,61 @@ settings = get_settings()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     os.makedirs(settings.upload_dir, exist_ok=True)
-    app.state.geo_helper = GeoHelper(settings.amap_key)
+    # 全局共享的高德客户端：长连接复用，关闭时统一释放；结果缓存在内存 LRU + geo_cache 表
+    geo_cache = GeoCache(
+        settings.geo_cache_max_entries,
+        settings.geo_cache_ttl,
+        settings.geo_cache_negative_ttl,
+        session_factory=SessionLocal,
+    )
+    # 行政区边界用于离线换算 adcode，解析 GeoJSON 放到线程里避免阻塞事件循环
+    boundaries = await asyncio.to_thread(load_adcode_resolver, settings.geo_boundaries_path)
+    app.state.geo_helper = GeoHelper(
+        settings.amap_key, client=create_amap_client(), cache=geo_cache, boundaries=boundaries
+    )
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await ensure_geo_status_columns(conn)
+        await ensure_photo_columns(conn)
+        # create_all 不会给已存在的表补建后来新增的索引
+        for index in TimelineItem.__table__.indexes:
+            await conn.run_sync(index.create, checkfirst=True)
         # location 字段索引，避免地图查询全表扫描
         await conn.execute(text("CREATE INDEX IF NOT EXISTS idx_entry_location ON entry (location)"))
         await conn.execute(text("CREATE INDEX IF NOT EXISTS idx_keydate_location ON key_date (location)"))
         await conn.execute(text("CREATE INDEX IF NOT EXISTS idx_photo_location ON photo (location)"))
+        # 关键字搜索的二元组索引（支持两个字的中文查询，单字查询只用 LIKE）
+        await ensure_search_indexes(conn)
     # 初始化地图版本号，保障缓存命中/失效逻辑正常
     async with SessionLocal() as session:
         await get_map_version(session)
+        # 变更日志的起点：更早的 since 版本只能全量同步
+        await ensure_change_log_floor(session)
+        # 升级后首次启动时回填 timeline_item / item_tag 等派生表
+        await ensure_indexes_populated(session)
+    # 监听版本变更通知，读路径直接使用内存中的版本号；变更通知经同一连接分发给 /api/events
+    event_broker.attach(map_version_watcher)
+    # 后台地理编码：写入路径只登记任务，worker 解析后回写条目并推送变更
+    geo_job_worker.attach(map_version_watcher)
+    map_version_watcher.start()
+    # 补做上次退出前未分配版本号的变更，之后定期兜底
+    change_sequencer.start()
+    geo_job_worker.start(app.state.geo_helper)
     yield
+    await geo_job_worker.stop()
+    await change_sequencer.stop()
+    await wait_file_cleanups()
+    await map_version_watcher.stop()
+    await response_cache.close()
+    await app.state.geo_helper.aclose()
+    shutdown_executor()
 
 
 def create_app() -> FastAPI:
     app = FastAPI(title="LoveJournal", lifespan=lifespan)
 
+    # 放在 CORS 内层，提前返回的 413 也带跨域头
+    app.add_middleware(UploadSizeLimitMiddleware)
     origins = [origin.strip() for origin in settings.cors_origins.split(",")] if settings.cors_origins else ["*"]
     app.add_middleware(
         CORSMiddleware,
@@ -50,6 +105,9 @@ def create_app() -> FastAPI:
     app.include_router(timeline_router.router)
     app.include_router(entries_router.router)
     app.include_router(map_router.router)
+    app.include_router(changes_router.router)
+    app.include_router(events_router.router)
+    app.include_router(geo_router.router)
 
     app.mount("/uploads", StaticFiles(directory=settings.upload_dir), name="uploads")
     return app
@@ -0,0 +1,193 @@
+"""
+维护命令
+
+运行方法：
+cd backend
+python -m app.manage backfill-tags      # 根据 tags 字符串回填 item_tag 标签索引与 tag_stat 计数
+python -m app.manage rebuild-timeline   # 根据源表重建 timeline_item 投影（含 region_stat）
+python -m app.manage rebuild-regions    # 根据 timeline_item 重建 region_stat 区域计数
+python -m app.manage backfill-coords    # 把位置文本中的坐标写入 lat/lng 列（地图查询只读列），不含坐标的地址批量地理编码
+python -m app.manage rebuild-thumbnails # 为全部照片重新生成缩略图、尺寸、主色与 BlurHash
+python -m app.manage gc-uploads         # 按 photo 表校正文件引用计数，删除上传目录中无人引用的文件
+python -m app.manage prune-geocache     # 删除 geo_cache 表中已过期的地理编码缓存
+"""
+
+import argparse
+import asyncio
+
+from sqlalchemy import func, select
+
+from .blobs import collect_garbage
+from .boundaries import load_adcode_resolver
+from .changes import commit_changes, record_change
+from .config import get_settings
+from .database import Base, SessionLocal, engine
+from .geo_jobs import cancel_geo_job, ensure_geo_status_columns
+from .geocache import GeoCache, prune_expired
+from .imaging import build_derivatives, ensure_photo_columns, remove_derivatives, shutdown_executor
+from .indexing import ITEM_MODELS, index_item, rebuild_region_stats, rebuild_tag_index, rebuild_timeline_items
+from .models import GeoJob, Photo
+from .utils import GeoHelper
+
+settings = get_settings()
+BATCH_SIZE = 500
+
+
+async def backfill_tags():
+    async with SessionLocal() as session:
+        total = await rebuild_tag_index(session)
+    print(f"✅ item_tag 已回填 {total} 条标签记录")
+
+
+async def rebuild_timeline():
+    async with SessionLocal() as session:
+        total = await rebuild_timeline_items(session)
+    print(f"✅ timeline_item 已重建 {total} 条记录")
+
+
+async def rebuild_regions():
+    async with SessionLocal() as session:
+        total = await rebuild_region_stats(session)
+    print(f"✅ region_stat 已重建 {total} 个区域格子")
+
+
+async def backfill_coords():
+    geo_cache = GeoCache(
+        settings.geo_cache_max_entries,
+        settings.geo_cache_ttl,
+        settings.geo_cache_negative_ttl,
+        session_factory=SessionLocal,
+    )
+    boundaries = load_adcode_resolver(settings.geo_boundaries_path)
+    geo_helper = GeoHelper(settings.amap_key, cache=geo_cache, boundaries=boundaries)
+    try:
+        await _backfill_coords(geo_helper)
+    finally:
+        await geo_helper.aclose()
+
+
+async def _backfill_coords(geo_helper: GeoHelper):
+    total = 0
+    async with SessionLocal() as session:
+        for kind, model in ITEM_MODELS.items():
+            last_id = 0
+            while True:
+                res = await session.execute(
+                    select(model)
+                    .where(
+                        model.id > last_id,
+                        model.lat.is_(None),
+                        func.length(func.trim(model.location)) > 0,
+                    )
+                    .order_by(model.id)
+                    .limit(BATCH_SIZE)
+                )
+                items = res.scalars().all()
+                if not items:
+                    break
+                # 带用户坐标输入的待处理任务（remerge）会重新合并位置文本，交给后台任务处理；
+                # 其余待处理任务在回填后撤销，避免之后用旧结果覆盖回填的坐标
+                res = await session.execute(
+                    select(GeoJob.item_id, GeoJob.remerge).where(
+                        GeoJob.kind == kind, GeoJob.item_id.in_([item.id for item in items])
+                    )
+                    # 锁住任务行，已认领的 worker 等本批提交后发现任务已撤销，不会再写回
+                    .with_for_update()
+                )
+                jobs = dict(res.all())
+                last_id = items[-1].id
+                items = [item for item in items if not jobs.get(item.id)]
+                results = [geo_helper.parse_coords_from_location(item.location) for item in items]
+                # 不含坐标的位置文本整批地理编码：批内去重、先查缓存，每次请求打包 10 个地址
+                missing = [i for i, coords in enumerate(results) if not coords]
+                geocoded = await geo_helper.geocode_many([items[i].location for i in missing])
+                for i, result in zip(missing, geocoded):
+                    results[i] = result
+                for item, coords in zip(items, results):
+                    if not coords:
+                        continue
+                    item.lat, item.lng = coords[0], coords[1]
+                    if not item.adcode:
+                        item.adcode = coords[2] or await geo_helper.reverse_geocode(item.lat, item.lng)
+                    item.geo_status = "ok"
+                    if item.id in jobs:
+                        await cancel_geo_job(session, kind, item.id)
+                    facets = await index_item(session, kind, item)
+                    await record_change(session, kind, item.id, "upsert", facets)
+                    total += 1
+                await commit_changes(session)
+    print(f"✅ 已为 {total} 条记录写入经纬度")
+
+
+async def rebuild_thumbnails():
+    total = 0
+    try:
+        async with SessionLocal() as session:
+            last_id = 0
+            while True:
+                res = await session.execute(
+                    select(Photo).where(Photo.id > last_id).order_by(Photo.id).limit(BATCH_SIZE)
+                )
+                photos = res.scalars().all()
+                if not photos:
+                    break
+                for photo in photos:
+                    remove_derivatives(photo.filename, settings.upload_dir)
+                    await build_derivatives(photo, settings.upload_dir)
+                    facets = await index_item(session, "photo", photo)
+                    await record_change(session, "photo", photo.id, "upsert", facets)
+                    total += photo.variants is not None
+                await commit_changes(session)
+                last_id = photos[-1].id
+    finally:
+        shutdown_executor()
+    print(f"✅ 已为 {total} 张照片生成缩略图")
+
+
+async def gc_uploads():
+    async with SessionLocal() as session:
+        result = await collect_garbage(session, settings.upload_dir)
+    print(
+        f"✅ 已校正 {result.recounted} 个文件的引用计数，删除 {result.files} 个原图、"
+        f"{result.derived} 个派生图、{result.temp} 个中断上传的临时文件"
+    )
+
+
+async def prune_geocache():
+    async with SessionLocal() as session:
+        total = await prune_expired(session)
+        await session.commit()
+    print(f"✅ 已删除 {total} 条过期的地理编码缓存")
+
+
+COMMANDS = {
+    "backfill-tags": backfill_tags,
+    "rebuild-timeline": rebuild_timeline,
+    "rebuild-regions": rebuild_regions,
+    "backfill-coords": backfill_coords,
+    "rebuild-thumbnails": rebuild_thumbnails,
+    "gc-uploads": gc_uploads,
+    "prune-geocache": prune_geocache,
+}
+
+
+async def run(command: str):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await ensure_geo_status_columns(conn)
+        await ensure_photo_columns(conn)
+    try:
+        await COMMANDS[command]()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LoveJournal 维护命令")
+    parser.add_argument("command", choices=sorted(COMMANDS), help="要执行的命令")
+    args = parser.parse_args()
+    asyncio.run(run(args.command))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import json
+from calendar import timegm
+from datetime import datetime
+
+from .schemas import MapResponse
+
+try:  # 可选依赖：msgpack 二进制格式
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 坐标定点精度：1e-6 度约 0.1 米
+COORD_SCALE = 1_000_000
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.lovejournal.columnar+json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+MAP_MEDIA_TYPES = {
+    "json": "application/json",
+    "columnar": COLUMNAR_MEDIA_TYPE,
+    "msgpack": MSGPACK_MEDIA_TYPES[0],
+}
+
+
+def negotiate_format(requested: str | None, accept: str | None) -> str:
+    """?format= 优先，其次看 Accept 头，默认仍是逐条对象的 JSON。"""
+    if requested:
+        return requested
+    accept = (accept or "").lower()
+    if COLUMNAR_MEDIA_TYPE in accept:
+        return "columnar"
+    if any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        return "msgpack"
+    return "json"
+
+
+def format_available(fmt: str) -> bool:
+    return fmt != "msgpack" or msgpack is not None
+
+
+def _deltas(values: list[int]) -> list[int]:
+    prev = 0
+    out = []
+    for value in values:
+        out.append(value - prev)
+        prev = value
+    return out
+
+
+def _dictionary(values: list[str | None]) -> tuple[list[str | None], list[int]]:
+    table: list[str | None] = []
+    positions: dict[str | None, int] = {}
+    indexes = []
+    for value in values:
+        pos = positions.get(value)
+        if pos is None:
+            pos = positions[value] = len(table)
+            table.append(value)
+        indexes.append(pos)
+    return table, indexes
+
+
+def _epoch_ms(timestamp: str) -> int:
+    # 时间戳是不带时区的墙钟时间，按 UTC 换算，前端用 UTC 方法还原出相同的字符串；
+    # 保留毫秒，同一秒内的条目顺序与 JSON 格式一致
+    value = datetime.fromisoformat(timestamp)
+    return timegm(value.timetuple()) * 1000 + value.microsecond // 1000
+
+
+def to_columnar(resp: MapResponse) -> dict:
+    """
+    把 MapResponse 转成列式结构：
+
+    - ids / ts（epoch 毫秒）为并行数组
+    - lat / lng 为乘以 COORD_SCALE 后的整数差分，首项为绝对值
+    - kind / label / adcode 使用字典编码（*_table + 下标数组）
+    - 聚合模式下的 clusters 体积很小，原样保留
+    """
+    markers = resp.markers
+    kind_table, kinds = _dictionary([m.kind for m in markers])
+    label_table, labels = _dictionary([m.label for m in markers])
+    adcode_table, adcodes = _dictionary([m.adcode for m in markers])
+    return {
+        "format": "columnar",
+        "version": resp.version,
+        "unchanged": resp.unchanged,
+        "zoom": resp.zoom,
+        "clusters": [cluster.model_dump() for cluster in resp.clusters],
+        "count": len(markers),
+        "coord_scale": COORD_SCALE,
+        "ids": [m.id for m in markers],
+        "kind_table": kind_table,
+        "kinds": kinds,
+        "lat": _deltas([round(m.lat * COORD_SCALE) for m in markers]),
+        "lng": _deltas([round(m.lng * COORD_SCALE) for m in markers]),
+        "ts": [_epoch_ms(m.timestamp) for m in markers],
+        "label_table": label_table,
+        "labels": labels,
+        "adcode_table": adcode_table,
+        "adcodes": adcodes,
+        "snippets": [m.snippet for m in markers],
+        "images": [m.image for m in markers],
+        "thumbnails": [m.thumbnail for m in markers],
+        "widths": [m.width for m in markers],
+        "heights": [m.height for m in markers],
+    }
+
+
+def encode_map_response(resp: MapResponse, fmt: str) -> bytes:
+    """按格式序列化地图响应，对应的 media type 见 MAP_MEDIA_TYPES。"""
+    if fmt == "columnar":
+        return json.dumps(to_columnar(resp), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if fmt == "msgpack":
+        return msgpack.packb(to_columnar(resp), use_bin_type=True)
+    return resp.model_dump_json().encode("utf-8")
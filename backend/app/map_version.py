@@ -1,15 +1,162 @@
-from sqlalchemy import select
+import asyncio
+import json
+import logging
+from typing import Callable
+
+import asyncpg
+from sqlalchemy import event, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
+from .config import get_settings
 from .models import MetaKV
 
 MAP_VERSION_KEY = "map_version"
+MAP_VERSION_CHANNEL = "lovejournal_map_version"
+PENDING_VERSION_KEY = "pending_map_version"
+
+# 分量版本号：每种条目 × 每个方面各一个，存放在 meta_kv 的 "version:<kind>:<facet>" 键下，
+# 值为该分量最后一次变化时分配的全局版本号（与 change_log / SSE 事件 id 同一序列）
+# - text：时间线可见的任意字段变化
+# - geo：影响地图的变化（条目修改前或修改后带坐标）
+# - tags：标签集合或带标签条目的时间变化
+FACETS = ("text", "geo", "tags")
+VERSION_KEY_PREFIX = "version:"
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def version_key(kind: str, facet: str) -> str:
+    return f"{VERSION_KEY_PREFIX}{kind}:{facet}"
+
+
+def version_keys(kinds, facet: str) -> list[str]:
+    return [version_key(kind, facet) for kind in kinds]
+
+
+class MapVersionWatcher:
+    """
+    在进程内缓存全局版本号与各分量版本号。
+
+    分配版本号的事务提交时通过 NOTIFY 广播新的版本，本进程（以及其他 uvicorn worker）的
+    LISTEN 连接收到后更新内存值，读路径因此无需查询 meta_kv。监听连接断开期间 versions
+    置为 None，读取函数自动退回数据库查询，重连后重新读取一次当前值。
+    """
+
+    def __init__(self, database_url: str):
+        url = make_url(database_url).set(drivername="postgresql")
+        self.dsn = url.render_as_string(hide_password=False)
+        self.versions: dict[str, int] | None = None
+        self._task: asyncio.Task | None = None
+        self._channels: dict[str, Callable[[str], None]] = {}
+        self._reconnect_callbacks: list[Callable[[], None]] = []
+
+    def listen(self, channel: str, handler: Callable[[str], None]) -> None:
+        """在同一条监听连接上额外订阅一个通知频道，需在 start() 之前注册。"""
+        self._channels[channel] = handler
+
+    def on_reconnect(self, callback: Callable[[], None]) -> None:
+        """监听连接（重新）建立后回调：断开期间的通知已丢失，订阅方需要自行补齐。"""
+        self._reconnect_callbacks.append(callback)
+
+    @property
+    def version(self) -> int | None:
+        if self.versions is None:
+            return None
+        return self.versions.get(MAP_VERSION_KEY, 1)
+
+    def observe(self, versions: dict[str, int]) -> None:
+        if self.versions is None:
+            return
+        for key, value in versions.items():
+            if value > self.versions.get(key, 0):
+                self.versions[key] = value
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        try:
+            versions = json.loads(payload)
+        except ValueError:
+            return
+        if isinstance(versions, dict):
+            self.observe({key: int(value) for key, value in versions.items()})
+
+    async def _listen_once(self) -> None:
+        conn = await asyncpg.connect(self.dsn)
+        closed = asyncio.Event()
+        conn.add_termination_listener(lambda _conn: closed.set())
+        try:
+            # 先 LISTEN 再读当前值，避免两者之间的通知丢失
+            await conn.add_listener(MAP_VERSION_CHANNEL, self._on_notify)
+            for channel, handler in self._channels.items():
+                await conn.add_listener(channel, lambda _c, _p, _ch, payload, handler=handler: handler(payload))
+            rows = await conn.fetch(
+                "SELECT key, value FROM meta_kv WHERE key = $1 OR key LIKE $2",
+                MAP_VERSION_KEY,
+                f"{VERSION_KEY_PREFIX}%",
+            )
+            current = _parse_versions((row["key"], row["value"]) for row in rows)
+            previous = self.versions or {}
+            self.versions = {
+                key: max(value, previous.get(key, 0)) for key, value in current.items()
+            }
+            for callback in self._reconnect_callbacks:
+                callback()
+            await closed.wait()
+        finally:
+            self.versions = None
+            if not conn.is_closed():
+                await conn.close()
+
+    async def _run(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                await self._listen_once()
+                delay = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("map version listener disconnected: %s", exc)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.versions = None
+
+
+def _parse_versions(rows) -> dict[str, int]:
+    versions = {}
+    for key, value in rows:
+        try:
+            versions[key] = int(value or 0)
+        except ValueError:
+            versions[key] = 0
+    return versions
+
+
+map_version_watcher = MapVersionWatcher(settings.database_url)
 
 
 async def get_map_version(session: AsyncSession) -> int:
     """
-    Ensure map version row exists and return current version as int.
+    Return current map version, from the in-process watcher when it is live.
     """
+    if map_version_watcher.version is not None:
+        return map_version_watcher.version
     res = await session.execute(select(MetaKV).where(MetaKV.key == MAP_VERSION_KEY))
     record = res.scalars().first()
     if not record:
@@ -23,22 +170,43 @@ async def get_map_version(session: AsyncSession) -> int:
         return 1
 
 
-async def bump_map_version(session: AsyncSession) -> int:
+async def get_data_version(session: AsyncSession, keys: list[str]) -> int:
     """
-    Increase map data version, used to bust caches on any data change.
+    返回若干分量中最大的版本号，即这些数据最后一次变化时的全局版本号。
+    它与 /api/changes、SSE 事件 id 属于同一序列，客户端可直接作为 since 使用；
+    不相关分量的变化不会让它增大。
     """
-    res = await session.execute(select(MetaKV).where(MetaKV.key == MAP_VERSION_KEY).with_for_update())
-    record = res.scalars().first()
-    if not record:
-        record = MetaKV(key=MAP_VERSION_KEY, value="1")
-        session.add(record)
-        await session.commit()
-        return 1
-    try:
-        next_ver = int(record.value or "0") + 1
-    except (TypeError, ValueError):
-        next_ver = 1
-    record.value = str(next_ver)
-    await session.commit()
-    await session.refresh(record)
-    return next_ver
+    if map_version_watcher.versions is not None:
+        return max((map_version_watcher.versions.get(key, 0) for key in keys), default=0)
+    res = await session.execute(select(MetaKV.key, MetaKV.value).where(MetaKV.key.in_(keys)))
+    return max(_parse_versions(res.all()).values(), default=0)
+
+
+async def publish_versions(session: AsyncSession, versions: dict[str, int]) -> None:
+    """
+    在调用方事务内写入新的全局版本号与分量版本号，由调用方提交；提交时 NOTIFY 把新值
+    广播给所有 worker。只由 app.changes.sequence_changes 在咨询锁内调用，写入路径不触碰这些行。
+    """
+    keys = sorted(versions)
+    stmt = insert(MetaKV).values([{"key": key, "value": str(versions[key])} for key in keys])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MetaKV.key],
+        set_={"value": stmt.excluded.value, "updated_at": func.now()},
+    )
+    await session.execute(stmt)
+    await session.execute(select(func.pg_notify(MAP_VERSION_CHANNEL, json.dumps(versions))))
+    pending = session.info.setdefault(PENDING_VERSION_KEY, {})
+    pending.update(versions)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed_version(session: Session) -> None:
+    # 本进程在提交后立即可见，不必等待通知回环
+    versions = session.info.pop(PENDING_VERSION_KEY, None)
+    if versions:
+        map_version_watcher.observe(versions)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_version(session: Session) -> None:
+    session.info.pop(PENDING_VERSION_KEY, None)
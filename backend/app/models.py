@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Float, Integer, String, Text, func
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Float, Index, Integer, String, Text, func
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .database import Base
@@ -31,6 +31,8 @@ class Entry(Base, TimestampMixin):
     tags: Mapped[str | None] = mapped_column(String(255), nullable=True)
     lat: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
     lng: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
+    # 位置解析状态：pending（后台解析中）/ ok / failed；无位置时为 NULL
+    geo_status: Mapped[str | None] = mapped_column(String(16), nullable=True)
 
 
 class KeyDate(Base):
@@ -47,6 +49,8 @@ class KeyDate(Base):
     )
     lat: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
     lng: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
+    # 位置解析状态：pending（后台解析中）/ ok / failed；无位置时为 NULL
+    geo_status: Mapped[str | None] = mapped_column(String(16), nullable=True)
 
 
 class Photo(Base, TimestampMixin):
@@ -60,6 +64,14 @@ class Photo(Base, TimestampMixin):
     tags: Mapped[str | None] = mapped_column(String(255), nullable=True)
     lat: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
     lng: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
+    # 位置解析状态：pending（后台解析中）/ ok / failed；无位置时为 NULL
+    geo_status: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    # 原图尺寸、主色、BlurHash 占位与派生图列表（JSON），由 app.imaging 生成
+    width: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    height: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    dominant_color: Mapped[str | None] = mapped_column(String(7), nullable=True)
+    blurhash: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    variants: Mapped[str | None] = mapped_column(Text, nullable=True)
 
 
 class MetaKV(Base):
@@ -70,3 +82,191 @@ class MetaKV(Base):
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=False), server_default=func.now(), onupdate=func.now(), nullable=False, index=True
     )
+
+
+class ItemTag(Base):
+    """标签倒排表：每个 (标签, 条目) 一行，替代对逗号拼接字符串的 LIKE 扫描。"""
+
+    __tablename__ = "item_tag"
+    __table_args__ = (
+        Index("ix_item_tag_item", "item_type", "item_id"),
+        Index("ix_item_tag_tag_ts", "tag", "ts"),
+    )
+
+    tag: Mapped[str] = mapped_column(String(255), primary_key=True)
+    item_type: Mapped[str] = mapped_column(String(16), primary_key=True)
+    item_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=False), nullable=False)
+
+
+class TagStat(Base):
+    """标签计数，由 item_tag 的写入增量维护，/api/tags 直接读取。"""
+
+    __tablename__ = "tag_stat"
+
+    tag: Mapped[str] = mapped_column(String(255), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_used_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=False), nullable=True)
+
+
+class TimelineItem(Base):
+    """
+    时间线 / 地图的统一投影，每个 Entry / KeyDate / Photo 一行。
+    由写入路径在同一事务中维护，查询只需读这一张有序索引的表。
+    """
+
+    __tablename__ = "timeline_item"
+
+    type: Mapped[str] = mapped_column(String(16), primary_key=True)
+    source_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=False), nullable=False)
+    content: Mapped[str | None] = mapped_column(Text, nullable=True)
+    caption: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    title: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    snippet: Mapped[str] = mapped_column(String(120), nullable=False, default="")
+    location: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    filename: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    image: Mapped[str | None] = mapped_column(String(300), nullable=True)
+    tags: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    lat: Mapped[float | None] = mapped_column(Float, nullable=True)
+    lng: Mapped[float | None] = mapped_column(Float, nullable=True)
+    adcode: Mapped[str | None] = mapped_column(String(12), nullable=True, index=True)
+    geo_status: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    # 原图尺寸、主色、BlurHash 占位与派生图列表（JSON）（仅照片）
+    width: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    height: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    dominant_color: Mapped[str | None] = mapped_column(String(7), nullable=True)
+    blurhash: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    variants: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+
+Index(
+    "ix_timeline_item_order",
+    TimelineItem.timestamp.desc(),
+    TimelineItem.type.desc(),
+    TimelineItem.source_id.desc(),
+)
+# 视口查询使用的空间索引：PostgreSQL 内置 point 类型 + GiST，无需 PostGIS
+Index(
+    "ix_timeline_item_geo",
+    func.point(TimelineItem.lng, TimelineItem.lat),
+    postgresql_using="gist",
+)
+# 按类型筛选时（?type=photo 等）使用，type 为等值条件后仍保持时间倒序
+Index(
+    "ix_timeline_item_type_order",
+    TimelineItem.type,
+    TimelineItem.timestamp.desc(),
+    TimelineItem.source_id.desc(),
+)
+# 地图只读有坐标的行：部分索引只收录这些行，按时间倒序扫描时 LIMIT 取到的都是可用标记
+Index(
+    "ix_timeline_item_located",
+    TimelineItem.timestamp.desc(),
+    TimelineItem.type.desc(),
+    TimelineItem.source_id.desc(),
+    postgresql_where=TimelineItem.lat.is_not(None),
+)
+
+
+class RegionStat(Base):
+    """按行政区划 (adcode)、类型、年份的条目计数，供省/市分级着色使用，由写入路径增量维护。"""
+
+    __tablename__ = "region_stat"
+
+    adcode: Mapped[str] = mapped_column(String(12), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(16), primary_key=True)
+    year: Mapped[int] = mapped_column(Integer, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class ChangeLog(Base):
+    """
+    增删改记录，version 为该次写入被分配的全局版本号；删除以 op="delete" 的墓碑保留。
+    客户端凭上次看到的版本号增量同步，过旧的记录会被压缩清理。
+    """
+
+    __tablename__ = "change_log"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)
+    item_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    op: Mapped[str] = mapped_column(String(8), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=False), server_default=func.now(), nullable=False
+    )
+
+
+class PendingChange(Base):
+    """
+    写事务登记的、尚未分配版本号的变更。写入路径只插入本表，不修改任何共享行；
+    提交后由 app.changes.sequence_changes 按提交顺序分配全局版本号并移入 change_log。
+    facets 为逗号分隔的受影响版本分量。
+    """
+
+    __tablename__ = "pending_change"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)
+    item_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    op: Mapped[str] = mapped_column(String(8), nullable=False)
+    facets: Mapped[str] = mapped_column(String(64), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=False), server_default=func.now(), nullable=False
+    )
+
+
+class GeoCacheEntry(Base):
+    """
+    地理编码结果的持久缓存，跨进程、跨重启共享。
+    value 为 JSON；查询无结果时为 NULL，以较短的过期时间缓存。
+    """
+
+    __tablename__ = "geo_cache"
+
+    key: Mapped[str] = mapped_column(String(300), primary_key=True)
+    value: Mapped[str | None] = mapped_column(Text, nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), nullable=False, index=True)
+
+
+class GeoJob(Base):
+    """
+    后台地理编码任务，每个条目至多一条。写入路径只保存原始位置输入并立即提交，
+    worker 解析出坐标与 adcode 后回写条目；revision 在重新入队时递增，
+    解析期间条目又被修改时据此丢弃过期结果。
+    """
+
+    __tablename__ = "geo_job"
+
+    kind: Mapped[str] = mapped_column(String(16), primary_key=True)
+    item_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # remerge 为真时 location / coords 是用户输入，需要重新合并出位置文本；否则沿用条目当前的位置
+    location: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    coords: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    source_location: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    remerge: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
+    revision: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_run_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), nullable=False, index=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=False), server_default=func.now(), nullable=False
+    )
+
+
+class PhotoBlob(Base):
+    """
+    按内容寻址的照片文件：文件名为 <sha256><扩展名>，相同内容的上传共用一个文件与一组派生图。
+    refcount 为引用该文件的 photo 行数，归零时删除文件；app.manage gc-uploads 按 photo 表校正。
+    没有对应行的旧文件（uuid 命名）由单张照片独占。
+    """
+
+    __tablename__ = "photo_blob"
+
+    filename: Mapped[str] = mapped_column(String(255), primary_key=True)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    refcount: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=False), server_default=func.now(), nullable=False
+    )
@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..changes import changes_since
+from ..database import get_session
+from ..map_version import get_map_version
+from ..models import TimelineItem
+from ..schemas import ChangeItem, ChangesResponse
+from .map import to_map_marker
+from .timeline import to_timeline_entry
+
+router = APIRouter(prefix="/api", tags=["changes"])
+
+
+def _upsert(row: TimelineItem, version: int) -> ChangeItem:
+    return ChangeItem(
+        kind=row.type,
+        id=row.source_id,
+        op="upsert",
+        version=version,
+        item=to_timeline_entry(row),
+        marker=to_map_marker(row),
+    )
+
+
+@router.get("/changes", response_model=ChangesResponse)
+async def get_changes(
+    since: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    返回 since 版本之后新增、修改和删除的条目；同一条目只返回最后一次变更。
+    日志已被压缩到 since 之后时返回 reset=true 与全部条目的快照，客户端应整体替换本地数据。
+    """
+    current_version = await get_map_version(session)
+    if since >= current_version:
+        return ChangesResponse(version=current_version, changes=[])
+
+    logged = await changes_since(session, since)
+    if logged is None:
+        res = await session.execute(
+            select(TimelineItem).order_by(
+                TimelineItem.timestamp.desc(), TimelineItem.type.desc(), TimelineItem.source_id.desc()
+            )
+        )
+        changes = [_upsert(row, current_version) for row in res.scalars()]
+        return ChangesResponse(version=current_version, reset=True, changes=changes)
+
+    upserted = [(c.kind, c.item_id) for c in logged if c.op == "upsert"]
+    rows: dict[tuple[str, int], TimelineItem] = {}
+    if upserted:
+        res = await session.execute(
+            select(TimelineItem).where(tuple_(TimelineItem.type, TimelineItem.source_id).in_(upserted))
+        )
+        rows = {(row.type, row.source_id): row for row in res.scalars()}
+
+    changes = []
+    for change in logged:
+        row = rows.get((change.kind, change.item_id))
+        if change.op == "upsert" and row is not None:
+            changes.append(_upsert(row, change.version))
+        else:
+            changes.append(
+                ChangeItem(kind=change.kind, id=change.item_id, op="delete", version=change.version)
+            )
+    # 读取版本号之后提交的变更也可能出现在日志里，以实际返回的最大版本为准
+    version = max([current_version] + [c.version for c in changes])
+    return ChangesResponse(version=version, changes=changes)
@@ -1,18 +1,29 @@
-import os
-import uuid
 from datetime import datetime
 from pathlib import Path
 
 from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..blobs import release_blob, reuse_derivatives, store_blob
+from ..changes import commit_changes, record_change
 from ..config import get_settings
 from ..database import get_session
 from ..deps import get_current_user
-from ..map_version import bump_map_version
+from ..geo_jobs import cancel_geo_job, enqueue_geo_job
+from ..imaging import build_derivatives, image_fields
+from ..indexing import index_item, unindex_item
 from ..models import Entry, KeyDate, Photo, User
 from ..schemas import EntryCreate, EntryUpdate, KeyDateBase, KeyDateUpdate, TimelineEntry
-from ..utils import GeoHelper, extract_tags, parse_datetime
+from ..uploads import stream_upload
+from ..utils import (
+    GeoHelper,
+    LocationInput,
+    apply_geo_info,
+    ensure_coords,
+    format_tags,
+    merge_location_offline,
+    parse_datetime,
+)
 
 router = APIRouter(prefix="/api", tags=["entries"])
 settings = get_settings()
@@ -32,11 +43,6 @@ async def _get_geo_helper(request: Request) -> GeoHelper:
     return helper
 
 
-def _format_tags(*parts: str | None) -> str | None:
-    tags = extract_tags(*parts)
-    return ",".join(tags) if tags else None
-
-
 def _timeline_entry_from_entry(entry: Entry) -> TimelineEntry:
     return TimelineEntry(
         id=entry.id,
@@ -45,50 +51,25 @@ def _timeline_entry_from_entry(entry: Entry) -> TimelineEntry:
         content=entry.content,
         location=entry.location,
         tags=[t for t in (entry.tags or "").split(",") if t],
+        geo_status=entry.geo_status,
     )
 
 
 
-async def _assign_geo_info(
-    target,
-    geo_helper: GeoHelper,
-    location_text: str | None,
-    source_location: str | None = None,
-    *,
-    update_requested: bool = True,
-    allow_clear: bool = True,
-):
-    if not update_requested:
-        return
-
-    prev_lat, prev_lng, prev_adcode = target.lat, target.lng, getattr(target, "adcode", None)
-    raw_text = location_text if location_text else source_location
-    cleaned = (raw_text or "").strip()
-
-    # 用户明确清空位置
-    if raw_text is not None and cleaned == "":
-        if allow_clear:
-            target.lat = None
-            target.lng = None
-            target.adcode = None
-        return
-
-    lat, lng, adcode = prev_lat, prev_lng, prev_adcode
-    geo_info = await geo_helper.resolve_location(cleaned) if cleaned else None
-    if geo_info:
-        lat, lng, adcode = geo_info
-    else:
-        coords_only = geo_helper.parse_coords_from_location(cleaned) if cleaned else None
-        if coords_only:
-            lat, lng = coords_only[0], coords_only[1]
-            adcode = await geo_helper.reverse_geocode(lat, lng)
-
-    if lat is not None and lng is not None and not adcode:
-        adcode = await geo_helper.reverse_geocode(lat, lng) or adcode
-
-    target.lat = lat
-    target.lng = lng
-    target.adcode = adcode
+
+def _timeline_entry_from_photo(photo: Photo) -> TimelineEntry:
+    return TimelineEntry(
+        id=photo.id,
+        type="photo",
+        timestamp=photo.created_at or datetime.now(),
+        caption=photo.caption,
+        location=photo.location,
+        tags=[t for t in (photo.tags or "").split(",") if t],
+        image=f"/uploads/{photo.filename}",
+        geo_status=photo.geo_status,
+        **image_fields(photo),
+    )
+
 
 @router.post("/entries", response_model=TimelineEntry, status_code=status.HTTP_201_CREATED)
 async def create_entry(
@@ -98,19 +79,24 @@ async def create_entry(
     _: User = Depends(get_current_user),
 ):
     geo_helper = await _get_geo_helper(request)
-    location = await geo_helper.merge_location_and_coords(payload.location, payload.location_coords)
-    tags = _format_tags(payload.content, location)
+    geo = await merge_location_offline(geo_helper, payload.location, payload.location_coords, payload.location)
+    tags = format_tags(payload.content, geo.location)
     entry = Entry(
         content=payload.content,
         created_at=payload.created_at or datetime.now(),
-        location=location,
+        location=geo.location,
         tags=tags,
     )
-    await _assign_geo_info(entry, geo_helper, location, payload.location)
+    pending = await apply_geo_info(entry, geo_helper, geo)
     session.add(entry)
-    await session.commit()
+    await session.flush()
+    ensure_coords(entry, geo_helper)
+    if pending:
+        await enqueue_geo_job(session, "entry", entry.id, geo)
+    facets = await index_item(session, "entry", entry)
+    await record_change(session, "entry", entry.id, "upsert", facets)
+    await commit_changes(session)
     await session.refresh(entry)
-    await bump_map_version(session)
     return _timeline_entry_from_entry(entry)
 
 
@@ -126,32 +112,34 @@ async def update_entry(
     if not entry:
         raise HTTPException(status_code=404, detail="Entry not found")
     geo_helper = await _get_geo_helper(request)
-    updated_location = entry.location
+    geo = LocationInput(entry.location, None, payload.location)
     location_updated = payload.location is not None or payload.location_coords is not None
     if location_updated:
-        updated_location = await geo_helper.merge_location_and_coords(
+        geo = await merge_location_offline(
+            geo_helper,
             payload.location if payload.location is not None else entry.location,
             payload.location_coords,
+            payload.location,
         )
-        entry.location = updated_location
+        entry.location = geo.location
     if payload.content is not None:
         entry.content = payload.content
     if payload.created_at is not None:
         entry.created_at = payload.created_at
-    entry.tags = _format_tags(entry.content, updated_location)
+    entry.tags = format_tags(entry.content, entry.location)
     needs_adcode_backfill = not location_updated and entry.lat is not None and entry.lng is not None and not entry.adcode
+    pending = False
     if location_updated or needs_adcode_backfill:
-        await _assign_geo_info(
-            entry,
-            geo_helper,
-            updated_location,
-            payload.location,
-            update_requested=True,
-            allow_clear=location_updated,
-        )
-    await session.commit()
+        pending = await apply_geo_info(entry, geo_helper, geo, allow_clear=location_updated)
+    ensure_coords(entry, geo_helper)
+    if pending:
+        await enqueue_geo_job(session, "entry", entry.id, geo, remerge=location_updated)
+    elif location_updated:
+        await cancel_geo_job(session, "entry", entry.id)
+    facets = await index_item(session, "entry", entry)
+    await record_change(session, "entry", entry.id, "upsert", facets)
+    await commit_changes(session)
     await session.refresh(entry)
-    await bump_map_version(session)
     return _timeline_entry_from_entry(entry)
 
 
@@ -164,9 +152,11 @@ async def delete_entry(
     entry = await session.get(Entry, entry_id)
     if not entry:
         raise HTTPException(status_code=404, detail="Entry not found")
+    facets = await unindex_item(session, "entry", entry.id)
+    await cancel_geo_job(session, "entry", entry.id)
+    await record_change(session, "entry", entry.id, "delete", facets)
     await session.delete(entry)
-    await session.commit()
-    await bump_map_version(session)
+    await commit_changes(session)
     return {"ok": True}
 
 
@@ -178,14 +168,19 @@ async def create_keydate(
     _: User = Depends(get_current_user),
 ):
     geo_helper = await _get_geo_helper(request)
-    location = await geo_helper.merge_location_and_coords(payload.location, payload.location_coords)
+    geo = await merge_location_offline(geo_helper, payload.location, payload.location_coords, payload.location)
     date = payload.date or datetime.now()
-    kd = KeyDate(title=payload.title, date=date, location=location, tags=_format_tags(payload.title, location))
-    await _assign_geo_info(kd, geo_helper, location, payload.location)
+    kd = KeyDate(title=payload.title, date=date, location=geo.location, tags=format_tags(payload.title, geo.location))
+    pending = await apply_geo_info(kd, geo_helper, geo)
     session.add(kd)
-    await session.commit()
+    await session.flush()
+    ensure_coords(kd, geo_helper)
+    if pending:
+        await enqueue_geo_job(session, "keydate", kd.id, geo)
+    facets = await index_item(session, "keydate", kd)
+    await record_change(session, "keydate", kd.id, "upsert", facets)
+    await commit_changes(session)
     await session.refresh(kd)
-    await bump_map_version(session)
     return TimelineEntry(
         id=kd.id,
         type="keydate",
@@ -193,6 +188,7 @@ async def create_keydate(
         title=kd.title,
         location=kd.location,
         tags=[t for t in (kd.tags or "").split(",") if t],
+        geo_status=kd.geo_status,
     )
 
 
@@ -208,32 +204,34 @@ async def update_keydate(
     if not kd:
         raise HTTPException(status_code=404, detail="Key date not found")
     geo_helper = await _get_geo_helper(request)
-    updated_location = kd.location
+    geo = LocationInput(kd.location, None, payload.location)
     location_updated = payload.location is not None or payload.location_coords is not None
     if location_updated:
-        updated_location = await geo_helper.merge_location_and_coords(
+        geo = await merge_location_offline(
+            geo_helper,
             payload.location if payload.location is not None else kd.location,
             payload.location_coords,
+            payload.location,
         )
-        kd.location = updated_location
+        kd.location = geo.location
     if payload.title is not None:
         kd.title = payload.title
     if payload.date is not None:
         kd.date = payload.date
-    kd.tags = _format_tags(kd.title, updated_location)
+    kd.tags = format_tags(kd.title, kd.location)
     needs_adcode_backfill = not location_updated and kd.lat is not None and kd.lng is not None and not kd.adcode
+    pending = False
     if location_updated or needs_adcode_backfill:
-        await _assign_geo_info(
-            kd,
-            geo_helper,
-            updated_location,
-            payload.location,
-            update_requested=True,
-            allow_clear=location_updated,
-        )
-    await session.commit()
+        pending = await apply_geo_info(kd, geo_helper, geo, allow_clear=location_updated)
+    ensure_coords(kd, geo_helper)
+    if pending:
+        await enqueue_geo_job(session, "keydate", kd.id, geo, remerge=location_updated)
+    elif location_updated:
+        await cancel_geo_job(session, "keydate", kd.id)
+    facets = await index_item(session, "keydate", kd)
+    await record_change(session, "keydate", kd.id, "upsert", facets)
+    await commit_changes(session)
     await session.refresh(kd)
-    await bump_map_version(session)
     return TimelineEntry(
         id=kd.id,
         type="keydate",
@@ -241,6 +239,7 @@ async def update_keydate(
         title=kd.title,
         location=kd.location,
         tags=[t for t in (kd.tags or "").split(",") if t],
+        geo_status=kd.geo_status,
     )
 
 
@@ -253,9 +252,11 @@ async def delete_keydate(
     kd = await session.get(KeyDate, keydate_id)
     if not kd:
         raise HTTPException(status_code=404, detail="Key date not found")
+    facets = await unindex_item(session, "keydate", kd.id)
+    await cancel_geo_job(session, "keydate", kd.id)
+    await record_change(session, "keydate", kd.id, "delete", facets)
     await session.delete(kd)
-    await session.commit()
-    await bump_map_version(session)
+    await commit_changes(session)
     return {"ok": True}
 
 
@@ -273,37 +274,36 @@ async def create_photo(
     if not file:
         raise HTTPException(status_code=400, detail="No file uploaded")
     geo_helper = await _get_geo_helper(request)
-    merged_location = await geo_helper.merge_location_and_coords(location, location_coords)
+    geo = await merge_location_offline(geo_helper, location, location_coords, location)
     dt = parse_datetime(custom_date)
 
     upload_dir = _ensure_upload_dir()
-    ext = os.path.splitext(file.filename)[1].lower()
-    save_name = f"{uuid.uuid4().hex}{ext}"
-    dest = upload_dir / save_name
-    content = await file.read()
-    dest.write_bytes(content)
+    staged = await stream_upload(file, upload_dir)
+    # 按内容哈希存储，重复上传只增加引用计数
+    created = await store_blob(session, staged, upload_dir)
 
     photo = Photo(
-        filename=save_name,
+        filename=staged.filename,
         caption=caption or None,
         created_at=dt,
-        location=merged_location,
-        tags=_format_tags(caption, merged_location),
+        location=geo.location,
+        tags=format_tags(caption, geo.location),
     )
-    await _assign_geo_info(photo, geo_helper, merged_location, location)
+    pending = await apply_geo_info(photo, geo_helper, geo)
+    # 缩略图、尺寸与占位信息在进程池中生成，重复上传直接沿用已有的派生图；
+    # 新内容的派生图由 store_blob 登记，事务未提交时一并删除
+    if created or not await reuse_derivatives(session, photo):
+        await build_derivatives(photo, upload_dir, staged.temp_path)
     session.add(photo)
-    await session.commit()
+    await session.flush()
+    ensure_coords(photo, geo_helper)
+    if pending:
+        await enqueue_geo_job(session, "photo", photo.id, geo)
+    facets = await index_item(session, "photo", photo)
+    await record_change(session, "photo", photo.id, "upsert", facets)
+    await commit_changes(session)
     await session.refresh(photo)
-    await bump_map_version(session)
-    return TimelineEntry(
-        id=photo.id,
-        type="photo",
-        timestamp=photo.created_at or datetime.now(),
-        caption=photo.caption,
-        location=photo.location,
-        tags=[t for t in (photo.tags or "").split(",") if t],
-        image=f"/uploads/{photo.filename}",
-    )
+    return _timeline_entry_from_photo(photo)
 
 
 @router.put("/photos/{photo_id}", response_model=TimelineEntry)
@@ -324,52 +324,41 @@ async def update_photo(
 
     geo_helper = await _get_geo_helper(request)
     location_updated = location is not None or location_coords is not None
-    merged_location = photo.location
+    geo = LocationInput(photo.location, None, location)
     if location_updated:
-        merged_location = await geo_helper.merge_location_and_coords(location, location_coords)
-        photo.location = merged_location
+        geo = await merge_location_offline(geo_helper, location, location_coords, location)
+        photo.location = geo.location
     dt = parse_datetime(custom_date)
     photo.caption = caption or photo.caption
     photo.created_at = dt or photo.created_at
     needs_adcode_backfill = not location_updated and photo.lat is not None and photo.lng is not None and not photo.adcode
+    pending = False
     if location_updated or needs_adcode_backfill:
-        await _assign_geo_info(
-            photo,
-            geo_helper,
-            merged_location,
-            location,
-            update_requested=True,
-            allow_clear=location_updated,
-        )
+        pending = await apply_geo_info(photo, geo_helper, geo, allow_clear=location_updated)
 
     upload_dir = _ensure_upload_dir()
     if file and file.filename:
-        ext = os.path.splitext(file.filename)[1].lower()
-        save_name = f"{uuid.uuid4().hex}{ext}"
-        dest = upload_dir / save_name
-        dest.write_bytes(await file.read())
-        # remove old file
-        old_path = upload_dir / photo.filename
-        if old_path.exists():
-            try:
-                old_path.unlink()
-            except OSError:
-                pass
-        photo.filename = save_name
-
-    photo.tags = _format_tags(photo.caption, photo.location)
-    await session.commit()
+        staged = await stream_upload(file, upload_dir)
+        old_filename = photo.filename
+        # 先登记新文件再释放旧文件，内容相同时引用计数不会中途归零
+        created = await store_blob(session, staged, upload_dir, replacing=old_filename)
+        if staged.filename != old_filename:
+            photo.filename = staged.filename
+            if created or not await reuse_derivatives(session, photo):
+                await build_derivatives(photo, upload_dir, staged.temp_path)
+        await release_blob(session, old_filename, upload_dir)
+
+    photo.tags = format_tags(photo.caption, photo.location)
+    ensure_coords(photo, geo_helper)
+    if pending:
+        await enqueue_geo_job(session, "photo", photo.id, geo, remerge=location_updated)
+    elif location_updated:
+        await cancel_geo_job(session, "photo", photo.id)
+    facets = await index_item(session, "photo", photo)
+    await record_change(session, "photo", photo.id, "upsert", facets)
+    await commit_changes(session)
     await session.refresh(photo)
-    await bump_map_version(session)
-    return TimelineEntry(
-        id=photo.id,
-        type="photo",
-        timestamp=photo.created_at or datetime.now(),
-        caption=photo.caption,
-        location=photo.location,
-        tags=[t for t in (photo.tags or "").split(",") if t],
-        image=f"/uploads/{photo.filename}",
-    )
+    return _timeline_entry_from_photo(photo)
 
 
 @router.delete("/photos/{photo_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -382,13 +371,12 @@ async def delete_photo(
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
     upload_dir = _ensure_upload_dir()
-    img_path = upload_dir / photo.filename
-    if img_path.exists():
-        try:
-            img_path.unlink()
-        except OSError:
-            pass
+    facets = await unindex_item(session, "photo", photo.id)
+    await cancel_geo_job(session, "photo", photo.id)
+    await record_change(session, "photo", photo.id, "delete", facets)
     await session.delete(photo)
-    await session.commit()
-    await bump_map_version(session)
+    await session.flush()
+    # 其它照片仍引用同一文件时只减少引用计数
+    await release_blob(session, photo.filename, upload_dir)
+    await commit_changes(session)
     return {"ok": True}
@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+from fastapi import APIRouter, Header, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+
+from ..changes import changes_since
+from ..config import get_settings
+from ..database import SessionLocal
+from ..deps import user_from_token
+from ..events import event_broker
+from ..map_version import get_map_version
+
+router = APIRouter(prefix="/api", tags=["events"])
+settings = get_settings()
+
+# 断线后浏览器 EventSource 的重连间隔（毫秒）
+RETRY_MS = 3000
+
+
+def _sse(event: str, data: dict, event_id: int | None = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def _replay(since: int) -> tuple[list[str], int]:
+    """从变更日志补发 since 之后的变更；日志已被压缩时发送 reset，客户端应全量刷新。"""
+    async with SessionLocal() as session:
+        changes = await changes_since(session, since)
+        current = await get_map_version(session)
+    if changes is None:
+        return [_sse("reset", {"version": current}, current)], current
+    chunks = []
+    for change in changes:
+        data = {"kind": change.kind, "id": change.item_id, "op": change.op, "version": change.version}
+        chunks.append(_sse("change", data, change.version))
+        since = max(since, change.version)
+    return chunks, since
+
+
+def _parse_event_id(value: str | None) -> int | None:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    token: str | None = None,
+    last_event_id: str | None = None,
+    last_event_id_header: str | None = Header(None, alias="Last-Event-ID"),
+):
+    """
+    以 SSE 推送变更通知：event: change，data 为 {kind, id, op, version}，id 为版本号。
+
+    EventSource 无法设置请求头，所以令牌可通过 ?token= 传入。浏览器断线重连时会带上
+    Last-Event-ID，服务端据此从变更日志补发遗漏的事件；空闲时定期发送注释行作为心跳。
+    """
+    if not token:
+        scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    async with SessionLocal() as session:
+        user = await user_from_token(session, token)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    resume_from = _parse_event_id(last_event_id_header or last_event_id)
+
+    async def stream():
+        # 先订阅再补发，补发期间到达的事件留在队列里，按版本号去重
+        subscriber = event_broker.subscribe()
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            if resume_from is None:
+                async with SessionLocal() as session:
+                    sent = await get_map_version(session)
+                yield _sse("ready", {"version": sent}, sent)
+            else:
+                chunks, sent = await _replay(resume_from)
+                for chunk in chunks:
+                    yield chunk
+            while True:
+                try:
+                    change = await asyncio.wait_for(
+                        subscriber.queue.get(), timeout=settings.events_heartbeat_seconds
+                    )
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if change is None:
+                    chunks, sent = await _replay(sent)
+                    for chunk in chunks:
+                        yield chunk
+                elif change.get("version", 0) > sent:
+                    sent = change["version"]
+                    yield _sse("change", change, sent)
+        finally:
+            event_broker.unsubscribe(subscriber)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers)
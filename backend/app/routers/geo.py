@@ -0,0 +1,14 @@
+from fastapi import APIRouter, Depends, Request
+
+from ..deps import get_current_user
+from ..models import User
+from ..schemas import GeoStatsResponse
+
+router = APIRouter(prefix="/api/geo", tags=["geo"])
+
+
+@router.get("/stats", response_model=GeoStatsResponse)
+async def get_geo_stats(request: Request, _: User = Depends(get_current_user)):
+    """当前 worker 的地理编码缓存命中统计与高德熔断器状态。"""
+    geo_helper = request.app.state.geo_helper
+    return GeoStatsResponse(cache=geo_helper.cache.stats(), breaker=geo_helper.breaker.stats())
@@ -1,188 +1,283 @@
-from datetime import datetime
-
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy import func, literal, or_, select, union_all
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import func, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..cache import cached_json_response, cached_response
+from ..clustering import MAX_ZOOM, BBox, ClusterPoint, cluster_cache, split_bbox
 from ..config import get_settings
 from ..database import get_session
-from ..map_version import get_map_version
-from ..models import Entry, KeyDate, Photo
-from ..schemas import MapMarker, MapResponse
-from ..utils import GeoHelper
+from ..imaging import parse_variants, thumbnail_url
+from ..indexing import TYPE_ALIASES, kind_filter, region_year, resolve_kinds, tag_filter
+from ..map_codec import MAP_MEDIA_TYPES, encode_map_response, format_available, negotiate_format
+from ..map_version import get_data_version, version_keys
+from ..models import RegionStat, TimelineItem
+from ..schemas import (
+    MapCluster,
+    MapClusterSample,
+    MapMarker,
+    MapResponse,
+    RegionResponse,
+    RegionStatOut,
+)
+from ..search import search_clause
 
 router = APIRouter(prefix="/api", tags=["map"])
 settings = get_settings()
-geo_helper = GeoHelper(settings.amap_key)
 
 
-def _resolve_coords(location: str | None, lat: float | None, lng: float | None):
-    if lat is not None and lng is not None:
-        return float(lat), float(lng)
-    parsed = geo_helper.parse_coords_from_location(location)
-    if parsed:
-        return float(parsed[0]), float(parsed[1])
-    return None
+def to_map_marker(row: TimelineItem) -> MapMarker | None:
+    if row.lat is None or row.lng is None:
+        return None
+    return MapMarker(
+        id=row.source_id,
+        kind=row.type,
+        lat=row.lat,
+        lng=row.lng,
+        label=(row.location or "").strip(),
+        timestamp=row.timestamp.isoformat(),
+        snippet=row.snippet,
+        image=row.image,
+        adcode=row.adcode,
+        thumbnail=thumbnail_url(parse_variants(row.variants)),
+        width=row.width,
+        height=row.height,
+    )
+
+
+def parse_bbox(value: str) -> BBox:
+    """解析 ?bbox=minLng,minLat,maxLng,maxLat；minLng > maxLng 表示跨越 180° 经线的视口。"""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(part) for part in value.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be minLng,minLat,maxLng,maxLat")
+    if not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise HTTPException(status_code=400, detail="Invalid bbox range")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def bbox_clause(bbox: BBox):
+    """point(lng, lat) <@ box，与 ix_timeline_item_geo 的表达式一致，走 GiST 索引；跨 180° 经线时两段取 OR。"""
+    point = func.point(TimelineItem.lng, TimelineItem.lat)
+    return or_(
+        *(
+            point.op("<@")(func.box(func.point(min_lng, min_lat), func.point(max_lng, max_lat)))
+            for min_lng, min_lat, max_lng, max_lat in split_bbox(bbox)
+        )
+    )
 
 
-def _tag_clause(column, tag: str):
-    wrapped = literal(",") + func.lower(func.coalesce(column, "")) + literal(",")
-    return wrapped.like(f"%,{tag},%")
+def _filter_map_items(stmt, search: str, kinds: list[str], tag: str, bbox: BBox | None):
+    # 坐标在写入时已解析进 lat/lng，lat IS NOT NULL 与部分索引 ix_timeline_item_located 的条件一致
+    stmt = stmt.where(TimelineItem.lat.is_not(None), TimelineItem.lng.is_not(None))
+    if bbox:
+        stmt = stmt.where(bbox_clause(bbox))
+    kind_clause = kind_filter(kinds)
+    if kind_clause is not None:
+        stmt = stmt.where(kind_clause)
+    if search:
+        stmt = stmt.where(
+            search_clause(
+                search,
+                TimelineItem.content,
+                TimelineItem.title,
+                TimelineItem.caption,
+                TimelineItem.location,
+            )
+        )
+    if tag:
+        stmt = stmt.where(tag_filter(tag))
+    return stmt.order_by(
+        TimelineItem.timestamp.desc(), TimelineItem.type.desc(), TimelineItem.source_id.desc()
+    )
 
 
 async def _build_map_markers(
-    session: AsyncSession, search: str, type_filter: str, tag: str, limit: int
+    session: AsyncSession,
+    search: str,
+    type_filter: str,
+    tag: str,
+    limit: int,
+    bbox: BBox | None = None,
 ) -> list[MapMarker]:
     search = (search or "").strip().lower()
-    type_filter = (type_filter or "all").lower()
     tag = (tag or "").strip().lower()
+    kinds = resolve_kinds(type_filter)
+    if not kinds:
+        return []
 
-    include_entry = type_filter in ("all", "entry", "text")
-    include_photo = type_filter in ("all", "photo", "img", "image")
-    include_keydate = type_filter in ("all", "keydate", "date", "anniversary")
-
-    selects = []
-
-    def add_select(
-        model,
-        type_label: str,
-        ts_col,
-        content_col,
-        caption_col,
-        title_col,
-        location_col,
-        tags_col,
-        image_col,
-        lat_col,
-        lng_col,
-        adcode_col,
-    ):
-        stmt = select(
-            model.id.label("id"),
-            literal(type_label).label("type"),
-            ts_col.label("timestamp"),
-            content_col.label("content"),
-            caption_col.label("caption"),
-            title_col.label("title"),
-            location_col.label("location"),
-            tags_col.label("tags"),
-            image_col.label("image"),
-            lat_col.label("lat"),
-            lng_col.label("lng"),
-            adcode_col.label("adcode"),
-        ).where(
-            or_(
-                func.length(func.trim(location_col)) > 0,
-                lat_col.is_not(None),
-                lng_col.is_not(None),
-            )
-        )
-        if search:
-            like = f"%{search}%"
-            stmt = stmt.where(
-                or_(
-                    func.lower(func.coalesce(content_col, "")).like(like),
-                    func.lower(func.coalesce(title_col, "")).like(like),
-                    func.lower(func.coalesce(caption_col, "")).like(like),
-                    func.lower(func.coalesce(location_col, "")).like(like),
-                )
-            )
-        if tag:
-            stmt = stmt.where(_tag_clause(tags_col, tag))
-        selects.append(stmt)
-
-    if include_entry:
-        add_select(
-            Entry,
-            "entry",
-            func.coalesce(Entry.created_at, func.now()),
-            Entry.content,
-            literal(None),
-            literal(None),
-            Entry.location,
-            Entry.tags,
-            literal(None),
-            Entry.lat,
-            Entry.lng,
-            Entry.adcode,
-        )
+    stmt = _filter_map_items(select(TimelineItem), search, kinds, tag, bbox).limit(limit)
+    res = await session.execute(stmt)
+    return [to_map_marker(row) for row in res.scalars()]
 
-    if include_keydate:
-        add_select(
-            KeyDate,
-            "keydate",
-            KeyDate.date,
-            literal(None),
-            literal(None),
-            KeyDate.title,
-            KeyDate.location,
-            KeyDate.tags,
-            literal(None),
-            KeyDate.lat,
-            KeyDate.lng,
-            KeyDate.adcode,
-        )
 
-    if include_photo:
-        add_select(
-            Photo,
-            "photo",
-            func.coalesce(Photo.created_at, func.now()),
-            literal(None),
-            Photo.caption,
-            literal(None),
-            Photo.location,
-            Photo.tags,
-            (literal("/uploads/") + Photo.filename),
-            Photo.lat,
-            Photo.lng,
-            Photo.adcode,
+async def _build_map_clusters(
+    session: AsyncSession,
+    version: int,
+    search: str,
+    type_filter: str,
+    tag: str,
+    zoom: int,
+    bbox: BBox | None = None,
+) -> list[MapCluster]:
+    search = (search or "").strip().lower()
+    tag = (tag or "").strip().lower()
+    kinds = resolve_kinds(type_filter)
+    if not kinds:
+        return []
+
+    async def load_points() -> list[ClusterPoint]:
+        columns = select(TimelineItem.type, TimelineItem.source_id, TimelineItem.lat, TimelineItem.lng)
+        stmt = _filter_map_items(columns, search, kinds, tag, None)
+        res = await session.execute(stmt)
+        return [
+            ClusterPoint(kind=kind, id=source_id, lat=lat, lng=lng) for kind, source_id, lat, lng in res.all()
+        ]
+
+    # 聚合索引覆盖全部数据，按版本缓存；视口只在内存中过滤
+    index = await cluster_cache.get((version, search, tuple(kinds), tag), load_points)
+    clusters = await index.query(zoom, bbox)
+    return [
+        MapCluster(
+            lat=cluster.lat,
+            lng=cluster.lng,
+            count=cluster.count,
+            kinds=cluster.kinds,
+            samples=[MapClusterSample(kind=kind, id=item_id) for kind, item_id in cluster.samples],
         )
+        for cluster in clusters
+    ]
 
-    if not selects:
+
+REGION_PREFIX = {"province": 2, "city": 4}
+
+
+async def _build_region_stats(
+    session: AsyncSession, level: str, type_filter: str, year: int | None
+) -> list[RegionStatOut]:
+    kinds = resolve_kinds(type_filter)
+    if not kinds:
         return []
+    prefix_len = REGION_PREFIX[level]
 
-    union_stmt = union_all(*selects).subquery()
-    ordered = select(union_stmt).order_by(union_stmt.c.timestamp.desc()).limit(limit)
-    res = await session.execute(ordered)
-    rows = res.mappings().all()
+    def grouped(adcode_col, kind_col, year_col, count_expr, base_filter):
+        code = func.substr(adcode_col, 1, prefix_len)
+        stmt = (
+            select(code, kind_col, year_col, count_expr)
+            .where(base_filter)
+            .group_by(code, kind_col, year_col)
+        )
+        if len(kinds) < len(TYPE_ALIASES):
+            stmt = stmt.where(kind_col.in_(kinds))
+        if year is not None:
+            stmt = stmt.where(year_col == year)
+        return stmt
 
-    markers: list[MapMarker] = []
-    for row in rows:
-        coords = _resolve_coords(row.get("location"), row.get("lat"), row.get("lng"))
-        if not coords:
-            continue
-        lat, lng = coords
-        snippet_src = row.get("content") or row.get("caption") or row.get("title") or ""
-        ts = row.get("timestamp") or datetime.now()
-        markers.append(
-            MapMarker(
-                id=row.get("id"),
-                kind=row.get("type"),
-                lat=lat,
-                lng=lng,
-                label=(row.get("location") or "").strip(),
-                timestamp=ts.isoformat(),
-                snippet=str(snippet_src)[:120],
-                image=row.get("image"),
-                adcode=row.get("adcode"),
+    # 优先读增量维护的 region_stat；为空时退回 timeline_item 上按 adcode 索引的 GROUP BY
+    res = await session.execute(
+        grouped(
+            RegionStat.adcode,
+            RegionStat.kind,
+            RegionStat.year,
+            func.sum(RegionStat.count),
+            RegionStat.count > 0,
+        )
+    )
+    rows = res.all()
+    if not rows:
+        res = await session.execute(
+            grouped(
+                TimelineItem.adcode,
+                TimelineItem.type,
+                region_year(TimelineItem.timestamp),
+                func.count(),
+                TimelineItem.adcode.is_not(None),
             )
         )
-    return markers
+        rows = res.all()
+
+    regions: dict[str, RegionStatOut] = {}
+    for prefix, kind, row_year, count in rows:
+        if not prefix or len(prefix) < prefix_len:
+            continue
+        adcode = prefix.ljust(6, "0")
+        region = regions.get(adcode)
+        if region is None:
+            region = regions[adcode] = RegionStatOut(adcode=adcode, count=0)
+        count = int(count)
+        region.count += count
+        region.kinds[kind] = region.kinds.get(kind, 0) + count
+        region.years[str(row_year)] = region.years.get(str(row_year), 0) + count
+    return sorted(regions.values(), key=lambda r: r.adcode)
+
+
+@router.get("/map/regions", response_model=RegionResponse)
+async def get_map_regions(
+    request: Request,
+    level: str = Query("province", pattern="^(province|city)$"),
+    type: str = "all",
+    year: int | None = None,
+    session: AsyncSession = Depends(get_session),
+):
+    # 区域计数只依赖相应类型的 geo 分量
+    current_version = await get_data_version(session, version_keys(resolve_kinds(type), "geo"))
+
+    async def compute() -> RegionResponse:
+        regions = await _build_region_stats(session, level, type, year)
+        return RegionResponse(level=level, regions=regions, version=current_version)
+
+    params = {"level": level, "type": type.lower(), "year": year}
+    return await cached_json_response(request, "map_regions", params, current_version, compute)
 
 
 @router.get("/map", response_model=MapResponse)
 async def get_map(
+    request: Request,
     q: str = "",
     type: str = "all",
     tag: str = "",
     limit: int = Query(800, ge=1, le=2000),
     since_version: int = Query(0, ge=0),
+    bbox: str | None = None,
+    zoom: int | None = Query(None, ge=0, le=MAX_ZOOM),
+    cluster: bool = False,
+    format: str | None = Query(None, pattern="^(json|columnar|msgpack)$"),
     session: AsyncSession = Depends(get_session),
 ):
-    current_version = await get_map_version(session)
+    parsed_bbox = parse_bbox(bbox) if bbox else None
+    if cluster and zoom is None:
+        raise HTTPException(status_code=400, detail="zoom is required when cluster=1")
+    fmt = negotiate_format(format, request.headers.get("accept"))
+    if not format_available(fmt):
+        raise HTTPException(status_code=406, detail="msgpack format is not available")
+    # 格式由 Accept 协商时，中间缓存需要区分不同的 Accept
+    headers = {"Vary": "Accept"} if format is None else {}
+    # 只比较所选类型的 geo 分量：没有坐标的条目改动不会让地图缓存失效
+    current_version = await get_data_version(session, version_keys(resolve_kinds(type), "geo"))
     if since_version and since_version >= current_version:
-        return MapResponse(markers=[], version=current_version, unchanged=True)
+        unchanged = MapResponse(markers=[], version=current_version, unchanged=True)
+        return Response(
+            content=encode_map_response(unchanged, fmt), media_type=MAP_MEDIA_TYPES[fmt], headers=headers
+        )
+
+    async def compute() -> MapResponse:
+        if cluster:
+            clusters = await _build_map_clusters(session, current_version, q, type, tag, zoom, parsed_bbox)
+            return MapResponse(markers=[], clusters=clusters, zoom=zoom, version=current_version)
+        markers = await _build_map_markers(session, q, type, tag, limit, parsed_bbox)
+        return MapResponse(markers=markers, version=current_version, unchanged=False)
+
+    async def render() -> bytes:
+        return encode_map_response(await compute(), fmt)
 
-    markers = await _build_map_markers(session, q, type, tag, limit)
-    return MapResponse(markers=markers, version=current_version, unchanged=False)
+    params = {
+        "q": q.strip().lower(),
+        "type": type.lower(),
+        "tag": tag.strip().lower(),
+        "limit": limit,
+        "bbox": parsed_bbox,
+        "zoom": zoom if cluster else None,
+        "format": fmt,
+    }
+    return await cached_response(
+        request, "map", params, current_version, render, MAP_MEDIA_TYPES[fmt], headers
+    )
@@ -1,13 +1,20 @@
-from datetime import datetime
+import base64
+import binascii
+from datetime import date, datetime, timedelta
 
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy import func, literal, or_, select, union_all
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import literal, select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..cache import cached_json_response
 from ..config import get_settings
 from ..database import get_session
-from ..models import Entry, KeyDate, Photo
-from ..schemas import TagResponse, TimelineEntry, TimelineResponse
+from ..imaging import image_fields
+from ..indexing import ITEM_MODELS, kind_filter, resolve_kinds, tag_filter
+from ..map_version import get_data_version, version_keys
+from ..models import TagStat, TimelineItem
+from ..schemas import TagResponse, TagStatOut, TimelineEntry, TimelineResponse
+from ..search import search_clause
 
 router = APIRouter(prefix="/api", tags=["timeline"])
 settings = get_settings()
@@ -19,6 +26,55 @@ def split_tags(text: str | None) -> list[str]:
     return [t.strip() for t in text.split(",") if t.strip()]
 
 
+def to_timeline_entry(row: TimelineItem) -> TimelineEntry:
+    return TimelineEntry(
+        id=row.source_id,
+        type=row.type,
+        timestamp=row.timestamp,
+        content=row.content,
+        caption=row.caption,
+        title=row.title,
+        location=row.location,
+        tags=split_tags(row.tags),
+        image=row.image,
+        geo_status=row.geo_status,
+        **image_fields(row),
+    )
+
+
+# 游标是 (timestamp, type, id) 三元组，与排序键完全一致，翻页只需一次索引范围扫描
+TimelineCursor = tuple[datetime, str | None, int | None]
+
+
+def encode_cursor(timestamp: datetime, type_: str, item_id: int) -> str:
+    raw = f"{timestamp.isoformat()},{type_},{item_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(value: str) -> TimelineCursor:
+    """
+    解析游标。
+
+    支持两种形式：
+    - encode_cursor 生成的不透明游标：从该条目之后继续
+    - 日期/时间字符串（如 "2023-05-20"）：跳转到该日期，返回当天及更早的内容
+    """
+    value = (value or "").strip()
+    try:
+        if len(value) == 10:
+            day = date.fromisoformat(value)
+            return datetime.combine(day + timedelta(days=1), datetime.min.time()), None, None
+        return datetime.fromisoformat(value), None, None
+    except ValueError:
+        pass
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        ts_text, type_, id_text = base64.urlsafe_b64decode(padded).decode("utf-8").rsplit(",", 2)
+        return datetime.fromisoformat(ts_text), type_, int(id_text)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 async def build_timeline(
     session: AsyncSession,
     search: str,
@@ -26,150 +82,114 @@ async def build_timeline(
     tag: str,
     page: int | None = None,
     per_page: int | None = None,
-) -> tuple[list[TimelineEntry], int]:
+    cursor: TimelineCursor | None = None,
+) -> tuple[list[TimelineEntry], bool]:
     search = (search or "").strip().lower()
-    type_filter = (type_filter or "all").lower()
     tag = (tag or "").strip().lower()
-
-    include_entry = type_filter in ("all", "entry", "text")
-    include_photo = type_filter in ("all", "photo", "img", "image")
-    include_keydate = type_filter in ("all", "keydate", "date", "anniversary")
-
-    timeline: list[TimelineEntry] = []
-
-    def tag_clause(column):
-        wrapped = literal(",") + func.lower(func.coalesce(column, "")) + literal(",")
-        return wrapped.like(f"%,{tag},%")
-
-    selects = []
-
-    if include_entry:
-        stmt = select(
-            Entry.id.label("id"),
-            literal("entry").label("type"),
-            func.coalesce(Entry.created_at, func.now()).label("timestamp"),
-            Entry.content.label("content"),
-            literal(None).label("caption"),
-            literal(None).label("title"),
-            Entry.location.label("location"),
-            Entry.tags.label("tags"),
-            literal(None).label("image"),
-        )
-        if search:
-            like = f"%{search}%"
-            stmt = stmt.where(
-                or_(
-                    func.lower(func.coalesce(Entry.content, "")).like(like),
-                    func.lower(func.coalesce(Entry.location, "")).like(like),
-                )
+    kinds = resolve_kinds(type_filter)
+    if not kinds:
+        return [], False
+
+    stmt = select(TimelineItem)
+    kind_clause = kind_filter(kinds)
+    if kind_clause is not None:
+        stmt = stmt.where(kind_clause)
+    if search:
+        stmt = stmt.where(
+            search_clause(
+                search,
+                TimelineItem.content,
+                TimelineItem.title,
+                TimelineItem.caption,
+                TimelineItem.filename,
+                TimelineItem.location,
             )
-        if tag:
-            stmt = stmt.where(tag_clause(Entry.tags))
-        selects.append(stmt)
-
-    if include_keydate:
-        stmt = select(
-            KeyDate.id.label("id"),
-            literal("keydate").label("type"),
-            KeyDate.date.label("timestamp"),
-            literal(None).label("content"),
-            literal(None).label("caption"),
-            KeyDate.title.label("title"),
-            KeyDate.location.label("location"),
-            KeyDate.tags.label("tags"),
-            literal(None).label("image"),
         )
-        if search:
-            like = f"%{search}%"
-            stmt = stmt.where(
-                or_(
-                    func.lower(func.coalesce(KeyDate.title, "")).like(like),
-                    func.lower(func.coalesce(KeyDate.location, "")).like(like),
-                )
+    if tag:
+        stmt = stmt.where(tag_filter(tag))
+
+    ordered = stmt.order_by(
+        TimelineItem.timestamp.desc(), TimelineItem.type.desc(), TimelineItem.source_id.desc()
+    )
+    if cursor:
+        cursor_ts, cursor_type, cursor_id = cursor
+        if cursor_type is None:
+            ordered = ordered.where(TimelineItem.timestamp < cursor_ts)
+        else:
+            ordered = ordered.where(
+                tuple_(TimelineItem.timestamp, TimelineItem.type, TimelineItem.source_id)
+                < tuple_(literal(cursor_ts), literal(cursor_type), literal(cursor_id))
             )
-        if tag:
-            stmt = stmt.where(tag_clause(KeyDate.tags))
-        selects.append(stmt)
-
-    if include_photo:
-        stmt = select(
-            Photo.id.label("id"),
-            literal("photo").label("type"),
-            func.coalesce(Photo.created_at, func.now()).label("timestamp"),
-            literal(None).label("content"),
-            Photo.caption.label("caption"),
-            literal(None).label("title"),
-            Photo.location.label("location"),
-            Photo.tags.label("tags"),
-            (literal("/uploads/") + Photo.filename).label("image"),
-        )
-        if search:
-            like = f"%{search}%"
-            stmt = stmt.where(
-                or_(
-                    func.lower(func.coalesce(Photo.caption, "")).like(like),
-                    func.lower(func.coalesce(Photo.filename, "")).like(like),
-                    func.lower(func.coalesce(Photo.location, "")).like(like),
-                )
-            )
-        if tag:
-            stmt = stmt.where(tag_clause(Photo.tags))
-        selects.append(stmt)
-
-    if not selects:
-        return [], 0
-
-    union_stmt = union_all(*selects).subquery()
-
-    total = await session.scalar(select(func.count()).select_from(union_stmt)) or 0
-    ordered = select(union_stmt).order_by(union_stmt.c.timestamp.desc())
-    if page and per_page:
-        ordered = ordered.offset((page - 1) * per_page).limit(per_page)
+    elif page and per_page:
+        ordered = ordered.offset((page - 1) * per_page)
+    if per_page:
+        # 多取一行判断是否还有下一页，避免 COUNT
+        ordered = ordered.limit(per_page + 1)
 
     res = await session.execute(ordered)
-    rows = res.mappings().all()
-
-    timeline = [
-        TimelineEntry(
-            id=row["id"],
-            type=row["type"],
-            timestamp=row["timestamp"] or datetime.now(),
-            content=row.get("content"),
-            caption=row.get("caption"),
-            title=row.get("title"),
-            location=row.get("location"),
-            tags=split_tags(row.get("tags")),
-            image=row.get("image"),
-        )
-        for row in rows
-    ]
+    rows = res.scalars().all()
+    has_more = bool(per_page) and len(rows) > per_page
+    if has_more:
+        rows = rows[:per_page]
 
-    return timeline, total
+    return [to_timeline_entry(row) for row in rows], has_more
 
 
 @router.get("/timeline", response_model=TimelineResponse)
 async def get_timeline(
+    request: Request,
     q: str = "",
     type: str = "all",
     tag: str = "",
     page: int = Query(1, ge=1),
     per_page: int = Query(24, ge=1, le=500),
+    cursor: str | None = None,
     session: AsyncSession = Depends(get_session),
 ):
-    timeline, total = await build_timeline(session, q, type, tag, page, per_page)
-    has_more = page * per_page < total
-    return TimelineResponse(items=timeline, page=page, has_more=has_more)
+    parsed_cursor = decode_cursor(cursor) if cursor else None
+
+    async def compute() -> TimelineResponse:
+        timeline, has_more = await build_timeline(session, q, type, tag, page, per_page, parsed_cursor)
+        next_cursor = None
+        if has_more and timeline:
+            last = timeline[-1]
+            next_cursor = encode_cursor(last.timestamp, last.type, last.id)
+        return TimelineResponse(
+            items=timeline,
+            page=None if parsed_cursor else page,
+            has_more=has_more,
+            next_cursor=next_cursor,
+        )
+
+    params = {
+        "q": q.strip().lower(),
+        "type": type.lower(),
+        "tag": tag.strip().lower(),
+        "per_page": per_page,
+        "cursor": cursor or None,
+        "page": None if cursor else page,
+    }
+    version = await get_data_version(session, version_keys(resolve_kinds(type), "text"))
+    return await cached_json_response(request, "timeline", params, version, compute)
 
 
 @router.get("/tags", response_model=TagResponse)
-async def get_tags(session: AsyncSession = Depends(get_session)):
-    all_tags = set()
-    for model in (Entry, Photo, KeyDate):
-        res = await session.execute(select(model.tags))
-        for tags_text, in res:
-            if not tags_text:
-                continue
-            for t in split_tags(tags_text):
-                if t:
-                    all_tags.add(t)
-    return TagResponse(tags=sorted(all_tags))
+async def get_tags(
+    request: Request,
+    sort: str = Query("name", pattern="^(name|count|recent)$"),
+    session: AsyncSession = Depends(get_session),
+):
+    async def compute() -> TagResponse:
+        order_by = {
+            "name": (TagStat.tag,),
+            "count": (TagStat.count.desc(), TagStat.tag),
+            "recent": (TagStat.last_used_at.desc().nulls_last(), TagStat.tag),
+        }[sort]
+        res = await session.execute(select(TagStat).where(TagStat.count > 0).order_by(*order_by))
+        stats = [
+            TagStatOut(tag=row.tag, count=row.count, last_used_at=row.last_used_at) for row in res.scalars()
+        ]
+        return TagResponse(tags=[stat.tag for stat in stats], stats=stats)
+
+    version = await get_data_version(session, version_keys(ITEM_MODELS, "tags"))
+    return await cached_json_response(request, "tags", {"sort": sort}, version, compute)
@@ -61,6 +61,13 @@ class KeyDateUpdate(BaseModel):
     location_coords: Optional[str] = None
 
 
+class ImageVariant(BaseModel):
+    width: int
+    height: int
+    format: str
+    url: str
+
+
 class TimelineEntry(BaseModel):
     id: int
     type: Literal["entry", "photo", "keydate"]
@@ -71,16 +78,34 @@ class TimelineEntry(BaseModel):
     location: Optional[str] = None
     tags: list[str] = Field(default_factory=list)
     image: Optional[str] = None
+    # 位置解析状态：pending 表示坐标仍在后台解析，完成后通过变更事件推送
+    geo_status: Optional[str] = None
+    # 照片的原图尺寸、加载占位（主色 / BlurHash）与各尺寸派生图
+    width: Optional[int] = None
+    height: Optional[int] = None
+    dominant_color: Optional[str] = None
+    blurhash: Optional[str] = None
+    thumbnail: Optional[str] = None
+    variants: list[ImageVariant] = Field(default_factory=list)
 
 
 class TimelineResponse(BaseModel):
     items: list[TimelineEntry]
-    page: int
+    # 游标翻页时为 null，只有按页码翻页时才有意义
+    page: Optional[int] = None
     has_more: bool
+    next_cursor: Optional[str] = None
+
+
+class TagStatOut(BaseModel):
+    tag: str
+    count: int
+    last_used_at: Optional[datetime] = None
 
 
 class TagResponse(BaseModel):
     tags: list[str]
+    stats: list[TagStatOut] = Field(default_factory=list)
 
 
 class MapMarker(BaseModel):
@@ -93,9 +118,74 @@ class MapMarker(BaseModel):
     snippet: str
     image: Optional[str] = None
     adcode: Optional[str] = None
+    thumbnail: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+
+class MapClusterSample(BaseModel):
+    id: int
+    kind: Literal["entry", "photo", "keydate"]
+
+
+class MapCluster(BaseModel):
+    lat: float
+    lng: float
+    count: int
+    kinds: dict[str, int]
+    samples: list[MapClusterSample]
 
 
 class MapResponse(BaseModel):
     markers: list[MapMarker]
     version: int = 1
     unchanged: bool = False
+    clusters: list[MapCluster] = Field(default_factory=list)
+    zoom: Optional[int] = None
+
+
+class RegionStatOut(BaseModel):
+    adcode: str
+    count: int
+    kinds: dict[str, int] = Field(default_factory=dict)
+    years: dict[str, int] = Field(default_factory=dict)
+
+
+class RegionResponse(BaseModel):
+    level: Literal["province", "city"]
+    regions: list[RegionStatOut]
+    version: int = 1
+
+
+class ChangeItem(BaseModel):
+    kind: Literal["entry", "photo", "keydate"]
+    id: int
+    op: Literal["upsert", "delete"]
+    version: int
+    item: Optional[TimelineEntry] = None
+    marker: Optional[MapMarker] = None
+
+
+class ChangesResponse(BaseModel):
+    version: int
+    reset: bool = False
+    changes: list[ChangeItem]
+
+
+class GeoCacheStats(BaseModel):
+    entries: int
+    memory_hits: int
+    db_hits: int
+    misses: int
+
+
+class GeoBreakerStats(BaseModel):
+    state: Literal["closed", "open", "half_open"]
+    consecutive_failures: int
+    trips: int
+    rejected: int
+
+
+class GeoStatsResponse(BaseModel):
+    cache: GeoCacheStats
+    breaker: GeoBreakerStats
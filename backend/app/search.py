@@ -0,0 +1,122 @@
+import logging
+import re
+from functools import reduce
+
+from sqlalchemy import Text, and_, func, literal, literal_column, or_, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+logger = logging.getLogger(__name__)
+
+# 参与关键字搜索的列。各列拼接成一个文档建一个 n-gram 索引，索引表达式必须与
+# search_document 生成的 SQL 完全一致才能命中
+SEARCH_COLUMNS: dict[str, tuple[str, ...]] = {
+    "timeline_item": ("content", "title", "caption", "filename", "location"),
+}
+# 查询改读 timeline_item 之后不再使用的旧索引、改用 n-gram 索引前的 pg_trgm 索引，
+# 以及合并为单个文档二元组索引前的逐列一元 + 二元组索引，启动时清理以免拖慢写入
+OBSOLETE_INDEXES = (
+    "idx_entry_content_trgm",
+    "idx_entry_location_trgm",
+    "idx_key_date_title_trgm",
+    "idx_key_date_location_trgm",
+    "idx_photo_caption_trgm",
+    "idx_photo_filename_trgm",
+    "idx_photo_location_trgm",
+    *(f"idx_{table}_{column}_trgm" for table, columns in SEARCH_COLUMNS.items() for column in columns),
+    *(f"idx_{table}_{column}_grams" for table, columns in SEARCH_COLUMNS.items() for column in columns),
+)
+# 旧索引依赖的函数，索引删除后一并删除
+OBSOLETE_FUNCTIONS = ("lj_search_grams(text)",)
+GRAMS_FUNCTION = "lj_search_bigrams"
+# 文本中全部二元组（按字符切分，与 locale 无关），GIN 数组索引据此过滤候选行；
+# COST 调高使规划器在需要逐行求值时把它排在 LIKE 之后。
+# 改变函数语义时必须换函数名，否则已有索引不会重建
+GRAMS_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION {GRAMS_FUNCTION}(t text) RETURNS text[]
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE COST 1000 AS $$
+    SELECT coalesce(array_agg(DISTINCT substr(t, i, 2)), '{{}}') FROM generate_series(1, length(t) - 1) AS i
+$$
+"""
+
+# ensure_search_indexes 成功后置为 True；之前（或建索引失败时）只用 LIKE，结果相同但不走索引
+_grams_ready = False
+
+
+def search_expr(column):
+    """
+    lower(coalesce(col, '')) —— 空串以字面量内联，保证与 GIN 表达式索引匹配
+    （绑定参数会让规划器无法识别索引表达式）。
+    """
+    return func.lower(func.coalesce(column, literal_column("''")))
+
+
+def search_document(table):
+    """SEARCH_COLUMNS 中各列以空格拼接后转小写，即 n-gram 索引的文档表达式（|| 是 IMMUTABLE，concat_ws 不是）。"""
+    parts = [func.coalesce(table.c[name], literal_column("''")) for name in SEARCH_COLUMNS[table.name]]
+    return func.lower(reduce(lambda left, right: left.op("||")(literal_column("' '")).op("||")(right), parts))
+
+
+def query_grams(search: str) -> list[str]:
+    """
+    LIKE 模式中通配符之间的字面片段（至少两个字符）拆成的二元组，命中的行必然包含全部二元组。
+    只有单个字符的片段不参与：一元组的倒排列表太长，按索引过滤反而比顺序扫描慢。
+    含转义符时不做过滤。
+    """
+    if "\\" in search:
+        return []
+    grams = set()
+    for segment in re.split(r"[%_]", search):
+        grams.update(segment[i : i + 2] for i in range(len(segment) - 1))
+    return sorted(grams)
+
+
+def search_clause(search: str, *columns):
+    """
+    子串匹配，语义与原先的 LIKE '%q%' 相同。n-gram 索引就绪且查询含两个字符以上的片段时，
+    先用 lj_search_bigrams(文档) @> 查询的二元组过滤候选行，再由逐列 LIKE 精确匹配；
+    单字查询只用 LIKE，交给按时间排序的索引边扫边过滤。
+    """
+    like = f"%{search}%"
+    matches = or_(*(search_expr(column).like(like) for column in columns))
+    table = columns[0].table
+    grams = query_grams(search) if _grams_ready and table.name in SEARCH_COLUMNS else []
+    if not grams:
+        return matches
+    # 任一列 LIKE 命中时拼接后的文档必然包含全部二元组，两组条件取 AND 与单独 LIKE 等价；
+    # n-gram 部分只作为位图索引条件，堆上只需按 LIKE 过滤，不再逐行调用 n-gram 函数
+    wanted = literal(grams, ARRAY(Text))
+    candidates = func.lj_search_bigrams(search_document(table)).op("@>")(wanted)
+    return and_(candidates, matches)
+
+
+async def ensure_search_indexes(conn: AsyncConnection) -> bool:
+    """
+    创建 n-gram 函数并为每张表的搜索文档建立一个 GIN 表达式索引，只依赖 PostgreSQL 内置的数组 GIN，
+    不需要 pg_trgm / pg_bigm 扩展。pg_trgm 对不足三个字符的查询无法使用索引，
+    且在 C 等非 UTF-8 locale 下不提取中文三元组，因此改为二元组。
+    建索引失败时记录警告，查询退回纯 LIKE，结果不受影响。
+    """
+    global _grams_ready
+    if conn.dialect.name != "postgresql":
+        return False
+    try:
+        async with conn.begin_nested():
+            await conn.execute(text(GRAMS_FUNCTION_SQL))
+            for name in OBSOLETE_INDEXES:
+                await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            for name in OBSOLETE_FUNCTIONS:
+                await conn.execute(text(f"DROP FUNCTION IF EXISTS {name}"))
+            for table in SEARCH_COLUMNS:
+                document = " || ' ' || ".join(f"coalesce({column}, '')" for column in SEARCH_COLUMNS[table])
+                await conn.execute(
+                    text(
+                        f"CREATE INDEX IF NOT EXISTS idx_{table}_search_bigrams ON {table} "
+                        f"USING gin ({GRAMS_FUNCTION}(lower({document})))"
+                    )
+                )
+    except Exception as exc:
+        logger.warning("search n-gram indexes unavailable, keyword search will not use indexes: %s", exc)
+        return False
+    _grams_ready = True
+    return True
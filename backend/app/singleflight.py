@@ -0,0 +1,61 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+def _owner_cancelled(inflight: asyncio.Future) -> bool:
+    """共享的结果因负责计算的调用被取消而取消，且当前任务自己没有被取消。"""
+    if not inflight.cancelled():
+        return False
+    task = asyncio.current_task()
+    cancelling = getattr(task, "cancelling", None)  # Python 3.11+
+    return cancelling is None or not cancelling()
+
+
+class SingleFlight:
+    """
+    同一个键的并发调用只执行一次 compute，其余调用等待同一结果；异常同样传给所有等待方。
+
+    负责计算的调用被取消（客户端断开、它自己的超时）时，没有被取消的等待方不会跟着收到
+    CancelledError，而是重新发起：第一个醒来的接手计算，其余等待它的结果。
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    def pending(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def run(
+        self, key: Hashable, compute: Callable[[], Awaitable[Any]], timeout: float | None = None
+    ) -> Any:
+        """timeout 只限制等待别人结果的时间，超时抛出 asyncio.TimeoutError；自己计算时不受限。"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                return await self._lead(key, compute)
+            remaining = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                return await asyncio.wait_for(asyncio.shield(inflight), remaining)
+            except asyncio.CancelledError:
+                if not _owner_cancelled(inflight):
+                    raise
+
+    async def _lead(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # 没有其他等待者时取出异常，避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
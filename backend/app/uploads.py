@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+
+from .config import get_settings
+
+settings = get_settings()
+
+# 每次从上传流读取并写盘的块大小
+CHUNK_SIZE = 1024 * 1024
+# 按文件头识别图片类型，不信任客户端给出的扩展名与 Content-Type
+SNIFF_BYTES = 32
+# 上传接口的请求体除文件外还有表单字段与 multipart 分隔符，整体上限在文件上限之上留出余量
+MULTIPART_OVERHEAD = 1024 * 1024
+UPLOAD_PATH_PREFIX = "/api/photos"
+
+
+class UploadSizeLimitMiddleware:
+    """
+    照片上传接口的请求体大小限制，在框架解析 multipart（整个请求体落盘）之前生效：
+    Content-Length 超限时直接返回 413，不读取请求体；没有 Content-Length（分块传输）时
+    边接收边计数，超限即中止。stream_upload 仍按 max_bytes 精确检查文件本身。
+    """
+
+    def __init__(self, app, max_bytes: int | None = None):
+        self.app = app
+        self.max_bytes = settings.upload_max_bytes if max_bytes is None else max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("POST", "PUT")
+            or not scope["path"].startswith(UPLOAD_PATH_PREFIX)
+        ):
+            await self.app(scope, receive, send)
+            return
+        limit = self.max_bytes + MULTIPART_OVERHEAD
+        detail = f"File exceeds {self.max_bytes} bytes"
+        headers = dict(scope["headers"])
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            response = JSONResponse({"detail": detail}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+@dataclass
+class StagedUpload:
+    """已完整写入临时文件、尚未放到最终位置的上传。filename 由内容哈希决定。"""
+
+    temp_path: Path
+    filename: str
+    size: int
+    sha256: str
+    content_type: str
+
+
+def sniff_image_type(head: bytes) -> tuple[str, str] | None:
+    """根据文件头返回 (content_type, 扩展名)，不是支持的图片格式时返回 None。"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg", ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png", ".png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif", ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"avif", b"avis"):
+            return "image/avif", ".avif"
+        if brand in (b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1"):
+            return "image/heic", ".heic"
+    return None
+
+
+def _open_temp(upload_dir: Path) -> tuple[Path, object]:
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    # 临时文件与目标在同一目录，保证最后的 os.replace 是原子的
+    path = upload_dir / f".upload-{uuid.uuid4().hex}.part"
+    return path, open(path, "wb")
+
+
+def sync_upload(staged: StagedUpload) -> None:
+    """把临时文件刷到磁盘，之后的 finish_upload 只需改名。同步函数，在线程中调用。"""
+    with open(staged.temp_path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def finish_upload(staged: StagedUpload, dest: Path) -> bool:
+    """
+    把临时文件原子地改名为 dest；dest 已存在（相同内容）时丢弃临时文件。
+    返回是否实际写入了新文件。
+    """
+    if dest.exists():
+        staged.temp_path.unlink(missing_ok=True)
+        return False
+    os.replace(staged.temp_path, dest)
+    return True
+
+
+def discard_upload(staged: StagedUpload) -> None:
+    staged.temp_path.unlink(missing_ok=True)
+
+
+def _discard(f, temp_path: Path) -> None:
+    f.close()
+    temp_path.unlink(missing_ok=True)
+
+
+async def stream_upload(file: UploadFile, upload_dir: Path, max_bytes: int | None = None) -> StagedUpload:
+    """
+    把上传的图片分块流式写入 upload_dir 下的临时文件，同时计算 SHA-256。
+
+    读取与写盘都不阻塞事件循环（UploadFile 的读取与文件写入都在线程池中执行），
+    内存中只保留一个块。超过大小上限（413）或不是支持的图片格式（415）时删除临时文件并报错。
+    这里读到的是框架已接收完的请求体，过大的请求应由 UploadSizeLimitMiddleware 提前拒绝。
+    最终文件名为 <sha256><扩展名>，相同内容的上传得到相同的文件名，由调用方决定去重与落盘。
+    """
+    max_bytes = settings.upload_max_bytes if max_bytes is None else max_bytes
+    temp_path, f = await asyncio.to_thread(_open_temp, upload_dir)
+    digest = hashlib.sha256()
+    size = 0
+    sniffed = None
+    try:
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if sniffed is None:
+                sniffed = sniff_image_type(chunk[:SNIFF_BYTES])
+                if sniffed is None:
+                    raise HTTPException(
+                        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Unsupported image type"
+                    )
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"File exceeds {max_bytes} bytes",
+                )
+            digest.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+        if sniffed is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty file")
+        await asyncio.to_thread(f.close)
+    except BaseException:
+        await asyncio.to_thread(_discard, f, temp_path)
+        raise
+    content_type, ext = sniffed
+    sha256 = digest.hexdigest()
+    return StagedUpload(temp_path, f"{sha256}{ext}", size, sha256, content_type)
+
@@ -1,11 +1,44 @@
+import asyncio
 import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import Any, Awaitable, Callable, Optional
 
 import httpx
 
+from .boundaries import AdcodeResolver
+from .breaker import CircuitBreaker
+from .config import get_settings
+from .geocache import MISSING, GeoCache
+from .singleflight import SingleFlight
+
+try:  # 可选依赖：安装 h2（httpx[http2]）后与高德之间使用 HTTP/2
+    import h2
+except ImportError:
+    h2 = None
+
 tag_pattern = re.compile(r"#([\w\u4e00-\u9fa5]+)")
 GeoResult = tuple[float, float, str | None]
+# 高德地理编码 batch=true 时单次请求最多 10 个地址，地址之间以 | 分隔
+GEOCODE_BATCH_SIZE = 10
+
+# 表示高德过载或配额耗尽的 infocode，与网络错误一样计入熔断器失败次数
+AMAP_OVERLOAD_INFOCODES = {"10003", "10004", "10014", "10015", "10016", "10019", "10020", "10021"}
+
+# 为 True 时 GeoHelper 只用本地解析与缓存，需要请求高德时抛出 GeoPending
+_offline: ContextVar[bool] = ContextVar("geo_offline", default=False)
+# 当前这次解析的截止时间（事件循环时钟），None 表示不限
+_deadline: ContextVar[float | None] = ContextVar("geo_deadline", default=None)
+
+
+class GeoPending(Exception):
+    """离线模式下结果不在缓存中、必须请求高德时抛出，由调用方转交后台任务处理。"""
+
+
+class GeoUnavailable(Exception):
+    """高德请求失败、超时、熔断器打开或超出本次解析的时间预算；结果不写入缓存。"""
 
 
 def extract_tags(*texts: Optional[str]) -> list[str]:
@@ -18,6 +51,20 @@ def extract_tags(*texts: Optional[str]) -> list[str]:
     return sorted(found)
 
 
+def format_tags(*parts: str | None) -> str | None:
+    tags = extract_tags(*parts)
+    return ",".join(tags) if tags else None
+
+
+def item_tags_text(kind: str, item) -> str | None:
+    """按类型从正文 / 标题 / 说明与位置中提取标签。"""
+    if kind == "entry":
+        return format_tags(item.content, item.location)
+    if kind == "keydate":
+        return format_tags(item.title, item.location)
+    return format_tags(item.caption, item.location)
+
+
 def parse_datetime(value: Optional[str]) -> datetime:
     if not value:
         return datetime.now()
@@ -29,12 +76,105 @@ def parse_datetime(value: Optional[str]) -> datetime:
     return datetime.fromisoformat(value) if value else datetime.now()
 
 
+def create_amap_client() -> httpx.AsyncClient:
+    """
+    创建访问高德 Web 服务的长连接客户端：连接池复用 TCP/TLS 连接，安装 h2 时启用 HTTP/2。
+    """
+    settings = get_settings()
+    return httpx.AsyncClient(
+        base_url=settings.amap_base_url,
+        timeout=httpx.Timeout(settings.amap_timeout, connect=min(settings.amap_timeout, 3.0)),
+        limits=httpx.Limits(
+            max_connections=settings.amap_max_connections,
+            max_keepalive_connections=settings.amap_max_keepalive,
+        ),
+        http2=settings.amap_http2 and h2 is not None,
+    )
+
+
+class RateLimiter:
+    """按固定间隔放行请求（rate 次/秒），rate <= 0 时不限速。"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def acquire(self) -> None:
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next)
+        self._next = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
 class GeoHelper:
-    def __init__(self, amap_key: str):
+    def __init__(
+        self,
+        amap_key: str,
+        client: httpx.AsyncClient | None = None,
+        cache: GeoCache | None = None,
+        boundaries: AdcodeResolver | None = None,
+    ):
         self.amap_key = amap_key
         self.coord_number_re = re.compile(r"(-?\d+(?:\.\d+)?)")
-        self.geocode_cache: dict[str, GeoResult | None] = {}
-        self.reverse_cache: dict[str, str | None] = {}
+        settings = get_settings()
+        if cache is None:
+            cache = GeoCache(
+                settings.geo_cache_max_entries, settings.geo_cache_ttl, settings.geo_cache_negative_ttl
+            )
+        self.cache = cache
+        self._flights = SingleFlight()
+        self.boundaries = boundaries
+        self.network_regeo = settings.geo_network_regeo
+        # 对高德的并发请求上限（批量导入、缓存冷启动时保护配额）
+        self._semaphore = asyncio.Semaphore(settings.geo_max_concurrency)
+        # 每秒发出的请求数上限，对应高德 Key 的 QPS 配额
+        self._rate_limiter = RateLimiter(settings.geo_max_qps)
+        self.breaker = CircuitBreaker(settings.geo_breaker_failures, settings.geo_breaker_reset_seconds)
+        # 未传入时首次请求再创建，由 aclose() 关闭
+        self.client = client
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = create_amap_client()
+        return self.client
+
+    async def aclose(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    @contextmanager
+    def offline(self):
+        """在 with 块内禁止网络请求：缓存未命中时抛出 GeoPending。"""
+        token = _offline.set(True)
+        try:
+            yield
+        finally:
+            _offline.reset(token)
+
+    @contextmanager
+    def deadline(self, seconds: float):
+        """
+        为 with 块内的全部地理编码请求设置总时间预算，无论触发多少次查询；
+        嵌套时取更早的截止时间。超出预算的查询按无结果处理。
+        """
+        deadline = asyncio.get_running_loop().time() + seconds
+        current = _deadline.get()
+        token = _deadline.set(deadline if current is None else min(current, deadline))
+        try:
+            yield
+        finally:
+            _deadline.reset(token)
+
+    @staticmethod
+    def _remaining() -> float | None:
+        deadline = _deadline.get()
+        if deadline is None:
+            return None
+        return deadline - asyncio.get_running_loop().time()
 
     def parse_coords_from_location(self, location_text: str | None) -> GeoResult | None:
         """
@@ -83,71 +223,180 @@ class GeoHelper:
         except ValueError:
             return None
 
-    async def geocode_location(self, location_text: str) -> GeoResult | None:
-        if not location_text:
-            return None
-        if location_text in self.geocode_cache:
-            return self.geocode_cache[location_text]
+    async def _send(self, path: str, params: dict) -> dict:
+        async with self._semaphore:
+            await self._rate_limiter.acquire()
+            resp = await self._get_client().get(path, params={"key": self.amap_key, **params})
+        resp.raise_for_status()
+        data = resp.json()
+        if not isinstance(data, dict):
+            raise ValueError("unexpected AMap response")
+        if data.get("status") != "1" and str(data.get("infocode")) in AMAP_OVERLOAD_INFOCODES:
+            raise ValueError(f"AMap overloaded: {data.get('info')}")
+        return data
 
+    async def _call(self, path: str, params: dict) -> dict:
+        """
+        发出一次高德请求，受并发上限、QPS 限速、熔断器与本次解析的时间预算约束。
+        失败时抛出 GeoUnavailable。
+        """
+        remaining = self._remaining()
+        if remaining is not None and remaining <= 0:
+            raise GeoUnavailable("geocoding deadline exceeded")
+        if not self.breaker.allow():
+            raise GeoUnavailable("circuit open")
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                resp = await client.get(
-                    "https://restapi.amap.com/v3/geocode/geo",
-                    params={"key": self.amap_key, "address": location_text},
-                )
-                data = resp.json()
+            data = await asyncio.wait_for(self._send(path, params), remaining)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except (httpx.HTTPError, asyncio.TimeoutError, ValueError) as exc:
+            self.breaker.record_failure()
+            raise GeoUnavailable(str(exc) or type(exc).__name__) from exc
         except Exception:
-            data = {}
+            # 其它意外异常同样记为失败，否则半开状态的探测名额永远不会归还
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return data
+
+    async def _single_flight(self, cache_key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        先查缓存；未命中时同一个键的并发调用只发出一次请求，其余调用等待同一结果。
+        请求失败（GeoUnavailable）时不写缓存，异常传给所有等待方；发出请求的调用被取消时
+        由等待方接手重新请求。
+        """
+        cached = await self.cache.get(cache_key)
+        if cached is not MISSING:
+            return cached
+        if _offline.get():
+            raise GeoPending(cache_key)
+
+        async def fetch_and_cache() -> Any:
+            value = await fetch()
+            await self.cache.set(cache_key, value)
+            return value
+
+        try:
+            return await self._flights.run(cache_key, fetch_and_cache, timeout=self._remaining())
+        except asyncio.TimeoutError:
+            raise GeoUnavailable("geocoding deadline exceeded") from None
+
+    def _parse_geocode(self, geocode: dict) -> GeoResult | None:
+        # 批量模式下查不到的地址 location 为空列表
+        loc = geocode.get("location") or ""
+        adcode = (
+                str(
+                    geocode.get("addressComponent", {}).get("adcode")
+                    or geocode.get("adcode")
+                    or ""
+                ).strip()
+                or None
+        )
+        nums = self.coord_number_re.findall(loc)
+        if len(nums) >= 2:
+            try:
+                # 高德API返回格式: "经度,纬度"
+                lng, lat = float(nums[0]), float(nums[1])
+                return lat, lng, adcode
+            except ValueError:
+                return None
+        return None
 
-        result = None
-        geocodes = data.get("geocodes") or [] if isinstance(data, dict) else []
+    async def _fetch_geocode(self, location_text: str) -> GeoResult | None:
+        data = await self._call("/v3/geocode/geo", {"address": location_text})
+        geocodes = data.get("geocodes") or []
         if data.get("status") == "1" and geocodes:
-            loc = geocodes[0].get("location", "")
-            adcode = (
-                    str(
-                        geocodes[0].get("addressComponent", {}).get("adcode")
-                        or geocodes[0].get("adcode")
-                        or ""
-                    ).strip()
-                    or None
+            return self._parse_geocode(geocodes[0])
+        return None
+
+    @staticmethod
+    def _normalize_address(location_text: str | None) -> str:
+        # 规整空白后作为缓存与合并请求的键，"北京  天安门" 与 "北京 天安门" 视为同一地址
+        return " ".join((location_text or "").split())
+
+    async def geocode_location(self, location_text: str) -> GeoResult | None:
+        location_text = self._normalize_address(location_text)
+        if not location_text:
+            return None
+        try:
+            result = await self._single_flight(
+                f"geo:{location_text}", lambda: self._fetch_geocode(location_text)
+            )
+        except GeoUnavailable:
+            return None
+        return tuple(result) if result else None
+
+    async def _fetch_geocode_batch(self, addresses: list[str]) -> list[GeoResult | None]:
+        data = await self._call("/v3/geocode/geo", {"address": "|".join(addresses), "batch": "true"})
+        geocodes = data.get("geocodes") or []
+        # 批量结果与输入一一对应；整批查询失败或条数对不上时全部按无结果处理
+        if data.get("status") != "1" or len(geocodes) != len(addresses):
+            return [None] * len(addresses)
+        return [self._parse_geocode(geocode) if isinstance(geocode, dict) else None for geocode in geocodes]
+
+    async def geocode_many(self, addresses: list[str | None]) -> list[GeoResult | None]:
+        """
+        批量正向地理编码，结果与输入顺序一致。
+
+        先按规整后的地址去重并查缓存，未命中的地址每 10 个打包成一次 batch=true 请求，
+        各批次并发发出，受 geo_max_concurrency、geo_max_qps 与熔断器约束。含 | 的地址无法放进
+        批量参数，单独走 geocode_location。
+        """
+        keys = [self._normalize_address(address) for address in addresses]
+        results: dict[str, Any] = {}
+        misses = []
+        for key in dict.fromkeys(key for key in keys if key):
+            cached = await self.cache.get(f"geo:{key}")
+            if cached is not MISSING:
+                results[key] = cached
+            elif "|" in key:
+                results[key] = await self.geocode_location(key)
+            else:
+                misses.append(key)
+        if misses and _offline.get():
+            raise GeoPending(f"geo:{misses[0]}")
+
+        async def fetch_batch(batch: list[str]) -> None:
+            try:
+                values = await self._fetch_geocode_batch(batch)
+            except GeoUnavailable:
+                # 请求失败不缓存，本次按无结果返回
+                return
+            for key, value in zip(batch, values):
+                await self.cache.set(f"geo:{key}", value)
+                results[key] = value
+
+        await asyncio.gather(
+            *(
+                fetch_batch(misses[i : i + GEOCODE_BATCH_SIZE])
+                for i in range(0, len(misses), GEOCODE_BATCH_SIZE)
             )
-            nums = self.coord_number_re.findall(loc)
-            if len(nums) >= 2:
-                try:
-                    # 高德API返回格式: "经度,纬度"
-                    lng, lat = float(nums[0]), float(nums[1])
-                    result = (lat, lng, adcode)
-                except ValueError:
-                    result = None
-
-        self.geocode_cache[location_text] = result
-        return result
+        )
+        return [tuple(results[key]) if results.get(key) else None for key in keys]
+
+    async def _fetch_regeo(self, lat: float, lng: float) -> str | None:
+        # 高德逆地理编码API参数格式: location=经度,纬度
+        data = await self._call("/v3/geocode/regeo", {"location": f"{lng},{lat}"})
+        regeocode = data.get("regeocode") or {}
+        adcode = regeocode.get("addressComponent", {}).get("adcode") if isinstance(regeocode, dict) else None
+        if adcode:
+            return str(adcode).strip() or None
+        return None
 
     async def reverse_geocode(self, lat: float, lng: float) -> str | None:
-        key = f"{lat:.6f},{lng:.6f}"
-        if key in self.reverse_cache:
-            return self.reverse_cache[key]
+        # 优先用本地边界离线换算；本地未命中（境外、海上）或要求区级精度时才请求高德
+        region = self.boundaries.lookup(lat, lng) if self.boundaries else None
+        if region and (not self.network_regeo or region.level == "district"):
+            return region.adcode
+        # 坐标保留 6 位小数（约 0.1 米）作为键，更小的差异视为同一点
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                # 高德逆地理编码API参数格式: location=经度,纬度
-                resp = await client.get(
-                    "https://restapi.amap.com/v3/geocode/regeo",
-                    params={"key": self.amap_key, "location": f"{lng},{lat}"},
-                )
-                data = resp.json()
-                adcode = (
-                    data.get("regeocode", {})
-                    .get("addressComponent", {})
-                    .get("adcode")
-                )
-        except Exception:
-            adcode = None
-        if adcode:
-            adcode = str(adcode).strip() or None
-        else:
+            adcode = await self._single_flight(
+                f"regeo:{lat:.6f},{lng:.6f}", lambda: self._fetch_regeo(lat, lng)
+            )
+        except GeoUnavailable:
             adcode = None
-        self.reverse_cache[key] = adcode
-        return adcode
+        return adcode or (region.adcode if region else None)
 
     async def resolve_location(self, location_text: str | None) -> GeoResult | None:
         coords = self.parse_coords_from_location(location_text)
@@ -204,3 +453,104 @@ class GeoHelper:
             return coords_str
 
         return location_text or None
+
+
+def geo_status_for(target) -> str | None:
+    if not (target.location or "").strip():
+        return None
+    return "ok" if target.lat is not None and target.lng is not None else "failed"
+
+
+async def assign_geo_info(
+    target,
+    geo_helper: GeoHelper,
+    location_text: str | None,
+    source_location: str | None = None,
+    *,
+    update_requested: bool = True,
+    allow_clear: bool = True,
+):
+    if not update_requested:
+        return
+
+    prev_lat, prev_lng, prev_adcode = target.lat, target.lng, getattr(target, "adcode", None)
+    raw_text = location_text if location_text else source_location
+    cleaned = (raw_text or "").strip()
+
+    # 用户明确清空位置
+    if raw_text is not None and cleaned == "":
+        if allow_clear:
+            target.lat = None
+            target.lng = None
+            target.adcode = None
+        return
+
+    lat, lng, adcode = prev_lat, prev_lng, prev_adcode
+    geo_info = await geo_helper.resolve_location(cleaned) if cleaned else None
+    if geo_info:
+        lat, lng, adcode = geo_info
+    else:
+        coords_only = geo_helper.parse_coords_from_location(cleaned) if cleaned else None
+        if coords_only:
+            lat, lng = coords_only[0], coords_only[1]
+            adcode = await geo_helper.reverse_geocode(lat, lng)
+
+    if lat is not None and lng is not None and not adcode:
+        adcode = await geo_helper.reverse_geocode(lat, lng) or adcode
+
+    target.lat = lat
+    target.lng = lng
+    target.adcode = adcode
+
+
+def ensure_coords(target, geo_helper: GeoHelper) -> None:
+    """位置文本自带坐标而经纬度列为空时（旧数据或地理编码失败），直接解析写入列中。"""
+    if target.lat is not None and target.lng is not None:
+        return
+    coords = geo_helper.parse_coords_from_location(target.location)
+    if coords:
+        target.lat, target.lng = coords[0], coords[1]
+
+
+@dataclass
+class LocationInput:
+    """一次写入的位置输入。pending 为真时 location 是未合并坐标的原始文本，等待后台解析。"""
+
+    location: str | None
+    coords: str | None
+    source: str | None
+    pending: bool = False
+
+
+async def merge_location_offline(
+    geo_helper: GeoHelper, location: str | None, coords: str | None, source: str | None = None
+) -> LocationInput:
+    """
+    合并位置文本与坐标，只用本地解析与缓存。坐标可解析或地址已有缓存时当场完成；
+    否则保留原始文本，标记为 pending 交给后台任务。
+    """
+    try:
+        with geo_helper.offline():
+            merged = await geo_helper.merge_location_and_coords(location, coords)
+        return LocationInput(merged, coords, source)
+    except GeoPending:
+        return LocationInput((location or "").strip() or None, coords, source, pending=True)
+
+
+async def apply_geo_info(
+    target, geo_helper: GeoHelper, geo: LocationInput, *, allow_clear: bool = True
+) -> bool:
+    """
+    离线写入坐标与 adcode 并设置 geo_status；需要请求高德时保留原有坐标、
+    标记 pending 并返回 True，由调用方在 flush 后入队。
+    """
+    if not geo.pending:
+        try:
+            with geo_helper.offline():
+                await assign_geo_info(target, geo_helper, geo.location, geo.source, allow_clear=allow_clear)
+            target.geo_status = geo_status_for(target)
+            return False
+        except GeoPending:
+            pass
+    target.geo_status = "pending"
+    return True
@@ -0,0 +1,158 @@
+"""
+地理编码 HTTP 客户端基准测试
+
+在本地启动一个 HTTPS 的高德接口桩服务（自签名证书），对比
+- 每次请求新建 httpx.AsyncClient（每次都要 TCP + TLS 握手）
+- 共享长连接客户端（create_amap_client 同样的连接池配置）
+下 GeoHelper.geocode_location / reverse_geocode 的延迟。
+
+运行方法：
+cd backend
+python -m benchmarks.geocode_latency --requests 200
+"""
+
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from fastapi import FastAPI
+
+from app.config import get_settings
+from app.utils import GeoHelper
+
+settings = get_settings()
+stub = FastAPI()
+
+
+@stub.get("/v3/geocode/geo")
+async def stub_geocode(address: str = ""):
+    return {"status": "1", "geocodes": [{"location": "116.397428,39.90923", "adcode": "110101"}]}
+
+
+@stub.get("/v3/geocode/regeo")
+async def stub_regeocode(location: str = ""):
+    return {"status": "1", "regeocode": {"addressComponent": {"adcode": "110101"}}}
+
+
+def _self_signed_cert(directory: Path) -> tuple[str, str]:
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = directory / "cert.pem", directory / "key.pem"
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+    )
+    return str(cert_path), str(key_path)
+
+
+def _client(base_url: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        verify=False,
+        timeout=settings.amap_timeout,
+        limits=httpx.Limits(
+            max_connections=settings.amap_max_connections,
+            max_keepalive_connections=settings.amap_max_keepalive,
+        ),
+    )
+
+
+async def _one_save(helper: GeoHelper, i: int) -> None:
+    # 一次带地点的保存：正向地理编码 + 逆地理编码各一次，地址各不相同以避开进程内缓存
+    await helper.geocode_location(f"测试地点 {i}")
+    await helper.reverse_geocode(39.9 + i * 1e-5, 116.4)
+
+
+async def _measure_per_call(base_url: str, requests: int) -> list[float]:
+    samples = []
+    for i in range(requests):
+        start = time.perf_counter()
+        # 与改动前一致：每个请求各自新建并关闭一个客户端
+        async with _client(base_url) as client:
+            await GeoHelper("bench", client=client).geocode_location(f"测试地点 {i}")
+        async with _client(base_url) as client:
+            await GeoHelper("bench", client=client).reverse_geocode(39.9 + i * 1e-5, 116.4)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def _measure_shared(base_url: str, requests: int) -> list[float]:
+    samples = []
+    helper = GeoHelper("bench", client=_client(base_url))
+    try:
+        for i in range(requests):
+            start = time.perf_counter()
+            await _one_save(helper, i)
+            samples.append((time.perf_counter() - start) * 1000)
+    finally:
+        await helper.aclose()
+    return samples
+
+
+def _summary(samples: list[float]) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    return f"{statistics.median(ordered):>8.2f}{p95:>10.2f}{statistics.mean(ordered):>10.2f}"
+
+
+async def run(requests: int, port: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = _self_signed_cert(Path(tmp))
+        config = uvicorn.Config(
+            stub, host="127.0.0.1", port=port, ssl_certfile=cert, ssl_keyfile=key, log_level="warning"
+        )
+        server = uvicorn.Server(config)
+        serve_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+        base_url = f"https://127.0.0.1:{port}"
+        try:
+            # 预热，排除首次导入与握手缓存的影响
+            await _measure_shared(base_url, 5)
+            per_call = await _measure_per_call(base_url, requests)
+            shared = await _measure_shared(base_url, requests)
+        finally:
+            server.should_exit = True
+            await serve_task
+
+    print(f"每次保存 = geocode + regeo 两次请求，共 {requests} 次 (ms)")
+    print(f"{'客户端':<14}{'中位数':>8}{'p95':>10}{'平均':>10}")
+    print(f"{'每次新建':<14}{_summary(per_call)}")
+    print(f"{'共享长连接':<14}{_summary(shared)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="地理编码 HTTP 客户端延迟基准测试")
+    parser.add_argument("--requests", type=int, default=200, help="模拟保存次数")
+    parser.add_argument("--port", type=int, default=18443, help="桩服务端口")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.port))
+
+
+if __name__ == "__main__":
+    main()
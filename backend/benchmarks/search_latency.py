@@ -0,0 +1,154 @@
+"""
+关键字搜索基准测试
+
+在独立 schema 中生成混合中英文的测试数据，分别在无索引（纯 LIKE）/ 有 n-gram 索引时
+测量 build_timeline 与 _build_map_markers 的搜索延迟。词表由少量固定词和大量随机
+两字词组成，固定词在数据中较稀疏，接近真实日记里地名、菜名等短查询的选择性。
+
+运行方法：
+cd backend
+python -m benchmarks.search_latency --rows 100000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.config import get_settings
+from app.database import Base
+from app.indexing import rebuild_timeline_items
+from app.routers.map import _build_map_markers
+from app.routers.timeline import build_timeline
+from app.search import SEARCH_COLUMNS, ensure_search_indexes
+
+SCHEMA = "bench_search"
+WORDS = [
+    "北京", "上海", "西湖", "日落", "海边", "散步", "火锅", "电影", "生日", "旅行",
+    "coffee", "sunset", "beach", "hiking", "dinner", "museum", "concert", "picnic", "rain", "snow",
+]
+# 随机两字词的字表，不含固定词用到的字，避免意外拼出查询词
+FILLER_CHARS = "天地人和春秋风雨花草山水云月星光明家园书画茶酒歌舞学校公司朋友周末早晚红黄蓝绿"
+FILLER_WORDS = 2000
+QUERIES = ["西湖", "火锅", "湖", "生日", "sunset", "hik", "museum 北京", "不存在的词"]
+
+
+def _vocabulary() -> list[str]:
+    rng = random.Random(42)
+    fillers = {rng.choice(FILLER_CHARS) + rng.choice(FILLER_CHARS) for _ in range(FILLER_WORDS)}
+    return WORDS + sorted(fillers)
+
+
+def _random_text_sql(words: int) -> str:
+    # 引用 g 使子查询对每一行重新求值
+    return (
+        "array_to_string(ARRAY(SELECT (CAST(:words AS text[]))[1 + floor(random() * :n)::int] "
+        f"FROM generate_series(1, {words}) WHERE g > 0), ' ')"
+    )
+
+
+async def _seed(conn, rows: int):
+    words = _vocabulary()
+    params = {"words": words, "n": len(words), "rows": rows}
+    await conn.execute(
+        text(
+            "INSERT INTO entry (content, location, created_at) "
+            f"SELECT {_random_text_sql(12)}, {_random_text_sql(2)}, now() - g * interval '1 hour' "
+            "FROM generate_series(1, CAST(:rows AS int)) g"
+        ),
+        params,
+    )
+    await conn.execute(
+        text(
+            "INSERT INTO photo (filename, caption, location, created_at) "
+            f"SELECT md5(g::text) || '.jpg', {_random_text_sql(4)}, {_random_text_sql(2)}, "
+            "now() - g * interval '1 hour' FROM generate_series(1, CAST(:rows AS int) / 5) g"
+        ),
+        params,
+    )
+    await conn.execute(
+        text(
+            "INSERT INTO key_date (title, location, date, created_at) "
+            f"SELECT {_random_text_sql(3)}, {_random_text_sql(2)}, now() - g * interval '1 day', now() "
+            "FROM generate_series(1, CAST(:rows AS int) / 20) g"
+        ),
+        params,
+    )
+
+
+async def _measure(session_factory, repeat: int) -> dict[str, tuple[float, float]]:
+    results = {}
+    for query in QUERIES:
+        timeline_ms, map_ms = [], []
+        for _ in range(repeat):
+            async with session_factory() as session:
+                start = time.perf_counter()
+                await build_timeline(session, query, "all", "", 1, 24)
+                timeline_ms.append((time.perf_counter() - start) * 1000)
+                start = time.perf_counter()
+                await _build_map_markers(session, query, "all", "", 800)
+                map_ms.append((time.perf_counter() - start) * 1000)
+        results[query] = (statistics.median(timeline_ms), statistics.median(map_ms))
+    return results
+
+
+async def run(rows: int, repeat: int, keep: bool):
+    settings = get_settings()
+    admin = create_async_engine(settings.database_url)
+    async with admin.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+    engine = create_async_engine(
+        settings.database_url, connect_args={"server_settings": {"search_path": f"{SCHEMA},public"}}
+    )
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await _seed(conn, rows)
+        async with session_factory() as session:
+            await rebuild_timeline_items(session)
+        async with engine.begin() as conn:
+            await conn.execute(text("ANALYZE"))
+        total = rows + rows // 5 + rows // 20
+        print(f"生成数据: {total} 行 (entry={rows}, photo={rows // 5}, key_date={rows // 20})")
+
+        before = await _measure(session_factory, repeat)
+        async with engine.begin() as conn:
+            indexed = await ensure_search_indexes(conn)
+            await conn.execute(text("ANALYZE"))
+        if not indexed:
+            print("⚠️  n-gram 索引创建失败，无法对比索引效果")
+        after = await _measure(session_factory, repeat)
+
+        print(f"{'查询':<16}{'timeline 无索引':>16}{'timeline 索引':>14}{'map 无索引':>12}{'map 索引':>10}  (ms, 中位数)")
+        for query in QUERIES:
+            print(
+                f"{query:<16}{before[query][0]:>16.1f}{after[query][0]:>14.1f}"
+                f"{before[query][1]:>12.1f}{after[query][1]:>10.1f}"
+            )
+        print(f"索引列: {SEARCH_COLUMNS}")
+    finally:
+        await engine.dispose()
+        if not keep:
+            async with admin.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await admin.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="关键字搜索延迟基准测试")
+    parser.add_argument("--rows", type=int, default=100_000, help="entry 表行数（photo/key_date 按比例生成）")
+    parser.add_argument("--repeat", type=int, default=5, help="每个查询重复次数")
+    parser.add_argument("--keep", action="store_true", help="保留测试 schema 便于 EXPLAIN")
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.repeat, args.keep))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+照片上传并发基准测试
+
+在后台线程中用 uvicorn 启动一个只含时间线路由与两个上传接口的服务：
+- legacy：改动前的写法，await file.read() 读入整个文件后在事件循环里 write_bytes
+- streaming：照片接口的写法，app.uploads.stream_upload 分块流式写入临时文件，
+  app.blobs.store_blob 登记引用计数，提交后原子改名
+多个客户端同时上传大图时，持续请求 /api/timeline 并统计其延迟，对比两种写法
+对同一 worker 上其它请求的影响。需要可用的 DATABASE_URL，结束时删除登记的 photo_blob 行。
+
+运行方法：
+cd backend
+python -m benchmarks.upload_latency --uploads 8 --size-mb 20
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+import uvicorn
+from fastapi import Depends, FastAPI, File, UploadFile
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.blobs import store_blob
+from app.database import SessionLocal, engine, get_session
+from app.deps import get_current_user
+from app.models import PhotoBlob
+from app.routers import timeline as timeline_router
+from app.uploads import stream_upload
+
+upload_dir = Path(tempfile.mkdtemp(prefix="bench-uploads-"))
+bench = FastAPI()
+bench.include_router(timeline_router.router)
+bench.dependency_overrides[get_current_user] = lambda: None
+stored: set[str] = set()
+
+
+@bench.post("/legacy")
+async def legacy_upload(file: UploadFile = File(...)):
+    ext = os.path.splitext(file.filename)[1].lower()
+    dest = upload_dir / f"{uuid.uuid4().hex}{ext}"
+    content = await file.read()
+    dest.write_bytes(content)
+    return {"filename": dest.name}
+
+
+@bench.post("/streaming")
+async def streaming_upload(file: UploadFile = File(...), session: AsyncSession = Depends(get_session)):
+    staged = await stream_upload(file, upload_dir, max_bytes=1 << 40)
+    await store_blob(session, staged, upload_dir)
+    await session.commit()
+    stored.add(staged.filename)
+    return {"filename": staged.filename}
+
+
+def _summary(samples: list[float]) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[max(int(len(ordered) * 0.95) - 1, 0)]
+    return f"{statistics.median(ordered):>8.1f}{p95:>10.1f}{ordered[-1]:>10.1f}{len(ordered):>8}"
+
+
+async def _probe_timeline(client: httpx.AsyncClient, stop: asyncio.Event) -> list[float]:
+    samples = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        resp = await client.get("/api/timeline", params={"per_page": 20})
+        resp.raise_for_status()
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+    return samples
+
+
+async def _run_mode(base_url: str, path: str | None, rounds: int, payloads: list[bytes]) -> list[float]:
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        stop = asyncio.Event()
+        probe = asyncio.create_task(_probe_timeline(client, stop))
+        if path is None:
+            await asyncio.sleep(2)
+        else:
+            for _ in range(rounds):
+                await asyncio.gather(
+                    *(
+                        client.post(path, files={"file": ("photo.jpg", payload, "image/jpeg")})
+                        for payload in payloads
+                    )
+                )
+        stop.set()
+        return await probe
+
+
+async def run(uploads: int, size_mb: int, rounds: int, port: int):
+    config = uvicorn.Config(bench, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    # 服务端在独立线程的事件循环中运行，客户端的收发不会干扰测量
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.05)
+    base_url = f"http://127.0.0.1:{port}"
+    # JPEG 文件头 + 随机内容，能通过类型识别；每个并发上传内容不同，不会在同一 blob 行上排队
+    payloads = [b"\xff\xd8\xff\xe0" + os.urandom(size_mb * 1024 * 1024) for _ in range(uploads)]
+    try:
+        await _run_mode(base_url, None, rounds, payloads)
+        results = {}
+        for name, path in (("无上传", None), ("legacy", "/legacy"), ("streaming", "/streaming")):
+            results[name] = await _run_mode(base_url, path, rounds, payloads)
+    finally:
+        server.should_exit = True
+        thread.join()
+        if stored:
+            # 连接池里的连接属于服务端线程已关闭的事件循环，丢弃后重新连接
+            await engine.dispose(close=False)
+            async with SessionLocal() as session:
+                await session.execute(delete(PhotoBlob).where(PhotoBlob.filename.in_(stored)))
+                await session.commit()
+        for item in upload_dir.iterdir():
+            item.unlink()
+        upload_dir.rmdir()
+
+    print(f"{uploads} 个并发上传 × {rounds} 轮，每个 {size_mb} MB；/api/timeline 延迟 (ms)")
+    print(f"{'上传方式':<12}{'中位数':>8}{'p95':>10}{'最大':>10}{'样本':>8}")
+    for name, samples in results.items():
+        print(f"{name:<12}{_summary(samples)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="照片上传并发对时间线延迟的影响")
+    parser.add_argument("--uploads", type=int, default=8, help="同时上传的数量")
+    parser.add_argument("--size-mb", type=int, default=20, help="每个文件的大小（MB）")
+    parser.add_argument("--rounds", type=int, default=3, help="上传轮数")
+    parser.add_argument("--port", type=int, default=18444, help="服务端口")
+    args = parser.parse_args()
+    asyncio.run(run(args.uploads, args.size_mb, args.rounds, args.port))
+
+
+if __name__ == "__main__":
+    main()
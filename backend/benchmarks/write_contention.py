@@ -0,0 +1,124 @@
+"""
+并发写入基准测试
+
+在独立 schema 中生成若干条日记，多个客户端同时通过 PUT /api/entries/{id} 修改
+各自不同的条目（同时改正文与时间），统计写入吞吐与延迟，
+以及压测期间 pg_locks 中等待行锁 / 咨询锁的会话数。用于对比版本号分配方式对
+写入并发的影响。需要可用的 DATABASE_URL。
+
+运行方法：
+cd backend
+python -m benchmarks.write_contention --writers 16 --writes 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.changes import change_sequencer
+from app.config import get_settings
+from app.database import Base, get_session
+from app.deps import get_current_user
+from app.routers import entries as entries_router
+
+SCHEMA = "bench_writes"
+
+
+async def _sample_lock_waits(engine, stop: asyncio.Event) -> list[int]:
+    samples = []
+    async with engine.connect() as conn:
+        while not stop.is_set():
+            waiting = await conn.scalar(
+                text("SELECT count(*) FROM pg_locks WHERE NOT granted AND locktype IN ('transactionid', 'tuple', 'advisory')")
+            )
+            samples.append(int(waiting))
+            await asyncio.sleep(0.01)
+    return samples
+
+
+async def run(writers: int, writes: int, keep: bool):
+    settings = get_settings()
+    admin = create_async_engine(settings.database_url)
+    async with admin.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+    engine = create_async_engine(
+        settings.database_url,
+        pool_size=writers,
+        connect_args={"server_settings": {"search_path": f"{SCHEMA},public"}},
+    )
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+
+    async def scratch_session():
+        async with session_factory() as session:
+            yield session
+
+    bench = FastAPI()
+    bench.include_router(entries_router.router)
+    bench.dependency_overrides[get_session] = scratch_session
+    bench.dependency_overrides[get_current_user] = lambda: None
+
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        change_sequencer.start(session_factory)
+        transport = httpx.ASGITransport(app=bench)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            ids = []
+            for i in range(writers):
+                resp = await client.post("/api/entries", json={"content": f"初始 {i}"})
+                resp.raise_for_status()
+                ids.append(resp.json()["id"])
+
+            latencies: list[float] = []
+
+            async def writer(entry_id: int):
+                for n in range(writes):
+                    start = time.perf_counter()
+                    resp = await client.put(
+                        f"/api/entries/{entry_id}",
+                        json={"content": f"第 {n} 次修改", "custom_date": f"2024-01-{n % 28 + 1:02d}"},
+                    )
+                    resp.raise_for_status()
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(_sample_lock_waits(admin, stop))
+            start = time.perf_counter()
+            await asyncio.gather(*(writer(entry_id) for entry_id in ids))
+            elapsed = time.perf_counter() - start
+            stop.set()
+            waits = await sampler
+    finally:
+        await change_sequencer.stop()
+        await engine.dispose()
+        if not keep:
+            async with admin.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await admin.dispose()
+
+    ordered = sorted(latencies)
+    p95 = ordered[max(int(len(ordered) * 0.95) - 1, 0)]
+    print(f"{writers} 个并发写入 × {writes} 次，共 {len(ordered)} 次写入，耗时 {elapsed:.2f}s")
+    print(f"吞吐 {len(ordered) / elapsed:.1f} 次/秒，延迟中位数 {statistics.median(ordered):.1f} ms，p95 {p95:.1f} ms")
+    print(f"等待锁的会话数：平均 {statistics.mean(waits):.2f}，最大 {max(waits)}（每 10ms 采样）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发写入吞吐与锁等待")
+    parser.add_argument("--writers", type=int, default=16, help="并发写入的客户端数")
+    parser.add_argument("--writes", type=int, default=50, help="每个客户端的写入次数")
+    parser.add_argument("--keep", action="store_true", help="保留测试 schema")
+    args = parser.parse_args()
+    asyncio.run(run(args.writers, args.writes, args.keep))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 import React from "react";
 import { motion } from "framer-motion";
 import { TimelineItem } from "../lib/types";
-import { cleanGeo, formatDateLabel, getDaysDiff } from "../lib/utils";
+import { cleanGeo, formatDateLabel, getDaysDiff, variantSrcSet } from "../lib/utils";
 import { renderMarkdown } from "../lib/markdown";
 
+// 时间线照片的显示宽度，浏览器据此从 srcset 中挑选派生图
+const PHOTO_SIZES = "(max-width: 768px) 100vw, 720px";
+
 type Props = {
   item: TimelineItem;
   index: number;
@@ -86,7 +89,25 @@ const TimelineRow: React.FC<Props> = ({ item, index, onEdit, onDelete, isActive,
           {item.type === "photo" && (
             <>
               <div className="photo-frame">
-                <img src={item.image} alt={item.caption || "Memory photo"} loading="lazy" />
+                <picture>
+                  {(["avif", "webp"] as const).map((format) => {
+                    const srcSet = variantSrcSet(item.variants, format);
+                    return srcSet ? (
+                      <source key={format} type={`image/${format}`} srcSet={srcSet} sizes={PHOTO_SIZES} />
+                    ) : null;
+                  })}
+                  <img
+                    src={item.image}
+                    srcSet={variantSrcSet(item.variants, "jpg")}
+                    sizes={PHOTO_SIZES}
+                    width={item.width ?? undefined}
+                    height={item.height ?? undefined}
+                    style={item.dominant_color ? { backgroundColor: item.dominant_color } : undefined}
+                    alt={item.caption || "Memory photo"}
+                    loading="lazy"
+                    decoding="async"
+                  />
+                </picture>
               </div>
               {item.caption && <div className="photo-caption">{item.caption}</div>}
               {item.location && <div className="entry-location">{cleanGeo(item.location)}</div>}
@@ -1,7 +1,15 @@
 import axios from "axios";
 import { API_BASE_URL } from "./config";
 import { emitAppEvent } from "./eventBus";
-import { MapResponse, TimelineResponse, User } from "./types";
+import {
+  ChangeEvent,
+  ChangesResponse,
+  ColumnarMapResponse,
+  MapMarker,
+  MapResponse,
+  TimelineResponse,
+  User,
+} from "./types";
 
 const TOKEN_KEY = "lovejournal_token";
 
@@ -45,12 +53,38 @@ export async function fetchMe() {
   return res.data;
 }
 
+// 订阅 /api/events 的实时变更推送；EventSource 断线后自动重连并携带 Last-Event-ID 补齐
+export function subscribeChanges(onEvent: (event: ChangeEvent) => void) {
+  const token = getStoredToken();
+  if (!token || typeof EventSource === "undefined") {
+    return () => {};
+  }
+  const source = new EventSource(`${API_BASE_URL}/events?token=${encodeURIComponent(token)}`);
+  const listen = (type: ChangeEvent["type"]) =>
+    source.addEventListener(type, (e) => {
+      try {
+        onEvent({ type, ...JSON.parse((e as MessageEvent<string>).data) } as ChangeEvent);
+      } catch (err) {
+        console.warn("[subscribeChanges] Malformed event", err);
+      }
+    });
+  listen("change");
+  listen("reset");
+  return () => source.close();
+}
+
+export async function fetchChanges(since: number) {
+  const res = await api.get<ChangesResponse>("/changes", { params: { since } });
+  return res.data;
+}
+
 export async function fetchTimeline(params: {
   q?: string;
   type?: string;
   tag?: string;
   page?: number;
   per_page?: number;
+  cursor?: string;
 }) {
   const res = await api.get<TimelineResponse>("/timeline", { params });
   return res.data;
@@ -139,9 +173,42 @@ export async function deletePhoto(id: number) {
   setTimeout(() => invalidateMap(), 100);
 }
 
-export async function fetchMap(params?: { q?: string; type?: string; tag?: string; limit?: number; since_version?: number }) {
-  const res = await api.get<MapResponse>("/map", { params });
-  return res.data;
+export async function fetchMap(params?: {
+  q?: string;
+  type?: string;
+  tag?: string;
+  limit?: number;
+  since_version?: number;
+  bbox?: string;
+}) {
+  const res = await api.get<ColumnarMapResponse>("/map", { params: { ...params, format: "columnar" } });
+  return decodeColumnarMap(res.data);
+}
+
+export function decodeColumnarMap(data: ColumnarMapResponse): MapResponse {
+  const markers: MapMarker[] = new Array(data.count);
+  let lat = 0;
+  let lng = 0;
+  for (let i = 0; i < data.count; i++) {
+    lat += data.lat[i];
+    lng += data.lng[i];
+    markers[i] = {
+      id: data.ids[i],
+      kind: data.kind_table[data.kinds[i]],
+      lat: lat / data.coord_scale,
+      lng: lng / data.coord_scale,
+      label: data.label_table[data.labels[i]],
+      // 服务端按 UTC 换算墙钟时间（毫秒），这里用 UTC 还原出原来的无时区字符串
+      timestamp: new Date(data.ts[i]).toISOString().slice(0, 23).replace(/\.000$/, ""),
+      snippet: data.snippets[i],
+      image: data.images[i],
+      adcode: data.adcode_table[data.adcodes[i]],
+      thumbnail: data.thumbnails[i],
+      width: data.widths[i],
+      height: data.heights[i],
+    };
+  }
+  return { markers, version: data.version, unchanged: data.unchanged };
 }
 
 export default api;
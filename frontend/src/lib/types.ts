@@ -11,12 +11,28 @@ export interface TimelineItem {
   location_coords?: string | null;
   tags: string[];
   image?: string;
+  geo_status?: "pending" | "ok" | "failed" | null;
+  width?: number | null;
+  height?: number | null;
+  dominant_color?: string | null;
+  blurhash?: string | null;
+  thumbnail?: string | null;
+  variants?: ImageVariant[];
+}
+
+// 照片派生图：同一尺寸有 avif / webp / jpg 多种格式
+export interface ImageVariant {
+  width: number;
+  height: number;
+  format: "avif" | "webp" | "jpg";
+  url: string;
 }
 
 export interface TimelineResponse {
   items: TimelineItem[];
-  page: number;
+  page: number | null;
   has_more: boolean;
+  next_cursor?: string | null;
 }
 
 export interface User {
@@ -35,10 +51,59 @@ export interface MapMarker {
   snippet: string;
   image?: string | null;
   adcode?: string | null;
+  thumbnail?: string | null;
+  width?: number | null;
+  height?: number | null;
+}
+
+// /api/changes 的单条变更：upsert 带最新的时间线条目与地图标记（无坐标时 marker 为 null），delete 只有 id
+export interface ChangeItem {
+  kind: TimelineType;
+  id: number;
+  op: "upsert" | "delete";
+  version: number;
+  item?: TimelineItem | null;
+  marker?: MapMarker | null;
 }
 
+export interface ChangesResponse {
+  version: number;
+  reset: boolean;
+  changes: ChangeItem[];
+}
+
+// /api/events 推送的事件：change 只带版本号与条目标识，内容通过 /api/changes 拉取
+export type ChangeEvent =
+  | { type: "change"; kind: TimelineType; id: number; op: "upsert" | "delete"; version: number }
+  | { type: "reset"; version: number };
+
 export interface MapResponse {
   markers: MapMarker[];
   version: number;
   unchanged?: boolean;
 }
+
+// /api/map?format=columnar 的列式响应：并行数组 + 字典编码，坐标为定点整数差分
+export interface ColumnarMapResponse {
+  format: "columnar";
+  version: number;
+  unchanged: boolean;
+  count: number;
+  coord_scale: number;
+  ids: number[];
+  kind_table: TimelineType[];
+  kinds: number[];
+  lat: number[];
+  lng: number[];
+  // epoch 毫秒
+  ts: number[];
+  label_table: string[];
+  labels: number[];
+  adcode_table: (string | null)[];
+  adcodes: number[];
+  snippets: string[];
+  images: (string | null)[];
+  thumbnails: (string | null)[];
+  widths: (number | null)[];
+  heights: (number | null)[];
+}
@@ -1,5 +1,6 @@
 import { clsx, ClassValue } from "clsx";
 import { twMerge } from "tailwind-merge";
+import { ImageVariant } from "./types";
 
 export function cn(...inputs: ClassValue[]) {
   return twMerge(clsx(inputs));
@@ -21,6 +22,12 @@ export const getDaysDiff = (date: Date) => {
   return { diff: 0, state: "today" as const };
 };
 
+// 某种格式的派生图拼成 srcset，没有该格式时返回 undefined
+export const variantSrcSet = (variants: ImageVariant[] | undefined, format: ImageVariant["format"]) => {
+  const matched = (variants || []).filter((v) => v.format === format);
+  return matched.length ? matched.map((v) => `${v.url} ${v.width}w`).join(", ") : undefined;
+};
+
 export const cleanGeo = (value?: string | null) => {
   if (!value) return "";
   const pattern = /^.*?(-?\d+)(?:\.\d+)?[,，\s]+(-?\d+)(?:\.\d+)?\s*(.*)$/;
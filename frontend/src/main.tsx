@@ -3,7 +3,9 @@ import ReactDOM from "react-dom/client";
 import { BrowserRouter } from "react-router-dom";
 import App from "./App";
 import "./index.css";
+import { subscribeChanges } from "./lib/api";
 import { useAuthStore } from "./store/auth";
+import { useTimelineStore } from "./store/timeline";
 
 const Root = () => {
   const initCalled = React.useRef(false);
@@ -14,6 +16,20 @@ const Root = () => {
       initAuth();
     }
   }, [initAuth]);
+  const user = useAuthStore((s) => s.user);
+  React.useEffect(() => {
+    if (!user) return;
+    // 另一位用户的修改经服务端推送到达：按版本号从 /api/changes 拉取增量合并到时间线与地图，
+    // 只有变更日志已压缩（reset）时才整体重新加载
+    return subscribeChanges((event) => {
+      const store = useTimelineStore.getState();
+      if (event.type === "reset") {
+        if (store.syncVersion !== null) store.init().catch((e) => console.warn("[subscribeChanges] Reload failed", e));
+      } else {
+        store.syncChanges(event.version);
+      }
+    });
+  }, [user]);
   return (
     <BrowserRouter>
       <App />
@@ -339,7 +339,7 @@ const MapPage: React.FC = () => {
           <div class="amap-info-window-custom">
             <span class="info-close" onclick="closeInfoWindow()">×</span>
             <div class="info-time">${new Date(m.timestamp).toLocaleString()}</div>
-            ${m.image ? `<img src="${m.image}" class="info-img" loading="lazy">` : ""}
+            ${m.image ? `<img src="${m.thumbnail || m.image}" class="info-img" loading="lazy">` : ""}
             <div class="info-content">${(m.snippet || "").slice(0, 120)}</div>
             <div class="info-geo">${m.label}</div>
           </div>
@@ -477,7 +477,8 @@ const MapPage: React.FC = () => {
   React.useEffect(() => {
     const off = onAppEvent("map:invalidate", () => {
       const { q: fq, type: ftype, tag: ftag } = latestFiltersRef.current;
-      refreshMapRef.current({ q: fq, type: ftype, tag: ftag, limit: 800, force: true });
+      // 带上当前版本号，数据没变时服务端只返回 unchanged
+      refreshMapRef.current({ q: fq, type: ftype, tag: ftag, limit: 800 });
     });
     return off;
   }, []);
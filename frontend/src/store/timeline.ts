@@ -1,6 +1,6 @@
 import { create } from "zustand";
-import { fetchMap, fetchTags, fetchTimeline } from "../lib/api";
-import { MapMarker, TimelineItem } from "../lib/types";
+import { fetchChanges, fetchMap, fetchTags, fetchTimeline } from "../lib/api";
+import { ChangeItem, MapMarker, TimelineItem } from "../lib/types";
 
 type Filters = {
   q: string;
@@ -8,10 +8,52 @@ type Filters = {
   tag: string;
 };
 
+// 按当前筛选条件判断推送来的条目是否应出现在列表中（关键字只做本地子串匹配）
+const matchesFilters = (item: TimelineItem, filters: Filters) => {
+  if (filters.type !== "all" && item.type !== filters.type) return false;
+  if (filters.tag && !item.tags.includes(filters.tag)) return false;
+  if (filters.q) {
+    const needle = filters.q.toLowerCase();
+    const haystack = [item.content, item.caption, item.title, item.location, item.tags.join(" ")]
+      .filter(Boolean)
+      .join(" ")
+      .toLowerCase();
+    if (!haystack.includes(needle)) return false;
+  }
+  return true;
+};
+
+const byTimestampDesc = (a: { timestamp: string }, b: { timestamp: string }) =>
+  a.timestamp < b.timestamp ? 1 : a.timestamp > b.timestamp ? -1 : 0;
+
+const applyToTimeline = (items: TimelineItem[], changes: ChangeItem[], filters: Filters, hasMore: boolean) => {
+  let next = items;
+  for (const change of changes) {
+    const rest = next.filter((item) => !(item.type === change.kind && item.id === change.id));
+    const item = change.op === "upsert" ? change.item : null;
+    // 还有未加载的更早条目时，只插入落在已加载范围内的条目，避免打乱翻页
+    const oldest = rest[rest.length - 1];
+    const inRange = !hasMore || !oldest || (item && item.timestamp >= oldest.timestamp);
+    next = item && matchesFilters(item, filters) && inRange ? [...rest, item].sort(byTimestampDesc) : rest;
+  }
+  return next;
+};
+
+const applyToMap = (markers: MapMarker[], changes: ChangeItem[], filters: Filters) => {
+  let next = markers;
+  for (const change of changes) {
+    const rest = next.filter((marker) => !(marker.kind === change.kind && marker.id === change.id));
+    const marker = change.op === "upsert" ? change.marker : null;
+    next = marker && change.item && matchesFilters(change.item, filters) ? [...rest, marker] : rest;
+  }
+  return next;
+};
+
 interface TimelineState {
   items: TimelineItem[];
   mapItems: MapMarker[];
   page: number;
+  cursor: string | null;
   hasMore: boolean;
   loading: boolean;
   mapLoading: boolean;
@@ -19,6 +61,10 @@ interface TimelineState {
   mapRequestKey: string | null;
   mapDataKey: string | null;
   mapVersion: number | null;
+  // 已合并到本地列表的最新变更版本，null 表示尚未加载
+  syncVersion: number | null;
+  syncing: boolean;
+  syncPending: boolean;
   filters: Filters;
   tags: string[];
   init: (filters?: Partial<Filters>) => Promise<void>;
@@ -26,12 +72,14 @@ interface TimelineState {
   setFilters: (filters: Partial<Filters>) => Promise<void>;
   reset: () => Promise<void>;
   refreshMap: (filters?: Partial<Filters> & { per_page?: number; limit?: number; force?: boolean }) => Promise<void>;
+  syncChanges: (version?: number) => Promise<void>;
 }
 
 export const useTimelineStore = create<TimelineState>((set, get) => ({
   items: [],
   mapItems: [],
   page: 1,
+  cursor: null,
   hasMore: true,
   loading: false,
   mapLoading: false,
@@ -39,11 +87,14 @@ export const useTimelineStore = create<TimelineState>((set, get) => ({
   mapRequestKey: null,
   mapDataKey: null,
   mapVersion: null,
+  syncVersion: null,
+  syncing: false,
+  syncPending: false,
   filters: { q: "", type: "all", tag: "" },
   tags: [],
   init: async (filters = {}) => {
     const currentFilters = { ...get().filters, ...filters };
-    set({ filters: currentFilters, page: 1, loading: true });
+    set({ filters: currentFilters, page: 1, cursor: null, loading: true });
     try {
       const [timelineRes, tags] = await Promise.all([
         fetchTimeline({ q: currentFilters.q, type: currentFilters.type, tag: currentFilters.tag, page: 1 }),
@@ -52,16 +103,19 @@ export const useTimelineStore = create<TimelineState>((set, get) => ({
       set({
         items: Array.isArray(timelineRes?.items) ? timelineRes.items : [],
         page: timelineRes?.page || 1,
+        cursor: timelineRes?.next_cursor || null,
         hasMore: !!timelineRes?.has_more,
         tags: Array.isArray(tags) ? tags : [],
         loading: false,
       });
       await get().refreshMap({ ...currentFilters, limit: 800, force: true });
+      set({ syncVersion: get().mapVersion });
     } catch (e) {
       set({
         items: [],
         mapItems: [],
         page: 1,
+        cursor: null,
         hasMore: false,
         tags: [],
         loading: false,
@@ -69,26 +123,29 @@ export const useTimelineStore = create<TimelineState>((set, get) => ({
         mapRequestKey: null,
         mapDataKey: null,
         mapVersion: null,
+        syncVersion: null,
         mapError: "地图数据加载失败",
       });
       throw e;
     }
   },
   loadMore: async () => {
-    const { hasMore, loading, page, filters, items } = get();
+    const { hasMore, loading, page, cursor, filters, items } = get();
     if (!hasMore || loading) return;
     set({ loading: true });
     const nextPage = page + 1;
     try {
+      // 优先使用游标翻页，旧版服务端未返回游标时回退到页码
       const res = await fetchTimeline({
         q: filters.q,
         type: filters.type,
         tag: filters.tag,
-        page: nextPage,
+        ...(cursor ? { cursor } : { page: nextPage }),
       });
       set({
         items: [...items, ...(Array.isArray(res?.items) ? res.items : [])],
         page: nextPage,
+        cursor: res?.next_cursor || null,
         hasMore: !!res?.has_more,
         loading: false,
       });
@@ -177,4 +234,37 @@ export const useTimelineStore = create<TimelineState>((set, get) => ({
       }
     }
   },
+  syncChanges: async (version) => {
+    const { syncVersion, syncing } = get();
+    if (syncVersion === null || (version !== undefined && version <= syncVersion)) return;
+    if (syncing) {
+      // 正在拉取时到达的事件合并为拉取结束后的一次补拉
+      set({ syncPending: true });
+      return;
+    }
+    set({ syncing: true, syncPending: false });
+    try {
+      const res = await fetchChanges(syncVersion);
+      if (res.reset) {
+        // 日志已被压缩，增量无法衔接，整体重新加载
+        set({ syncing: false });
+        await get().init();
+        return;
+      }
+      const { items, mapItems, filters, hasMore, mapVersion } = get();
+      set({
+        items: applyToTimeline(items, res.changes, filters, hasMore),
+        mapItems: applyToMap(mapItems, res.changes, filters),
+        mapVersion: Math.max(mapVersion ?? 0, res.version),
+        syncVersion: res.version,
+        syncing: false,
+      });
+    } catch (e) {
+      console.warn("[syncChanges] Failed to fetch changes:", e);
+      set({ syncing: false });
+    }
+    if (get().syncPending) {
+      await get().syncChanges();
+    }
+  },
 }));